@@ -6,6 +6,10 @@ from django.utils.translation import gettext as _
 class FeaturemapConfig(AppConfig):
     name = 'featuremap'
 
+    def ready(self):
+        # connect the model signal handlers
+        from . import signals
+
 
 # some configuration-getters: one place for default app-specific settings
 
@@ -13,4 +17,79 @@ def get_site_name():
     return getattr(settings, 'SITE_NAME', _('PlaceDB Map'))
 
 def get_detail_url():
-    return getattr(settings, 'DETAIL_URL', 'detail/')
\ No newline at end of file
+    return getattr(settings, 'DETAIL_URL', 'detail/')
+
+def get_tile_max_age():
+    """ seconds for which browsers may cache map tiles """
+    return getattr(settings, 'TILE_MAX_AGE', 300)
+
+def get_cluster_max_zoom():
+    """ map data requests below this zoom level return clusters instead of individual places """
+    return getattr(settings, 'CLUSTER_MAX_ZOOM', 10)
+
+def get_cluster_cell_size():
+    """ width (in screen pixels) of the grid cells used for clustering """
+    return getattr(settings, 'CLUSTER_CELL_SIZE', 64)
+
+def get_map_data_engine():
+    """
+    how the map data is serialised: 'python' (Django ORM), 'stream' (Django ORM, streamed), 'sql' (built by PostgreSQL)
+    or 'features' (compact format built by PostgreSQL from the MapFeature table)
+    """
+    return getattr(settings, 'MAP_DATA_ENGINE', 'python')
+
+def get_map_data_chunk_size():
+    """ number of places fetched from the database at a time when streaming map data """
+    return getattr(settings, 'MAP_DATA_CHUNK_SIZE', 500)
+
+def get_sync_tile_zoom():
+    """ zoom level of the tiles which map clients use to keep track of loaded data """
+    return getattr(settings, 'SYNC_TILE_ZOOM', 10)
+
+def get_sync_token_margin():
+    """ seconds subtracted from sync tokens, longer than any transaction writing places takes to commit """
+    return getattr(settings, 'SYNC_TOKEN_MARGIN', 300)
+
+def get_map_cache_alias():
+    """ name of the cache (see CACHES) used for map data responses, or None to disable caching """
+    return getattr(settings, 'MAP_CACHE', None)
+
+def get_cache_tile_zoom():
+    """ zoom level of the smallest tiles used to invalidate cached map data """
+    return getattr(settings, 'CACHE_TILE_ZOOM', get_sync_tile_zoom())
+
+def get_icon_sprite_dir():
+    """ directory (relative to STATIC_ROOT) of the icon sprite atlas built by the build_icon_sprite command """
+    return getattr(settings, 'ICON_SPRITE_DIR', 'images/sprites/')
+
+def get_legend_max_age():
+    """ seconds for which browsers may use the language legend without revalidating it """
+    return getattr(settings, 'LEGEND_MAX_AGE', 3600)
+
+def get_async_views():
+    """ whether to use the async versions of the map views (see featuremap.async_views), for ASGI deployments """
+    return getattr(settings, 'ASYNC_VIEWS', False)
+
+def get_async_db_threads():
+    """ number of threads (and so database connections) used by the async views in each worker process """
+    return getattr(settings, 'ASYNC_DB_THREADS', 8)
+
+def get_server_timing():
+    """ whether to add a Server-Timing header with SQL, template and total times to each response """
+    return getattr(settings, 'SERVER_TIMING', True)
+
+def get_metrics_ips():
+    """ client addresses allowed to read /metrics without logging in as staff """
+    return getattr(settings, 'METRICS_IPS', ['127.0.0.1', '::1'])
+
+def get_import_engine():
+    """
+    how CSV files are imported: 'row' (each instance saved separately), 'bulk' (batches, see featuremap.bulk) or
+    'copy' (COPY to a staging table, see featuremap.copy_import) or 'parallel' (the bulk engine with worker processes,
+    see featuremap.parallel, for manage.py import_csv only)
+    """
+    return getattr(settings, 'IMPORT_ENGINE', 'row')
+
+def get_import_workers():
+    """ number of worker processes for the parallel import engine, None for one per CPU """
+    return getattr(settings, 'IMPORT_WORKERS', None)
@@ -0,0 +1,59 @@
+"""
+Async versions of the map views, for running under ASGI (see placesdb/asgi.py and the ASYNC_VIEWS setting).
+
+Under ASGI, Django 3.2 runs every sync view in one shared thread, so a slow bbox query holds up every other request.
+These views run the same code in a bounded pool of ASYNC_DB_THREADS threads instead, so that concurrent requests
+are served in parallel while the event loop only waits on them. Each pool thread keeps its own database
+connection, so the pool size also caps the number of connections used by each worker process.
+
+Django 3.2 has no async ORM (and psycopg2 no async interface), so the database work itself stays synchronous.
+"""
+
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+from django.http import HttpResponse
+import functools
+
+from .apps import get_async_db_threads
+from . import views
+
+_executor = None
+
+def get_db_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=get_async_db_threads(), thread_name_prefix='featuremap-db')
+    return _executor
+
+def _run_view(view, request, *args, **kwargs):
+    # the request_started/finished signals don't run in the pool threads, so tidy up connections here
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if response.streaming:
+            # ASGIHandler iterates streaming responses in the event loop, where the database can't be used
+            streamed = response
+            response = HttpResponse(b''.join(streamed.streaming_content))
+            for header, value in streamed.items():
+                response[header] = value
+            response.status_code = streamed.status_code
+            response.cookies = streamed.cookies
+        return response
+    finally:
+        close_old_connections()
+
+def async_view(view):
+    """ async version of a sync view (including its decorators), which runs it in the database thread pool """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        run = sync_to_async(_run_view, thread_sensitive=False, executor=get_db_executor())
+        return await run(view, request, *args, **kwargs)
+    return wrapper
+
+places_json = async_view(views.places_json)
+place_detail = async_view(views.place_detail)
+place_details = async_view(views.place_details)
+place_tile = async_view(views.place_tile)
+search_json = async_view(views.search_json)
+nearest_json = async_view(views.nearest_json)
@@ -0,0 +1,168 @@
+"""
+Benchmark suite for the map views and imports, run by "manage.py run_benchmarks" (see also generate_dataset).
+
+Each benchmark times the same requests against the current database and reports latency percentiles, so results
+saved as JSON from different commits (on the same data) can be compared.
+"""
+
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory
+import django
+import itertools
+import platform
+import random
+import subprocess
+import time
+
+from . import views
+from .models import Place, Word, Language, Source
+from .mappings import mappings
+from .files import IMPORT_ENGINES
+from .synthetic import WA_BBOX, mapping_rows, delete_source
+from .apps import get_map_data_engine
+
+import logging
+logger = logging.getLogger(__name__)
+
+# name, width of the viewport in degrees, zoom level
+VIEWPORTS = [
+    ('street', 0.02, 16),
+    ('town', 0.2, 13),
+    ('region', 2.0, 10),
+    ('state', 16.0, 6),
+]
+
+GROUPS = ('places_json', 'place_detail', 'search', 'import')
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else None
+
+def summarise(name, times, **extra):
+    """ latency statistics (in milliseconds) for a list of times in seconds """
+    ms = lambda t: round(t * 1000, 2)
+    return dict({
+        'name': name,
+        'runs': len(times),
+        'min_ms': ms(min(times)),
+        'p50_ms': ms(percentile(times, 0.5)),
+        'p95_ms': ms(percentile(times, 0.95)),
+        'max_ms': ms(max(times)),
+    }, **extra)
+
+def _response_size(response):
+    if response.streaming:
+        return len(b''.join(response.streaming_content))
+    return len(response.content)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def environment():
+    """ what the results depend on, to record with them """
+    return {
+        'commit': _git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'map_data_engine': get_map_data_engine(),
+        'places': Place.objects.count(),
+        'names': Word.objects.count(),
+        'languages': Language.objects.count(),
+    }
+
+class BenchmarkSuite:
+    def __init__(self, user, runs=20, import_rows=1000, seed=0, centre=None):
+        self.user = user
+        self.runs = runs
+        self.import_rows = import_rows
+        self.seed = seed
+        self.centre = centre or ((WA_BBOX[0] + WA_BBOX[2]) / 2, (WA_BBOX[1] + WA_BBOX[3]) / 2)
+        self.factory = RequestFactory()
+
+    def _request(self, path, params):
+        request = self.factory.get(path, params, HTTP_ACCEPT_ENCODING='gzip')
+        request.user = self.user
+        return request
+
+    def _time_view(self, view, make_request, **kwargs):
+        """ calls the view once to warm up, then self.runs times. Returns the times and last response size """
+        _response_size(view(make_request(0), **kwargs))
+        times = []
+        size = 0
+        for i in range(self.runs):
+            request = make_request(i)
+            start = time.perf_counter()
+            size = _response_size(view(request, **kwargs))
+            times.append(time.perf_counter() - start)
+        return times, size
+
+    def bench_places_json(self):
+        results = []
+        x, y = self.centre
+        for name, width, zoom in VIEWPORTS:
+            bbox = '%f,%f,%f,%f' % (x - width / 2, y - width / 2, x + width / 2, y + width / 2)
+            times, size = self._time_view(
+                views.places_json, lambda i: self._request('/data/', {'bbox': bbox, 'zoom': zoom}))
+            results.append(summarise('places_json:' + name, times, bbox=bbox, zoom=zoom, bytes=size))
+        return results
+
+    def bench_place_detail(self):
+        ids = list(Place.objects.order_by('pk').values_list('pk', flat=True))
+        if not ids:
+            return []
+        sample = random.Random(self.seed).sample(ids, min(self.runs + 1, len(ids)))
+        times = []
+        for i, pk in enumerate(sample):
+            start = time.perf_counter()
+            _response_size(views.place_detail(self._request('/detail/%d/' % pk, {}), place_id=pk))
+            if i:
+                # the first is a warm up
+                times.append(time.perf_counter() - start)
+        return [summarise('place_detail', times)] if times else []
+
+    def bench_search(self):
+        names = list(Word.objects.order_by('pk').values_list('name', flat=True)[:1000])
+        if not names:
+            return []
+        rng = random.Random(self.seed)
+        queries = [name[:rng.randint(3, max(3, len(name)))] for name in rng.choices(names, k=self.runs + 1)]
+        times, size = self._time_view(views.search_json, lambda i: self._request('/search/', {'q': queries[i]}))
+        return [summarise('search', times, bytes=size)]
+
+    def bench_import(self):
+        """
+        times bulk_ingest of synthetic rows with each import engine for each column mapping, into a source which is
+        then deleted
+        """
+        results = []
+        for (name, colmap), engine in itertools.product(mappings.items(), IMPORT_ENGINES):
+            rows = mapping_rows(colmap, self.import_rows, random.Random(self.seed))
+            source = Source.objects.create(name='benchmark: %s' % name, pending_import=False)
+            result = {'name': 'import:%s:%s' % (engine, name), 'rows': len(rows)}
+            try:
+                start = time.perf_counter()
+                count, new, updated = IMPORT_ENGINES[engine](colmap).bulk_ingest(rows, source)
+                elapsed = time.perf_counter() - start
+                result.update(seconds=round(elapsed, 3), rows_per_second=round(count / elapsed, 1), new=new,
+                              updated=updated)
+            except Exception as e:
+                logger.exception('import benchmark failed for %s' % name)
+                result['error'] = '%s: %s' % (type(e).__name__, e)
+            finally:
+                delete_source(source)
+            results.append(result)
+        return results
+
+    def run(self, groups=GROUPS):
+        results = []
+        for group in groups:
+            logger.info('running %s benchmarks' % group)
+            results += getattr(self, 'bench_' + group)()
+        return results
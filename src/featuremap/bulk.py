@@ -0,0 +1,308 @@
+"""
+Set-based import engine: a Dataset which imports rows in batches, with a few queries per batch instead of several
+per row.
+
+Each batch of rows is first mapped through the column map without touching the database, in the same way as
+Dataset.ingest_row. Then, for each model in dependency order (languages, places, then names), the records of the whole
+batch are matched to existing rows with one query on (source, source_ref), new instances are written with
+bulk_create and changed ones with bulk_update, and foreign keys are assigned in memory. Languages are found by name
+or alternative name in an index loaded once per import.
+
+The new/updated counts are the same as those of Dataset.bulk_ingest. Unlike the row engine, existing languages are
+not saved again when they are used (which changed nothing, but refreshed the map data for every place in the
+language each time).
+"""
+
+from django.db import transaction
+from django.db.models import Q
+from django.forms.models import model_to_dict
+from django.utils import timezone
+import itertools
+
+from featuremap import models
+from featuremap.dataset import (Dataset, ValueBase, JsonPassthru, FilteredField, Relation, ChildRelation,
+                                ParentRelation, LanguageRelation)
+from featuremap.versions import bump_version, deferred_bumps
+from featuremap.cache import invalidate_all
+from featuremap.languages import LanguageIndex, invalidate_language_index
+from featuremap.features import refresh_map_features
+from featuremap.signals import removed_places
+
+import logging
+logger = logging.getLogger(__name__)
+
+def batches(rows, batch_size):
+    """ splits an iterable of rows into lists of batch_size rows """
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+class Record:
+    """ the values for one model instance from one row, and the records of its child relations """
+    def __init__(self, model, level, values, fields_unique, dependents):
+        self.model = model
+        self.level = level
+        self.values = values
+        self.fields_unique = fields_unique
+        self.dependents = dependents
+        self.instance = None
+        self.created = False
+        # (foreign key field, parent Record) for records of a child relation
+        self.parent = None
+
+class BulkDataset(Dataset):
+    """ imports rows in batches with bulk_create/bulk_update, see the module docstring """
+    def __init__(self, model_map, dry_run=False):
+        super().__init__(model_map, dry_run=dry_run)
+        self.languages = None
+        self.new_languages = False
+        self._updated_pks = {}
+        # values of the FilteredFields of the column map for each row of the current batch, see ingest_batch
+        self.calculated = {}
+
+    def filtered_fields(self, level):
+        for fmap in level.values():
+            if isinstance(fmap, FilteredField):
+                yield fmap
+            elif isinstance(fmap, Relation):
+                yield from self.filtered_fields(fmap)
+
+    def plan_layer(self, model, level, row, row_index, source, source_ref):
+        """ maps a row to Records for model, as Dataset.ingest_row does for model instances """
+        return_multiple = 1
+        values = {}
+        fields_unique = []
+        dependents = {}
+
+        for field, fmap in level.items():
+            val = None
+            if isinstance(fmap, (ValueBase, JsonPassthru)):
+                val = fmap.resolve(row, row_index)
+                if fmap.unique:
+                    fields_unique.append(field)
+            elif isinstance(fmap, FilteredField):
+                val = self.calculated[id(fmap)][row_index]
+            elif isinstance(fmap, ChildRelation):
+                dependents[field] = self.plan_layer(fmap.get_related_model(model, field), fmap, row, row_index,
+                                                    source, source_ref)
+            elif isinstance(fmap, ParentRelation):
+                val = self.plan_layer(fmap.get_related_model(model, field), fmap, row, row_index, source, source_ref)
+
+            if isinstance(val, list):
+                return_multiple = max(return_multiple, len(val))
+            if not val is None:
+                values[field] = val
+
+        if hasattr(model, 'source') and hasattr(model, 'source_ref'):
+            values.setdefault('source', source)
+            values.setdefault('source_ref', source_ref)
+
+        records = []
+        for i in range(return_multiple):
+            record = {}
+            for field, val in values.items():
+                if isinstance(val, list):
+                    if len(val) == return_multiple:
+                        record[field] = val[i]
+                    elif val and isinstance(val[0], Record):
+                        record[field] = val[0]
+                    else:
+                        record[field] = ", ".join(val)
+                else:
+                    record[field] = val
+            my_ref = record.get('source_ref', None)
+            if my_ref:
+                record['source_ref'] = str(my_ref) + "_" + str(i)
+            records.append(Record(model, level, record, fields_unique, dependents))
+        return records
+
+    def _existing_by_ref(self, model, records, source):
+        """ loads the existing instances from source with the source_refs of records, by source_ref """
+        refs = {r.values.get('source_ref') for r in records}
+        query = Q(source_ref__in=[ref for ref in refs if ref is not None])
+        if None in refs:
+            query |= Q(source_ref__isnull=True)
+        # related objects compared by update_fields
+        related = [f.name for f in model._meta.concrete_fields
+                        if f.is_relation and any(f.name in r.values for r in records)]
+        existing = {}
+        for inst in model._base_manager.filter(query, source=source).select_related(*related):
+            existing.setdefault(inst.source_ref, []).append(inst)
+        return existing
+
+    def _match(self, records, source, try_update, pending):
+        """ sets the instance of each record: an existing (updated) instance, or a new one """
+        model, level = records[0].model, records[0].level
+        existing = {}
+        if try_update and level.mode == Relation.SOURCE_UPDATE:
+            existing = self._existing_by_ref(model, records, source)
+
+        found = {}
+        for r in records:
+            inst = None
+            if isinstance(level, LanguageRelation):
+                inst = self.languages.find(r.values)
+            elif level.mode == Relation.FIND_EXISTING:
+                key = tuple((f, r.values.get(f)) for f in r.fields_unique)
+                if key not in found:
+                    found[key] = list(level.find_model_instance(r.fields_unique, r.values, model))
+                matches = found[key]
+                inst = matches[0] if len(matches) == 1 else None
+            elif try_update:
+                ref = r.values.get('source_ref')
+                matches = [pending[ref]] if ref in pending else existing.get(ref, [])
+                if len(matches) == 1:
+                    inst = matches[0]
+                    inst.update_fields(r.values)
+                elif len(matches) > 1:
+                    # multiple matching instances: replace them with the new one, keeping them in its metadata
+                    old_rows = []
+                    for m in matches:
+                        if not self.dry_run:
+                            m.delete()
+                        old_rows.append(model_to_dict(m))
+                    existing[ref] = []
+                    r.values.setdefault('metadata', {})['old_rows'] = old_rows
+
+            if inst is None:
+                inst = model(**r.values)
+                r.created = True
+                if isinstance(level, LanguageRelation):
+                    self.languages.add(inst)
+                    self.new_languages = True
+                elif level.mode == Relation.SOURCE_UPDATE:
+                    pending[r.values.get('source_ref')] = inst
+            r.instance = inst
+
+    def _write(self, records, extra_fields=()):
+        """ saves the new and changed instances of records (all of the same model) """
+        model, level = records[0].model, records[0].level
+        new = {}
+        changed = {}
+        fields = set(extra_fields)
+        for r in records:
+            if r.instance._state.adding:
+                new[id(r.instance)] = r.instance
+            elif level.mode == Relation.SOURCE_UPDATE or extra_fields:
+                changed[id(r.instance)] = r.instance
+                fields.update(r.values)
+
+        if self.dry_run:
+            return
+        if new:
+            model._base_manager.bulk_create(new.values(), batch_size=500)
+        if changed:
+            now = timezone.now()
+            names = {f.name for f in model._meta.concrete_fields if not f.primary_key}
+            for inst in changed.values():
+                if hasattr(inst, 'updated'):
+                    inst.updated = now
+            fields = [f for f in fields | {'metadata', 'updated'} if f in names]
+            model._base_manager.bulk_update(changed.values(), fields, batch_size=500)
+            if model is models.Place:
+                # as recorded by signals.place_saved, for synchronised map clients
+                models.DeletedPlace.objects.bulk_create(removed_places(changed.values()))
+
+    def _count(self, records):
+        for r in records:
+            if r.created:
+                self.new_instances.setdefault(r.model, []).append(r.instance)
+            else:
+                # counted once per object, like Dataset.ingest_instance
+                seen = self._updated_pks.setdefault(r.model, set())
+                if r.instance.pk not in seen:
+                    seen.add(r.instance.pk)
+                    self.updated_instances.setdefault(r.model, []).append(r.instance)
+
+    def save_layer(self, records, source, try_update):
+        """ matches and saves records of one model and column map: parent records first, then children """
+        level = records[0].level
+        for field, fmap in level.items():
+            if isinstance(fmap, ParentRelation):
+                parents = [r.values[field] for r in records if isinstance(r.values.get(field), Record)]
+                if parents:
+                    self.save_layer(parents, source, try_update)
+                for r in records:
+                    if isinstance(r.values.get(field), Record):
+                        r.values[field] = r.values[field].instance
+
+        self._match(records, source, try_update, pending={})
+        # foreign keys to parent instances (of child relations) are assigned in memory
+        fk_fields = set()
+        for r in records:
+            if r.parent:
+                fk, parent = r.parent
+                setattr(r.instance, fk, parent.instance)
+                fk_fields.add(fk)
+        self._write(records, extra_fields=fk_fields)
+        self._count(records)
+
+        for field, fmap in level.items():
+            if isinstance(fmap, ChildRelation):
+                fk = records[0].model._meta.get_field(field).field.name
+                children = {}
+                for r in records:
+                    for child in r.dependents.get(field, []):
+                        # as with RelatedManager.add(), the last parent a child is added to wins
+                        child.parent = (fk, r)
+                        children[id(child)] = child
+                if children:
+                    self.save_layer(list(children.values()), source, try_update)
+
+    def plan_batch(self, rows, start_index, source):
+        """ maps a batch of rows to Records, without any queries """
+        # eg. the coordinates of the whole batch are transformed at once (see LocationFilter.calculate_batch)
+        self.calculated = {
+            id(fmap): dict(zip(range(start_index, start_index + len(rows)), fmap.calculate_batch(rows)))
+                for fmap in self.filtered_fields(self.colmap)
+        }
+        records = []
+        for i, row in enumerate(rows):
+            source_ref = self.colmap['source_ref'].resolve(row, start_index + i)
+            records += self.plan_layer(self.model, self.colmap, row, start_index + i, source, source_ref)
+        return records
+
+    def planned_batches(self, rows, source, batch_size):
+        """ yields the number of rows and the Records of each batch of rows, in order """
+        count = 0
+        for batch in batches(rows, batch_size):
+            yield len(batch), self.plan_batch(batch, count, source)
+            count += len(batch)
+
+    def ingest_batch(self, rows, start_index, source, try_update=True):
+        """ maps and saves a batch of rows """
+        records = self.plan_batch(rows, start_index, source)
+        if records:
+            self.save_layer(records, source, try_update)
+
+    def bulk_ingest(self, rows, source, batch_size=1000, allow_update=True):
+        """ same as Dataset.bulk_ingest, with each batch of rows written using bulk queries """
+        if isinstance(source, str):
+            source = models.Source.objects.get_or_create(name=source)[0]
+
+        if source._state.adding:
+            source.save()
+            allow_update = False
+
+        self.languages = LanguageIndex()
+        count = 0
+        with deferred_bumps():
+            for num_rows, records in self.planned_batches(rows, source, batch_size):
+                if records:
+                    with transaction.atomic():
+                        self.save_layer(records, source, allow_update)
+                count += num_rows
+                logger.debug('imported %d rows' % count)
+            bump_version()
+            if self.new_languages:
+                invalidate_language_index()
+        refresh_map_features(source_id=source.pk)
+        invalidate_all()
+
+        s = lambda insts: ", ".join("%s (%d)" % (m.__name__, len(l)) for m, l in insts.items())
+        logger.info("Imported instances: new=[%s], updated [%s]" % (s(self.new_instances), s(self.updated_instances)))
+        cnt = lambda insts: {m._meta.object_name: len(l) for m, l in insts.items()}
+        return count, cnt(self.new_instances), cnt(self.updated_instances)
@@ -0,0 +1,168 @@
+"""
+Cache for map data responses, keyed by tile region and visibility class.
+
+Responses are stored gzip-compressed in the cache named by the MAP_CACHE setting. A file based cache with
+MAX_ENTRIES gives a bounded cache shared by the worker processes without any extra services.
+
+Each cached entry records a generation token for every tile it covers, using the largest tiles (up to zoom level
+CACHE_TILE_ZOOM) that keep the number of tiles small. When a place changes, only the generation tokens of the
+tiles covering its location are replaced, which invalidates the affected entries and leaves the rest of the cache
+alone. Tokens are replaced once the transaction which changed the place commits: a request in between would read
+the old data, and store it with the new tokens.
+
+Invalidation only reaches other worker processes through a shared cache. Entries in a local memory cache also record
+the global data version (see versions.py), and are only used while it is unchanged, so that changes made through
+other processes are seen (at the cost of one query per request, and of any change invalidating every entry).
+"""
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+import gzip
+import math
+import uuid
+
+from .apps import get_map_cache_alias, get_cache_tile_zoom
+from .tiles import tile_bounds
+from .versions import get_version
+
+import logging
+logger = logging.getLogger(__name__)
+
+# maximum number of tiles indexed for one cached entry or invalidated for one change
+MAX_INDEX_TILES = 64
+
+# replaced to invalidate the whole cache
+GLOBAL_GEN_KEY = 'gen:all'
+
+# web mercator latitude limit
+MAX_LAT = 85.0511
+
+def get_cache():
+    """ returns the configured map data cache, or None if caching is disabled """
+    alias = get_map_cache_alias()
+    return caches[alias] if alias else None
+
+def _new_token():
+    return uuid.uuid4().hex
+
+def lnglat_to_tile(lng, lat, z):
+    n = 2 ** z
+    lat = math.radians(max(min(lat, MAX_LAT), -MAX_LAT))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tile_range(bbox, z):
+    """ returns (x0, y0, x1, y1), the range of tiles at zoom z covering bbox (west, south, east, north) """
+    x0, y0 = lnglat_to_tile(bbox[0], bbox[3], z)
+    x1, y1 = lnglat_to_tile(bbox[2], bbox[1], z)
+    return x0, y0, x1, y1
+
+def _num_tiles(x0, y0, x1, y1):
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+def _gen_keys(z, x0, y0, x1, y1):
+    return [
+        'gen:%d/%d/%d' % (z, x, y)
+            for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+    ] + [GLOBAL_GEN_KEY]
+
+class CachedRegion:
+    """ a cache entry covering the range of tiles x0..x1, y0..y1 at zoom z """
+    def __init__(self, key, z, x0, y0, x1, y1):
+        self.cache = get_cache()
+        self.key = key
+        self.z = z
+        self.range = (x0, y0, x1, y1)
+        self.gens = None
+        # the data version, for a cache which isn't shared between processes
+        self.version = None
+
+    @classmethod
+    def for_bbox(cls, key, bbox):
+        """ cache entry for a bounding box, which is expanded to the edges of the tiles which cover it """
+        z = get_cache_tile_zoom()
+        while z > 0 and _num_tiles(*tile_range(bbox, z)) > MAX_INDEX_TILES:
+            z -= 1
+        x0, y0, x1, y1 = tile_range(bbox, z)
+        return cls('%s:%d/%d-%d/%d-%d' % (key, z, x0, x1, y0, y1), z, x0, y0, x1, y1)
+
+    @classmethod
+    def for_tile(cls, key, z, x, y):
+        """ cache entry for a single tile, indexed by its parent tile if z is larger than CACHE_TILE_ZOOM """
+        index_z = min(z, get_cache_tile_zoom())
+        ix, iy = x >> (z - index_z), y >> (z - index_z)
+        return cls('%s:%d/%d/%d' % (key, z, x, y), index_z, ix, iy, ix, iy)
+
+    @property
+    def bbox(self):
+        x0, y0, x1, y1 = self.range
+        west, _, _, north = tile_bounds(self.z, x0, y0)
+        _, south, east, _ = tile_bounds(self.z, x1, y1)
+        return (west, south, east, north)
+
+    def get(self):
+        """
+        Returns the cached (gzipped) body, or None if there is no valid entry.
+        The current generation tokens are remembered for set(), so that changes made while the response is being
+        generated invalidate it.
+        """
+        keys = _gen_keys(self.z, *self.range)
+        gens = self.cache.get_many(keys)
+        missing = {k: _new_token() for k in keys if k not in gens}
+        for k, token in missing.items():
+            # keep any token set by a concurrent request
+            if not self.cache.add(k, token, timeout=None):
+                token = self.cache.get(k, token)
+            gens[k] = token
+        self.gens = gens
+        if isinstance(self.cache, LocMemCache):
+            self.version = get_version()
+
+        if missing:
+            # entries are only valid while all their generation tokens are still in the cache
+            return None
+        entry = self.cache.get(self.key)
+        if entry and entry['gens'] == gens and entry.get('version') == self.version:
+            logger.debug('map cache hit: %s' % self.key)
+            return entry['body']
+        return None
+
+    def set(self, content):
+        """ compress and store the response content, returns the compressed body """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        body = gzip.compress(content)
+        if self.gens is not None:
+            self.cache.set(self.key, {'gens': self.gens, 'version': self.version, 'body': body}, timeout=None)
+        return body
+
+def invalidate_bbox(bbox):
+    """ invalidate cached entries covering bbox (west, south, east, north), once the current transaction commits """
+    if get_cache() is not None:
+        transaction.on_commit(lambda: _invalidate_bbox(bbox))
+
+def _invalidate_bbox(bbox):
+    cache = get_cache()
+    tokens = {}
+    for z in range(get_cache_tile_zoom() + 1):
+        r = tile_range(bbox, z)
+        if _num_tiles(*r) > MAX_INDEX_TILES:
+            # too big to invalidate tile by tile
+            _invalidate_all()
+            return
+        tokens.update({k: _new_token() for k in _gen_keys(z, *r)[:-1]})
+    cache.set_many(tokens, timeout=None)
+
+def invalidate_geometry(geom):
+    if geom is not None:
+        invalidate_bbox(geom.extent)
+
+def invalidate_all():
+    """ invalidate every cached entry, once the current transaction commits """
+    if get_cache() is not None:
+        transaction.on_commit(_invalidate_all)
+
+def _invalidate_all():
+    get_cache().set(GLOBAL_GEN_KEY, _new_token(), timeout=None)
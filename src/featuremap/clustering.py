@@ -0,0 +1,76 @@
+"""
+Server-side clustering of places for low zoom levels.
+
+Places are snapped to a grid sized according to the map zoom (ST_SnapToGrid), so the number of features
+returned for a viewport is bounded by the number of grid cells rather than the number of places.
+"""
+
+from django.db import connection
+import geojson
+
+from .models import Place, Word
+from . import lod
+
+import logging
+logger = logging.getLogger(__name__)
+
+# width (in pixels) of a standard web map tile
+TILE_SIZE = 256
+
+# number of representative names returned with each cluster
+CLUSTER_NUM_NAMES = 3
+
+CLUSTER_SQL = """
+SELECT
+    count(*) AS num_places,
+    ST_AsGeoJSON(ST_Centroid(ST_Collect(ST_Centroid(p.location::geometry))), {precision}) AS geom,
+    (array_agg(w.name ORDER BY p.id) FILTER (WHERE w.name IS NOT NULL))[1:%s] AS names,
+    array_agg(DISTINCT w.language_id) FILTER (WHERE w.language_id IS NOT NULL) AS lang_ids,
+    min(p.id) AS first_id
+FROM {place} p
+LEFT JOIN LATERAL (
+    SELECT name, language_id FROM {word} WHERE place_id = p.id ORDER BY id LIMIT 1
+) w ON true
+WHERE p.id IN ({subquery})
+GROUP BY ST_SnapToGrid(ST_Centroid(p.location::geometry), %s)
+"""
+
+def get_grid_size(zoom, cell_size):
+    """ size (in degrees) of a grid cell which is cell_size pixels wide at the given zoom level """
+    return 360.0 / (2 ** zoom) * cell_size / TILE_SIZE
+
+def cluster_places(places, zoom, cell_size):
+    """
+    Aggregate a queryset of places into grid clusters for the given zoom level.
+    Returns a tuple of (list of geojson Features, set of language ids).
+    """
+    subquery, sub_params = places.values('pk').query.sql_with_params()
+    sql = CLUSTER_SQL.format(
+        place = Place._meta.db_table,
+        word = Word._meta.db_table,
+        subquery = subquery,
+        precision = lod.get_precision(zoom),
+    )
+    # parameters in order of appearance: names slice, subquery, grid size
+    params = (CLUSTER_NUM_NAMES, ) + tuple(sub_params) + (get_grid_size(zoom, cell_size), )
+
+    features = []
+    lang_ids = set()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for num_places, geom, names, langs, first_id in cursor.fetchall():
+            langs = langs or []
+            lang_ids.update(langs)
+            features.append(geojson.Feature(
+                geometry = geojson.loads(geom),
+                properties = {
+                    'id': 'cluster-%d-%d' % (zoom, first_id),
+                    'cluster': True,
+                    'count': num_places,
+                    'names': names or [],
+                    'langs': langs,
+                },
+            ))
+
+    logger.debug('zoom=%d: %d clusters' % (zoom, len(features)))
+    return features, lang_ids
@@ -0,0 +1,539 @@
+"""
+COPY-based import engine, for CSV files with millions of rows.
+
+The raw CSV is streamed into an unlogged staging table with COPY FROM STDIN, then the column map is applied with
+set-based SQL: field values and coordinates (ST_Transform for LocationFilter) are computed for every row at once,
+names are matched to languages with a join, and places and names are written with INSERT ... SELECT and
+UPDATE ... FROM, matched to previously imported rows on (source, source_ref). The whole import is one transaction.
+
+Column maps with a base model, fields of the base model and child relations (eg. Place.names) whose names can have a
+LanguageRelation are supported; CopyDataset raises ValueError for anything else (use the 'bulk' engine for those).
+
+Place and name counts are by object, as for the other engines. Compared with the row engine: rows whose coordinates
+can't be parsed get no location (the same), rows with the same source_ref are merged with the last row winning,
+and previously imported duplicates of a source_ref are not deleted (the one with the lowest id is updated).
+"""
+
+from django.db import connection, transaction
+from django.contrib.gis.db.models import GeometryField
+from django.utils import timezone
+from datetime import datetime
+import csv
+import io
+import uuid
+
+from featuremap import models
+from featuremap.dataset import (Dataset, RawField, ConcatRawField, ValueLiteral, RowNumber, JsonPassthru,
+                                LocationFilter, ChildRelation, LanguageRelation)
+from featuremap.versions import bump_version, deferred_bumps
+from featuremap.cache import invalidate_all
+from featuremap.languages import invalidate_language_index
+from featuremap.features import refresh_map_features
+
+import logging
+logger = logging.getLogger(__name__)
+
+# functions which return NULL instead of failing for bad coordinates, like LocationFilter.calculate
+FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION pg_temp.featuremap_geom_from_text(wkt text, srid integer) RETURNS geometry AS $$
+BEGIN
+    IF COALESCE(wkt, '') = '' THEN
+        RETURN NULL;
+    END IF;
+    RETURN ST_Transform(ST_GeomFromText(wkt, srid), 4326);
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END $$ LANGUAGE plpgsql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION pg_temp.featuremap_point(x text, y text, srid integer) RETURNS geometry AS $$
+BEGIN
+    IF COALESCE(x, '') = '' OR COALESCE(y, '') = '' THEN
+        RETURN NULL;
+    END IF;
+    RETURN ST_Transform(ST_SetSRID(ST_MakePoint(x::float8, y::float8), srid), 4326);
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END $$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+# ids of previously imported objects, by source_ref
+MATCH_SQL = """
+UPDATE {rows} r SET id = m.id FROM (
+    SELECT source_ref, min(id) AS id FROM {table} WHERE source_id = %s AND source_ref IS NOT NULL GROUP BY source_ref
+) m
+WHERE r.source_ref = m.source_ref
+"""
+
+# new ids for the remaining objects: one per source_ref, or per row if there is no source_ref
+NEW_IDS_SQL = """
+UPDATE {rows} r SET id = n.id, is_new = true FROM (
+    SELECT source_ref, nextval(%s) AS id FROM (
+        SELECT DISTINCT source_ref FROM {rows} WHERE id IS NULL AND source_ref IS NOT NULL
+    ) d
+) n
+WHERE r.id IS NULL AND r.source_ref = n.source_ref;
+UPDATE {rows} SET id = nextval(%s), is_new = true WHERE id IS NULL;
+"""
+
+INSERT_SQL = """
+INSERT INTO {table} ({columns})
+SELECT {values} FROM (
+    SELECT DISTINCT ON (id) * FROM {rows} WHERE is_new ORDER BY id, row_num DESC
+) r
+"""
+
+UPDATE_SQL = """
+UPDATE {table} t SET {assignments} FROM (
+    SELECT DISTINCT ON (id) * FROM {rows} WHERE NOT is_new ORDER BY id, row_num DESC
+) r
+WHERE t.id = r.id
+"""
+
+# previous locations of places which are moved or hidden, for synchronised map clients (as signals.place_saved)
+REMOVED_PLACES_SQL = """
+INSERT INTO {deleted} (place_id, location, is_public, deleted)
+SELECT t.id, t.location, t.is_public, %s FROM {table} t JOIN (
+    SELECT DISTINCT ON (id) * FROM {rows} WHERE NOT is_new ORDER BY id, row_num DESC
+) r ON t.id = r.id
+WHERE t.location IS NOT NULL AND ({removed})
+"""
+
+# objects updated by more than one row, and new objects written by more than one row (which the row engine counts
+# as updated again)
+COUNTS_SQL = """
+SELECT
+    count(DISTINCT id) FILTER (WHERE is_new),
+    count(DISTINCT id) FILTER (WHERE NOT is_new),
+    (SELECT count(*) FROM (SELECT id FROM {rows} WHERE is_new GROUP BY id HAVING count(*) > 1) d)
+FROM {rows}
+"""
+
+MATCH_LANGUAGES_SQL = """
+UPDATE {words} w SET language_id = l.id FROM (
+    SELECT DISTINCT ON (name) name, id FROM {language} ORDER BY name, id
+) l
+WHERE w.language_id IS NULL AND l.name = w.lang_name::citext;
+
+UPDATE {words} w SET language_id = l.id FROM (
+    SELECT DISTINCT ON (alt_name) alt_name, id FROM {language}, unnest(alt_names) alt_name ORDER BY alt_name, id
+) l
+WHERE w.language_id IS NULL AND l.alt_name = w.lang_name::citext;
+"""
+
+NEW_LANGUAGES_SQL = """
+SELECT DISTINCT ON (lower(lang_name)) lang_name, source_ref FROM {words}
+WHERE language_id IS NULL ORDER BY lower(lang_name), row_num, source_ref
+"""
+
+LANGUAGE_COUNTS_SQL = """
+SELECT
+    (SELECT count(DISTINCT language_id) FROM {words} WHERE NOT (language_id = ANY(%s))),
+    (SELECT count(*) FROM (
+        SELECT language_id FROM {words} WHERE language_id = ANY(%s) GROUP BY language_id HAVING count(*) > 1
+    ) d)
+"""
+
+class LineStream:
+    """ file-like object reading from an iterable of lines, for cursor.copy_expert() """
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def _dict_rows_to_lines(rows):
+    """ CSV lines (with a header) for an iterable of dicts, eg. from csv.DictReader """
+    buffer = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+class SqlBuilder:
+    """ SQL expressions for column map values, reading from the staging table columns (aliased s) """
+    def __init__(self, header):
+        # as for csv.DictReader, the last of any repeated column names is used
+        self.columns = {name: 'c%d' % i for i, name in enumerate(header)}
+
+    def column(self, name):
+        if name in self.columns:
+            return 's.%s' % self.columns[name], []
+        return 'NULL::text', []
+
+    def value(self, fmap, split_value=None):
+        """ text SQL expression and params for a column map value """
+        if isinstance(fmap, ConcatRawField):
+            parts, params = [], []
+            for label, name in fmap.value:
+                col, _ = self.column(name)
+                if label:
+                    parts.append("%%s || COALESCE(%s, '')" % col)
+                    params.append(label + fmap.label_suffix)
+                else:
+                    parts.append(col)
+            return "NULLIF(concat_ws(%%s, %s), '')" % ', '.join(parts), [fmap.separator] + params
+        if isinstance(fmap, RawField):
+            sql, params = self.column(fmap.value)
+            if split_value is not None:
+                sql = split_value
+            sql = "NULLIF(%s, '')" % sql
+            if fmap.default is not None:
+                sql, params = 'COALESCE(%s, %%s)' % sql, params + [str(fmap.default)]
+            return sql, params
+        if isinstance(fmap, ValueLiteral):
+            return '%s::text', [fmap.value]
+        if isinstance(fmap, RowNumber):
+            return '(s.row_num - 1)::text', []
+        raise ValueError('unsupported column map value: %s' % type(fmap).__name__)
+
+    def json(self, fmap):
+        parts = []
+        params = []
+        for name in fmap:
+            parts.append('%%s, %s' % self.column(name)[0])
+            params.append(name)
+        return 'jsonb_build_object(%s)' % ', '.join(parts), params
+
+    def location(self, fmap):
+        srid = int(fmap.srid)
+        if fmap.mode == LocationFilter.WKT:
+            return 'pg_temp.featuremap_geom_from_text(%s, %%s)' % self.column(fmap.wkt_field)[0], [srid]
+        if fmap.mode == LocationFilter.LAT_LNG:
+            x, y = fmap.lng_field, fmap.lat_field
+        else:
+            # the same (x, y) order as LocationFilter.calculate
+            x, y = fmap.north_field, fmap.east_field
+        return 'pg_temp.featuremap_point(%s, %s, %%s)' % (self.column(x)[0], self.column(y)[0]), [srid]
+
+    def field(self, model, field_name, fmap, split_value=None):
+        """ expression for a model field, cast to the type of its column """
+        field = model._meta.get_field(field_name)
+        if isinstance(fmap, JsonPassthru):
+            sql, params = self.json(fmap)
+        elif isinstance(fmap, LocationFilter):
+            sql, params = self.location(fmap)
+        else:
+            sql, params = self.value(fmap, split_value)
+        return 'CAST(%s AS %s)' % (sql, field.db_type(connection)), params
+
+class Layer:
+    """ the fields of one model in a column map, checked for what the copy engine supports """
+    def __init__(self, model, level, is_base):
+        self.model = model
+        self.level = level
+        self.fields = {}
+        self.children = []
+        self.language = None
+        self.split = None
+
+        for field, fmap in level.items():
+            if field == 'source_ref':
+                continue
+            if isinstance(fmap, ChildRelation):
+                if not is_base:
+                    raise ValueError('the copy import engine only supports one level of child relations')
+                self.children.append((field, Layer(fmap.get_related_model(model, field), fmap, is_base=False)))
+            elif isinstance(fmap, LanguageRelation):
+                if is_base or set(fmap) - {'name'}:
+                    raise ValueError('the copy import engine only supports language names of child relations')
+                self.language = (field, fmap.get('name'))
+                self._check_split(field, fmap.get('name'))
+            elif isinstance(fmap, (RawField, ValueLiteral, RowNumber, JsonPassthru, LocationFilter)):
+                model._meta.get_field(field)
+                self.fields[field] = fmap
+                self._check_split(field, fmap)
+            else:
+                raise ValueError('the copy import engine does not support %s (%s)' % (type(fmap).__name__, field))
+        if is_base and self.split:
+            raise ValueError('the copy import engine does not support multiple values (separator) for base models')
+
+    def _check_split(self, field, fmap):
+        if isinstance(fmap, RawField) and not isinstance(fmap, ConcatRawField) and fmap.separator:
+            if self.split:
+                raise ValueError('the copy import engine supports one field with a separator for each model')
+            self.split = (field, fmap)
+
+
+def _defaults(model, provided, source, now):
+    """ columns and params for the fields of model which don't come from the column map """
+    columns, params = [], []
+    for field in model._meta.concrete_fields:
+        if field.primary_key or field.name in provided:
+            continue
+        if field.name == 'source':
+            value = source.pk
+        elif getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            value = now
+        else:
+            value = field.get_db_prep_save(field.get_default(), connection)
+        columns.append(field.column)
+        params.append(value)
+    return columns, params
+
+def _changes(model, fields):
+    """
+    SQL for a jsonb object of the old values of the fields which a row changes (as recorded in the archive by
+    BaseItemModel.update_fields), and its params. fields is {field name: column of the rows table}
+    """
+    parts, params = [], []
+    for name, col in fields.items():
+        field = model._meta.get_field(name)
+        old = 't.%s' % _quote(field.column)
+        if isinstance(field, GeometryField):
+            differs, old_text = 'ST_AsBinary(%s) IS DISTINCT FROM ST_AsBinary(%s)' % (col, old), 'ST_AsEWKT(%s)' % old
+        else:
+            differs, old_text = '%s IS DISTINCT FROM %s' % (col, old), '%s::text' % old
+        parts.append('%%s, CASE WHEN %s IS NOT NULL AND %s THEN %s END' % (col, differs, old_text))
+        params.append(name)
+    if not parts:
+        return "'{}'::jsonb", []
+    return 'jsonb_strip_nulls(jsonb_build_object(%s))' % ', '.join(parts), params
+
+class CopyDataset(Dataset):
+    """ imports CSV files with COPY and set-based SQL, see the module docstring """
+    PLACES = 'featuremap_import_places'
+    WORDS = 'featuremap_import_words'
+
+    def __init__(self, model_map, dry_run=False):
+        super().__init__(model_map, dry_run=dry_run)
+        self.layer = Layer(self.model, model_map, is_base=True)
+        self.new_counts = {}
+        self.updated_counts = {}
+
+    def _copy(self, cursor, lines):
+        """ creates the staging table and copies the CSV lines into it, returns its name and a SqlBuilder """
+        lines = iter(lines)
+        header = next(csv.reader([next(lines, '')]), [])
+        if not header:
+            raise ValueError('the CSV file is empty')
+        staging = 'featuremap_import_%s' % uuid.uuid4().hex
+        columns = ['c%d' % i for i in range(len(header))]
+        cursor.execute('CREATE UNLOGGED TABLE %s (row_num bigserial, %s)' % (
+            staging, ', '.join('%s text' % c for c in columns)))
+        cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (staging, ', '.join(columns)),
+                           LineStream(lines))
+        return staging, SqlBuilder(header)
+
+    def _base_rows(self, cursor, builder, staging):
+        """ the base model values of each row, in the temporary table PLACES """
+        ref_sql, ref_params = builder.value(self.colmap['source_ref'])
+        selects, params = [], []
+        for field, fmap in self.layer.fields.items():
+            sql, p = builder.field(self.model, field, fmap)
+            selects.append(', %s AS f_%s' % (sql, field))
+            params += p
+        cursor.execute('DROP TABLE IF EXISTS %s' % self.PLACES)
+        cursor.execute("""
+            CREATE TEMPORARY TABLE {rows} ON COMMIT DROP AS
+            SELECT s.row_num, {ref} AS ref, CAST(({ref}) || '_0' AS text) AS source_ref, NULL::integer AS id,
+                false AS is_new {selects}
+            FROM {staging} s
+        """.format(rows=self.PLACES, ref=ref_sql, staging=staging, selects=''.join(selects)),
+            ref_params + ref_params + params)
+
+    def _child_rows(self, cursor, builder, staging, layer):
+        """ the values of each child (name) of each row, in the temporary table WORDS """
+        split_field = None
+        unnest = 'CROSS JOIN (VALUES (NULL::text, 1::bigint)) AS m(value, i)'
+        unnest_params = []
+        if layer.split:
+            split_field, split_fmap = layer.split
+            unnest = ("CROSS JOIN LATERAL unnest(COALESCE(string_to_array(%s, %%s), ARRAY[NULL::text])) "
+                      "WITH ORDINALITY AS m(value, i)" % builder.column(split_fmap.value)[0])
+            unnest_params = [split_fmap.separator]
+
+        # like RawField.resolve, each of the split values is stripped
+        split_value = lambda field: 'trim(m.value)' if field == split_field else None
+        selects, params = [], []
+        for field, fmap in layer.fields.items():
+            sql, p = builder.field(layer.model, field, fmap, split_value(field))
+            selects.append(', %s AS f_%s' % (sql, field))
+            params += p
+        if layer.language:
+            field, fmap = layer.language
+            sql, p = builder.value(fmap, split_value(field))
+            selects.append(', trim(%s) AS lang_name' % sql)
+            params += p
+        else:
+            selects.append(', NULL::text AS lang_name')
+
+        cursor.execute('DROP TABLE IF EXISTS %s' % self.WORDS)
+        cursor.execute("""
+            CREATE TEMPORARY TABLE {rows} ON COMMIT DROP AS
+            SELECT s.row_num, p.id AS place_id, CAST(p.ref || '_' || (m.i - 1) AS text) AS source_ref,
+                NULL::integer AS id, false AS is_new, NULL::integer AS language_id {selects}
+            FROM {staging} s JOIN {places} p ON p.row_num = s.row_num
+            {unnest}
+        """.format(rows=self.WORDS, staging=staging, places=self.PLACES, unnest=unnest, selects=''.join(selects)),
+            params + unnest_params)
+
+    def _resolve_languages(self, cursor, source):
+        """
+        sets language_id of each name as LanguageRelation.find_language does, creating the languages which aren't
+        found by name or alternative name. Returns whether any were created
+        """
+        tables = {'words': self.WORDS, 'language': _quote(models.Language._meta.db_table)}
+        cursor.execute("UPDATE %s SET language_id = %%s WHERE lang_name IS NULL OR length(lang_name) < 3" %
+                       self.WORDS, [models.Language.get_default_pk()])
+        cursor.execute(MATCH_LANGUAGES_SQL.format(**tables))
+
+        cursor.execute(NEW_LANGUAGES_SQL.format(**tables))
+        new_languages = models.Language.objects.bulk_create([
+            models.Language(name=name, source=source, source_ref=ref) for name, ref in cursor.fetchall()
+        ])
+        new_ids = [lang.pk for lang in new_languages]
+        if new_ids:
+            invalidate_language_index()
+            cursor.execute(MATCH_LANGUAGES_SQL.format(**tables))
+            self.new_counts['Language'] = len(new_ids)
+
+        cursor.execute(LANGUAGE_COUNTS_SQL.format(**tables), [new_ids, new_ids])
+        used, reused = cursor.fetchone()
+        if used or reused:
+            self.updated_counts['Language'] = used + reused
+        return bool(new_ids)
+
+    def _removed_places(self, cursor, layer, table, rows, now):
+        """ records the places which the rows move or hide, before they are updated """
+        removed = []
+        if 'location' in layer.fields:
+            removed.append('r.f_location IS NOT NULL AND ST_AsBinary(r.f_location) <> ST_AsBinary(t.location)')
+        if 'is_public' in layer.fields:
+            removed.append('t.is_public AND NOT r.f_is_public')
+        if removed:
+            cursor.execute(REMOVED_PLACES_SQL.format(
+                deleted = _quote(models.DeletedPlace._meta.db_table),
+                table = table,
+                rows = rows,
+                removed = ' OR '.join('(%s)' % r for r in removed),
+            ), [now])
+
+    def _write(self, cursor, layer, rows, source, allow_update, foreign_keys):
+        """
+        matches the rows (in the temporary table rows) to existing objects, then inserts and updates them.
+        foreign_keys is {field name: column of rows}
+        """
+        model = layer.model
+        table = _quote(model._meta.db_table)
+        column = lambda name: _quote(model._meta.get_field(name).column)
+        if allow_update:
+            cursor.execute(MATCH_SQL.format(rows=rows, table=table), [source.pk])
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [model._meta.db_table])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(NEW_IDS_SQL.format(rows=rows), [sequence, sequence])
+
+        # new objects: fields in the column map without a value get their default
+        now = timezone.now()
+        columns = ['id', 'source_ref'] + [column(f) for f in foreign_keys]
+        values = ['r.id', 'r.source_ref'] + ['r.%s' % c for c in foreign_keys.values()]
+        params = []
+        for f in layer.fields:
+            field = model._meta.get_field(f)
+            columns.append(column(f))
+            values.append('COALESCE(r.f_%s, %%s)' % f)
+            params.append(field.get_db_prep_save(field.get_default(), connection))
+        default_columns, default_params = _defaults(
+            model, list(layer.fields) + list(foreign_keys) + ['source_ref'], source, now)
+        cursor.execute(INSERT_SQL.format(
+            table = table,
+            rows = rows,
+            columns = ', '.join(columns + [_quote(c) for c in default_columns]),
+            values = ', '.join(values + ['%s'] * len(default_params)),
+        ), params + default_params)
+
+        # existing objects: fields without a value are left as they are, and changes are archived in the metadata
+        changed = {f: 'r.f_%s' % f for f in layer.fields if f != 'metadata'}
+        changes, change_params = _changes(model, changed)
+        metadata = 't.metadata'
+        if 'metadata' in layer.fields:
+            # JsonPassthru values are merged into extra_fields, like BaseItemModel.update_extra_fields
+            metadata = ("CASE WHEN r.f_metadata IS NULL THEN t.metadata ELSE jsonb_set(t.metadata, '{extra_fields}', "
+                        "COALESCE(t.metadata->'extra_fields', '{}'::jsonb) || r.f_metadata) END")
+        metadata = ("{metadata} || CASE WHEN {changes} = '{{}}'::jsonb THEN '{{}}'::jsonb ELSE jsonb_build_object("
+                    "'archive', COALESCE(t.metadata->'archive', '[]'::jsonb) || jsonb_build_array(jsonb_build_object("
+                    "'when', %s::text, 'on_model', {changes}, 'on_meta', '{{}}'::jsonb))) END"
+                   ).format(metadata=metadata, changes=changes)
+        assignments = ['%s = COALESCE(r.f_%s, t.%s)' % (column(f), f, column(f)) for f in changed]
+        assignments += ['%s = r.%s' % (column(f), c) for f, c in foreign_keys.items()]
+        assignments += ['metadata = %s' % metadata, 'updated = %s']
+        if model is models.Place:
+            self._removed_places(cursor, layer, table, rows, now)
+        cursor.execute(UPDATE_SQL.format(table=table, rows=rows, assignments=', '.join(assignments)),
+                       change_params + [datetime.now().isoformat()] + change_params + [now])
+
+        cursor.execute(COUNTS_SQL.format(rows=rows))
+        new, updated, rewritten = cursor.fetchone()
+        name = model._meta.object_name
+        if new:
+            self.new_counts[name] = new
+        if updated or rewritten:
+            self.updated_counts[name] = updated + rewritten
+
+    def ingest_csv(self, lines, source, allow_update=True):
+        """
+        imports CSV lines (an iterable of str, starting with the header) with COPY and set-based SQL.
+        Returns the number of rows and the new and updated counts, like Dataset.bulk_ingest
+        """
+        if isinstance(source, str):
+            source = models.Source.objects.get_or_create(name=source)[0]
+        if source._state.adding:
+            source.save()
+            allow_update = False
+
+        started = timezone.now()
+        with deferred_bumps(), transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(FUNCTIONS_SQL)
+                staging, builder = self._copy(cursor, lines)
+                cursor.execute('SELECT count(*) FROM %s' % staging)
+                count = cursor.fetchone()[0]
+                logger.debug('copied %d rows to %s' % (count, staging))
+
+                self._base_rows(cursor, builder, staging)
+                self._write(cursor, self.layer, self.PLACES, source, allow_update, {})
+                for field, layer in self.layer.children:
+                    foreign_keys = {self.model._meta.get_field(field).field.name: 'place_id'}
+                    self._child_rows(cursor, builder, staging, layer)
+                    if layer.language:
+                        self._resolve_languages(cursor, source)
+                        foreign_keys[layer.language[0]] = 'language_id'
+                    self._write(cursor, layer, self.WORDS, source, allow_update, foreign_keys)
+                cursor.execute('DROP TABLE %s' % staging)
+
+            if self.dry_run:
+                transaction.set_rollback(True)
+            else:
+                bump_version()
+        if not self.dry_run:
+            # the transaction may have taken longer than the sync token margin to commit (see featuremap.sync)
+            now = timezone.now()
+            models.Place.objects.filter(source=source, updated__gte=started).update(updated=now)
+            models.DeletedPlace.objects.filter(
+                deleted__gte=started, place_id__in=models.Place.objects.filter(source=source).values('pk')
+            ).update(deleted=now)
+            refresh_map_features(source_id=source.pk)
+            invalidate_all()
+
+        logger.info("Imported %d rows: new=%s, updated=%s" % (count, self.new_counts, self.updated_counts))
+        return count, self.new_counts, self.updated_counts
+
+    def bulk_ingest(self, rows, source, batch_size=None, allow_update=True):
+        """ imports an iterable of dicts (eg. from csv.DictReader) by writing them as CSV, see ingest_csv """
+        return self.ingest_csv(_dict_rows_to_lines(rows), source, allow_update=allow_update)
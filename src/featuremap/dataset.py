@@ -1,5 +1,6 @@
 from django import apps
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import GEOSGeometry, LineString, Point
+from django.contrib.gis.gdal import CoordTransform, SpatialReference
 from django.db import transaction
 from django.db.models.query import QuerySet
 from django.db.models import Q, ForeignKey, ManyToOneRel
@@ -7,8 +8,14 @@ from django.utils.html import mark_safe, escape
 from django.forms.models import model_to_dict
 from django.core.exceptions import FieldDoesNotExist
 import json
+import numpy
+import threading
 
 from featuremap import models
+from featuremap.versions import bump_version, deferred_bumps
+from featuremap.cache import invalidate_all
+from featuremap.languages import get_language_index, invalidate_language_index
+from featuremap.features import refresh_map_features
 
 import logging
 logger = logging.getLogger(__name__)
@@ -114,6 +121,33 @@ class FilteredField:
     def calculate(self, values):
         """ calculate the filtered value from the fields in the given input rowv values dict """
         pass
+
+    def calculate_batch(self, rows):
+        """ calculate the filtered values for a list of row dicts, returns a list with one value per row """
+        return [self.calculate(row) for row in rows]
+
+# GDAL coordinate transformations to WGS84 by source SRID, for each thread (GDAL transformations are not thread safe,
+# and creating one is much slower than using it)
+_transforms = threading.local()
+
+def get_transform(srid):
+    """ the cached CoordTransform from srid to WGS84 """
+    cache = _transforms.__dict__
+    ct = cache.get(srid)
+    if ct is None:
+        ct = cache[srid] = CoordTransform(SpatialReference(srid), SpatialReference(4326))
+    return ct
+
+def _parse_coords(values):
+    """ numpy array of floats for a list of strings, NaN where a value is missing or not a number """
+    coords = numpy.full(len(values), numpy.nan)
+    for i, value in enumerate(values):
+        if value:
+            try:
+                coords[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+    return coords
     
 class LocationFilter(FilteredField):
     WKT         = 0
@@ -135,7 +169,8 @@ class LocationFilter(FilteredField):
             self.wkt_field = wkt_field
         else:
             raise NotImplementedError("Please specify the lat/lng, north/east or WKT fields for LocationFilter")
-        self.srid = srid
+        # column maps may give the SRID as a string
+        self.srid = int(srid)
     
     def wkt_point(self, x, y):
         # Note: WKT geographic coordinates are sometimes (Long, Lat) whereas projected coords are (x, y)
@@ -162,10 +197,10 @@ class LocationFilter(FilteredField):
         try:
             geom = GEOSGeometry(location_wkt, srid=self.srid)
             if self.srid != 4326:
-                geom.transform(4326)
+                geom.transform(get_transform(self.srid))
                 if swap:
                     geom.coords = geom.coords[::-1]
-                logger.debug('transform srid %d %s to srid %d %s' % (self.srid, location_wkt, geom.srid, geom.wkt))
+                logger.debug('transform srid %s %s to srid %s %s' % (self.srid, location_wkt, geom.srid, geom.wkt))
             else:
                 logger.debug('got geometry: %s' % geom.wkt)
             return geom
@@ -174,6 +209,60 @@ class LocationFilter(FilteredField):
             #print(e)
             return None
 
+    def pop_coords(self, rows):
+        """ x and y coordinate strings of each row (None if missing), removing them from the rows like calculate """
+        if self.mode == self.LAT_LNG:
+            x_field, y_field = self.lng_field, self.lat_field
+        else:
+            # the same order as calculate
+            x_field, y_field = self.north_field, self.east_field
+        xs, ys = [], []
+        for row in rows:
+            if x_field in row and y_field in row:
+                xs.append(row.pop(x_field))
+                ys.append(row.pop(y_field))
+            else:
+                xs.append(None)
+                ys.append(None)
+        return xs, ys
+
+    def transform_coords(self, coords):
+        """ transforms an (n, 2) numpy array of coordinates in self.srid to WGS84, with one GDAL call """
+        if self.srid == 4326 or not len(coords):
+            return coords
+        # a LineString needs two points
+        line = LineString(coords if len(coords) > 1 else numpy.vstack([coords, coords]), srid=self.srid)
+        line.transform(get_transform(self.srid))
+        return line.array[:len(coords)]
+
+    def calculate_batch(self, rows):
+        """
+        returns a GEOSGeometry or None for the location of each row (like calculate, but with the coordinates of all
+        the rows transformed at once, and without formatting and parsing WKT)
+        """
+        if self.mode == self.WKT:
+            return super().calculate_batch(rows)
+
+        xs, ys = self.pop_coords(rows)
+        coords = numpy.column_stack([_parse_coords(xs), _parse_coords(ys)])
+        valid = numpy.isfinite(coords).all(axis=1)
+        geoms = [None] * len(rows)
+        try:
+            transformed = self.transform_coords(coords[valid])
+        except Exception as e:
+            # eg. a point outside the projection: transform them one by one, as calculate does
+            logger.debug('batch transform from srid %s failed: %s' % (self.srid, e))
+            for i in numpy.flatnonzero(valid):
+                try:
+                    geoms[i] = Point(*coords[i], srid=self.srid).transform(get_transform(self.srid), clone=True)
+                except Exception:
+                    pass
+            return geoms
+
+        for i, (x, y) in zip(numpy.flatnonzero(valid), transformed):
+            geoms[i] = Point(x, y, srid=4326)
+        return geoms
+
     def serialise(self, format='obj'):
         obj = {
             k: getattr(self, k) for k in ['lat_field', 'lng_field', 'wkt_field', 'east_field', 'north_field', 'srid']
@@ -302,6 +391,10 @@ class LanguageRelation(ParentRelation):
         super().__init__(fields, mode=Relation.FIND_EXISTING)
     
     def find_language(self, name, model):
+        if model is models.Language:
+            # names and alternative names are looked up in memory (see featuremap.languages)
+            return get_language_index().find_name(name)
+
         if not name or len(name) < 3:
             return model.default()
         
@@ -327,7 +420,7 @@ class LanguageRelation(ParentRelation):
             lang = self.find_language(name, model)
             return [lang] if lang else []
         else:
-            return (model.default(), )
+            return (get_language_index().default() if model is models.Language else model.default(), )
 
 class ModelColMap(Relation):
     """ Used as the base of a relational model column map, with a base model provided """
@@ -515,26 +608,33 @@ class Dataset:
             source.save()
             allow_update = False
         
+        # languages changed by other processes since the index was loaded are picked up
+        invalidate_language_index()
         rows = iter(rows)
         count = 0
-        while True:
-            row = None
-            with transaction.atomic():
-                while True:
-                    try:
-                        row = next(rows)
-                    except StopIteration: # there are no more rows
-                        row = None
-                        break
-                
-                    self.ingest_row(row, count, source, try_update=allow_update)
-                    count += 1
-                    if count % batch_size == 0:
-                        # commit the transaction once we have processed a batch of rows
-                        break
+        # the data version is bumped once for the whole import, rather than for every saved row
+        with deferred_bumps():
+            while True:
+                row = None
+                with transaction.atomic():
+                    while True:
+                        try:
+                            row = next(rows)
+                        except StopIteration: # there are no more rows
+                            row = None
+                            break
                     
-            if row is None:
-                break
+                        self.ingest_row(row, count, source, try_update=allow_update)
+                        count += 1
+                        if count % batch_size == 0:
+                            # commit the transaction once we have processed a batch of rows
+                            break
+                        
+                if row is None:
+                    break
+            bump_version()
+        refresh_map_features(source_id=source.pk)
+        invalidate_all()
         
         models = ''
         s = lambda insts: ", ".join("%s (%d)" % (m.__name__, len(l)) for m, l in insts.items())
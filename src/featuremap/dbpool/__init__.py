@@ -0,0 +1,228 @@
+"""
+In-process PostgreSQL connection pool, used by the featuremap.dbpool database backend (a PostGIS backend whose
+connections are borrowed from the pool instead of opened for each request).
+
+Set 'ENGINE': 'featuremap.dbpool' and CONN_MAX_AGE = 0 in DATABASES (see settings.example.py): Django then "closes"
+its connection at the end of each request, which returns it to the pool, and the next request in any thread of the
+same process gets it back without the cost of connecting to PostgreSQL. Options go in a 'POOL' dict in the same
+DATABASES entry:
+
+    MAX_SIZE            most connections open at once in each process; requests wait for a free one beyond that
+    TIMEOUT             seconds to wait for a free connection before failing with OperationalError
+    HEALTH_CHECK_AFTER  connections idle for longer than this are checked with SELECT 1 before being handed out
+    MAX_IDLE            connections idle for longer than this are closed, so PostgreSQL can free them
+
+Pool and per-view checkout statistics are kept by get_pool_stats(); add ViewLabelMiddleware to MIDDLEWARE to get
+checkouts counted by view.
+"""
+
+from contextvars import ContextVar
+from psycopg2 import OperationalError, extensions
+import os
+import threading
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'MAX_SIZE': 8,
+    'TIMEOUT': 10,
+    'HEALTH_CHECK_AFTER': 30,
+    'MAX_IDLE': 600,
+}
+
+# view checking out connections in the current request (set by ViewLabelMiddleware)
+current_view = ContextVar('current_view', default='-')
+
+class PoolTimeout(OperationalError):
+    pass
+
+class ConnectionPool:
+    """ thread safe pool of up to max_size connections made by connect() """
+    def __init__(self, connect, max_size, timeout, health_check_after, max_idle):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.max_idle = max_idle
+
+        self.lock = threading.Condition()
+        self.idle = []      # (connection, time returned), most recently used last
+        self.size = 0       # open connections, idle or in use
+        self.checked_out = {}   # id(connection) -> (view, time checked out)
+        self.stats = {
+            'connects': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'discarded': 0,
+        }
+        self.view_stats = {}
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expire_idle(self, now):
+        """ close connections idle for longer than max_idle (call holding the lock) """
+        expired = [entry for entry in self.idle if now - entry[1] > self.max_idle]
+        if expired:
+            self.idle = [entry for entry in self.idle if now - entry[1] <= self.max_idle]
+            self.size -= len(expired)
+            self.lock.notify(len(expired))
+        return [conn for conn, returned in expired]
+
+    def _is_healthy(self, conn, returned):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self.lock:
+            self.size -= 1
+            self.stats['discarded'] += 1
+            self.lock.notify()
+
+    def get(self):
+        """ returns a connection, waiting up to timeout seconds for one to be free """
+        view = current_view.get()
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            conn = None
+            waited = False
+            with self.lock:
+                expired = self._expire_idle(start)
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeout('no database connection free after %s seconds (pool MAX_SIZE is %d)' %
+                                          (self.timeout, self.max_size))
+                    waited = True
+                    self.lock.wait(remaining)
+                if self.idle:
+                    conn, returned = self.idle.pop()
+                else:
+                    self.size += 1
+            for c in expired:
+                self._close(c)
+
+            if conn is None:
+                try:
+                    conn = self.connect()
+                except Exception:
+                    with self.lock:
+                        self.size -= 1
+                        self.lock.notify()
+                    raise
+                with self.lock:
+                    self.stats['connects'] += 1
+            elif not self._is_healthy(conn, returned):
+                with self.lock:
+                    self.stats['health_check_failures'] += 1
+                self._discard(conn)
+                continue
+
+            now = time.monotonic()
+            with self.lock:
+                self.checked_out[id(conn)] = (view, now)
+                self.stats['checkouts'] += 1
+                if waited:
+                    self.stats['waits'] += 1
+                self.stats['wait_seconds'] += now - start
+                vs = self.view_stats.setdefault(view, {'checkouts': 0, 'wait_seconds': 0.0, 'held_seconds': 0.0})
+                vs['checkouts'] += 1
+                vs['wait_seconds'] += now - start
+            return conn
+
+    def put(self, conn):
+        """ returns a connection to the pool, or closes it if it is broken """
+        with self.lock:
+            view, checked_out = self.checked_out.pop(id(conn), (None, None))
+            if view is not None:
+                self.view_stats[view]['held_seconds'] += time.monotonic() - checked_out
+
+        if not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        if conn.closed or conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            self._discard(conn)
+            return
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
+            self.lock.notify()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                self.stats,
+                max_size = self.max_size,
+                size = self.size,
+                idle = len(self.idle),
+                in_use = self.size - len(self.idle),
+                views = {view: dict(vs) for view, vs in self.view_stats.items()},
+            )
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = None
+
+def get_pool(alias, settings_dict, connect):
+    """ returns the pool of connections for a database alias in this process, creating it if needed """
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # don't share connections inherited from a parent process (e.g. gunicorn --preload)
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if alias not in _pools:
+            options = dict(DEFAULT_OPTIONS, **settings_dict.get('POOL', {}))
+            _pools[alias] = ConnectionPool(
+                connect,
+                max_size = options['MAX_SIZE'],
+                timeout = options['TIMEOUT'],
+                health_check_after = options['HEALTH_CHECK_AFTER'],
+                max_idle = options['MAX_IDLE'],
+            )
+            logger.debug('connection pool for %s: %s' % (alias, options))
+        return _pools[alias]
+
+def get_pool_stats():
+    """ returns {database alias: pool statistics} for the pools in this process """
+    with _pools_lock:
+        pools = dict(_pools) if _pools_pid == os.getpid() else {}
+    return {alias: pool.get_stats() for alias, pool in pools.items()}
+
+class ViewLabelMiddleware:
+    """ labels the database connections checked out while handling a request with the name of the view """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_view.set('-')
+        try:
+            return self.get_response(request)
+        finally:
+            current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        current_view.set(match.view_name if match else view_func.__name__)
@@ -0,0 +1,22 @@
+"""
+PostGIS database backend with pooled connections (see featuremap.dbpool).
+"""
+
+from django.contrib.gis.db.backends.postgis.base import DatabaseWrapper as PostGISDatabaseWrapper
+
+from . import get_pool
+
+class DatabaseWrapper(PostGISDatabaseWrapper):
+    def _get_pool(self, conn_params):
+        return get_pool(self.alias, self.settings_dict, lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def get_new_connection(self, conn_params):
+        connection = self._get_pool(conn_params).get()
+        # what the parent class sets on new connections
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self._get_pool(self.get_connection_params()).put(self.connection)
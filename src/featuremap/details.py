@@ -0,0 +1,51 @@
+"""
+Place details for map popups, rendered in batches and cached per place.
+
+Each cached fragment is keyed by the place id and the last updated times of the place, its names and its media, so
+edits are picked up without invalidating anything: looking up the keys for a whole batch takes one small query,
+and only the places which have changed since they were cached are loaded and rendered.
+"""
+
+from django.db.models import Max
+import hashlib
+
+from .models import Place
+from .cache import get_cache
+
+# maximum number of places in one batch request
+MAX_BATCH_DETAILS = 100
+
+def get_fragment_keys(places):
+    """ returns {place id: cache key suffix} for a queryset of places """
+    stamps = places.select_related(None).prefetch_related(None).annotate(
+        names_updated = Max('names__updated'),
+        names_media_updated = Max('names__media__updated'),
+        media_updated = Max('media__updated'),
+    ).values_list('pk', 'updated', 'names_updated', 'names_media_updated', 'media_updated')
+    return {
+        row[0]: hashlib.sha1(repr(row[1:]).encode()).hexdigest()
+        for row in stamps
+    }
+
+def get_place_details(places, render, name='html'):
+    """
+    returns {place id: render(place)} for a queryset of places, using the cached result for each place which hasn't
+    changed. name identifies the kind of rendering in the cache keys.
+    """
+    keys = {
+        pk: 'detail:%s:%d:%s' % (name, pk, stamp)
+        for pk, stamp in get_fragment_keys(places).items()
+    }
+    cache = get_cache()
+    details = {}
+    if cache is not None:
+        cached = cache.get_many(keys.values())
+        details = {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+    missing = [pk for pk in keys if pk not in details]
+    if missing:
+        rendered = {p.pk: render(p) for p in Place.objects.filter(pk__in=missing)}
+        if cache is not None:
+            cache.set_many({keys[pk]: detail for pk, detail in rendered.items()})
+        details.update(rendered)
+    return details
@@ -0,0 +1,123 @@
+"""
+Maintains the denormalised MapFeature table, and serialises it for the map.
+
+Each MapFeature row holds everything needed to draw one place marker (label, language ids and colours, icon,
+visibility and geometry), so the map data can be read from a single indexed table without any joins or prefetches.
+Rows are refreshed with set-based SQL from model signals (see signals.py) and at the end of each import.
+"""
+
+from django.db import connection
+import json
+
+from .models import Place, Word, Language, MapFeature
+from . import lod
+
+import logging
+logger = logging.getLogger(__name__)
+
+REFRESH_SQL = """
+INSERT INTO {feature} (place_id, location, is_public, category, icon, label, lang_ids, lang_colours, updated)
+SELECT
+    p.id, p.location, p.is_public, p.category, p.icon,
+    COALESCE(n.names[1], ''),
+    COALESCE(n.lang_ids, '{{}}'),
+    COALESCE(n.lang_colours, '{{}}'),
+    p.updated
+FROM {place} p
+LEFT JOIN LATERAL (
+    SELECT
+        array_agg(w.name ORDER BY w.id) AS names,
+        array_agg(l.id ORDER BY w.id) AS lang_ids,
+        array_agg(l.colour ORDER BY w.id) AS lang_colours
+    FROM {word} w JOIN {language} l ON l.id = w.language_id
+    WHERE w.place_id = p.id
+) n ON true
+WHERE p.location IS NOT NULL AND {where}
+ON CONFLICT (place_id) DO UPDATE SET
+    location = EXCLUDED.location,
+    is_public = EXCLUDED.is_public,
+    category = EXCLUDED.category,
+    icon = EXCLUDED.icon,
+    label = EXCLUDED.label,
+    lang_ids = EXCLUDED.lang_ids,
+    lang_colours = EXCLUDED.lang_colours,
+    updated = EXCLUDED.updated
+"""
+
+# remove features for places which no longer have a location
+PURGE_SQL = """
+DELETE FROM {feature} f USING {place} p
+WHERE f.place_id = p.id AND p.location IS NULL AND {where}
+"""
+
+FEATURES_SQL = """
+WITH features AS (
+    SELECT * FROM {feature} WHERE place_id IN ({subquery})
+)
+SELECT json_build_object(
+    'type', 'FeatureCollection',
+    'features', COALESCE((
+        SELECT json_agg(json_build_object(
+            'type', 'Feature',
+            'geometry', {geometry},
+            'properties', json_build_object(
+                'id', f.place_id,
+                'label', f.label,
+                'category', f.category,
+                'icon', f.icon,
+                'langs', f.lang_ids,
+                'colours', f.lang_colours
+            )
+        ) ORDER BY f.place_id)
+        FROM features f
+    ), '[]'::json),
+    'metadata', json_build_object(
+        'clustered', false,
+        'langs', COALESCE((
+            SELECT json_agg(json_build_object('id', l.id, 'name', l.name, 'colour', l.colour) ORDER BY l.name)
+            FROM {language} l WHERE l.id IN (SELECT unnest(f.lang_ids) FROM features f)
+        ), '[]'::json)
+    )::jsonb || %s::jsonb
+)::text
+"""
+
+def _tables():
+    return {
+        'feature': MapFeature._meta.db_table,
+        'place': Place._meta.db_table,
+        'word': Word._meta.db_table,
+        'language': Language._meta.db_table,
+    }
+
+def refresh_map_features(place_ids=None, source_id=None, language_id=None):
+    """
+    Rebuild the MapFeature rows for the given places, the places from a source or the places with names in a
+    language. Rebuilds every row if no arguments are given.
+    """
+    if place_ids is not None:
+        where, params = 'p.id = ANY(%s)', [list(place_ids)]
+    elif source_id is not None:
+        where, params = 'p.source_id = %s', [source_id]
+    elif language_id is not None:
+        where, params = 'p.id IN (SELECT place_id FROM {word} WHERE language_id = %s)'.format(**_tables()), [language_id]
+    else:
+        where, params = 'true', []
+
+    with connection.cursor() as cursor:
+        cursor.execute(REFRESH_SQL.format(where=where, **_tables()), params)
+        num_updated = cursor.rowcount
+        cursor.execute(PURGE_SQL.format(where=where, **_tables()), params)
+        logger.debug('refreshed %d map features, removed %d' % (num_updated, cursor.rowcount))
+    return num_updated
+
+def features_geojson_sql(features, extra_metadata=None, zoom=None):
+    """
+    returns the GeoJSON FeatureCollection (str) for a queryset of MapFeatures, generated by the database.
+    Geometries are simplified for zoom if given.
+    """
+    subquery, sub_params = features.values('pk').query.sql_with_params()
+    params = tuple(sub_params) + (json.dumps(extra_metadata or {}), )
+    with connection.cursor() as cursor:
+        sql = FEATURES_SQL.format(subquery=subquery, geometry=lod.geojson_sql('f.location', zoom), **_tables())
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
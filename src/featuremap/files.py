@@ -3,9 +3,24 @@ import itertools
 import logging
 
 from .dataset import Dataset
+from .bulk import BulkDataset
+from .copy_import import CopyDataset
+from .parallel import ParallelDataset
+from .apps import get_import_engine
 
 logger = logging.getLogger(__name__)
 
+# Dataset classes which import rows: 'row' saves each instance separately, 'bulk' writes batches of rows with
+# bulk queries (see featuremap.bulk), 'copy' copies the file to a staging table and imports it with set-based SQL
+# (see featuremap.copy_import), 'parallel' is the bulk engine with the rows mapped in worker processes
+# (see featuremap.parallel)
+IMPORT_ENGINES = {
+    'row': Dataset,
+    'bulk': BulkDataset,
+    'copy': CopyDataset,
+    'parallel': ParallelDataset,
+}
+
 def get_csv_dialect(f):
     # use the first chunk to deduce the format
     chunk = next(iter(f))
@@ -44,10 +59,16 @@ def get_csv_info(file, leave_open=True):
             f.close()
     
 
-def import_csv_with_colmap(csvfile, colmap, source):
+def import_csv_with_colmap(csvfile, colmap, source, engine=None):
+    engine = engine or get_import_engine()
+    if engine == 'parallel':
+        # it forks worker processes, which isn't safe in a web server (see featuremap.parallel)
+        raise ValueError('the parallel import engine can only be used by manage.py import_csv')
     with csvfile.open('r') as f:
         dialect = get_csv_dialect(wrap_file_str(f))
         reader = csv.DictReader(wrap_file_str(f), dialect)
         
-        ds = Dataset(colmap)
-        return ds.bulk_ingest(reader, source, batch_size=50, allow_update=True)
+        ds = IMPORT_ENGINES[engine](colmap)
+        if hasattr(ds, 'ingest_csv'):
+            return ds.ingest_csv(wrap_file_str(f), source, allow_update=True)
+        return ds.bulk_ingest(reader, source, allow_update=True)
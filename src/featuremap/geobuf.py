@@ -0,0 +1,193 @@
+"""
+Geobuf (https://github.com/mapbox/geobuf) encoder for compact binary map data.
+
+Geobuf is a protobuf encoding of GeoJSON with delta-encoded integer coordinates. Strings which repeat between
+features (names, categories, icons and languages) are dictionary-encoded: the dictionaries are stored once as
+custom properties of the FeatureCollection, and each feature only stores indexes into them.
+
+The protobuf wire format is written directly, see the geobuf.proto schema for the field numbers used here.
+"""
+
+import json
+import struct
+
+CONTENT_TYPE = 'application/x-geobuf'
+
+GEOMETRY_TYPES = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 2,
+    'MultiLineString': 3,
+    'Polygon': 4,
+    'MultiPolygon': 5,
+    'GeometryCollection': 6,
+}
+
+# protobuf wire types
+VARINT = 0
+FIXED64 = 1
+BYTES = 2
+
+class ProtobufWriter:
+    """ minimal protobuf message writer """
+    def __init__(self):
+        self.buf = bytearray()
+
+    def _varint(self, value):
+        while value > 0x7f:
+            self.buf.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self.buf.append(value)
+
+    def _tag(self, field, wire_type):
+        self._varint((field << 3) | wire_type)
+
+    def varint(self, field, value):
+        self._tag(field, VARINT)
+        self._varint(value)
+
+    def double(self, field, value):
+        self._tag(field, FIXED64)
+        self.buf += struct.pack('<d', value)
+
+    def bytes(self, field, value):
+        self._tag(field, BYTES)
+        self._varint(len(value))
+        self.buf += value
+
+    def string(self, field, value):
+        self.bytes(field, value.encode('utf-8'))
+
+    def message(self, field, writer):
+        self.bytes(field, writer.buf)
+
+    def packed_varint(self, field, values):
+        w = ProtobufWriter()
+        for v in values:
+            w._varint(v)
+        self.bytes(field, w.buf)
+
+    def packed_svarint(self, field, values):
+        # zigzag encoding for signed values
+        self.packed_varint(field, [(v << 1) ^ (v >> 63) for v in values])
+
+class GeobufEncoder:
+    def __init__(self, precision=6):
+        self.e = 10 ** precision
+        self.precision = precision
+        self.keys = []
+        self.key_index = {}
+        self.features = []
+
+    def _key(self, key):
+        if key not in self.key_index:
+            self.key_index[key] = len(self.keys)
+            self.keys.append(key)
+        return self.key_index[key]
+
+    def _value(self, value):
+        w = ProtobufWriter()
+        if isinstance(value, bool):
+            w.varint(5, int(value))
+        elif isinstance(value, str):
+            w.string(1, value)
+        elif isinstance(value, int):
+            if value >= 0:
+                w.varint(3, value)
+            else:
+                w.varint(4, -value)
+        elif isinstance(value, float):
+            w.double(2, value)
+        else:
+            w.string(6, json.dumps(value))
+        return w
+
+    def _props(self, writer, props, field):
+        indexes = []
+        for key, value in props.items():
+            indexes += [self._key(key), len(indexes) // 2]
+            writer.message(13, self._value(value))
+        if indexes:
+            writer.packed_varint(field, indexes)
+
+    def _line(self, coords, line, closed=False):
+        total = [0, 0]
+        for point in line[:len(line) - 1] if closed else line:
+            for j in range(2):
+                n = round(point[j] * self.e) - total[j]
+                coords.append(n)
+                total[j] += n
+
+    def _geometry(self, geom):
+        w = ProtobufWriter()
+        gtype = geom['type']
+        w.varint(1, GEOMETRY_TYPES[gtype])
+        coords = []
+        lengths = None
+        if gtype == 'GeometryCollection':
+            for g in geom['geometries']:
+                w.message(4, self._geometry(g))
+            return w
+
+        c = geom['coordinates']
+        if gtype == 'Point':
+            coords = [round(v * self.e) for v in c[:2]]
+        elif gtype in ('MultiPoint', 'LineString'):
+            self._line(coords, c)
+        elif gtype in ('MultiLineString', 'Polygon'):
+            closed = gtype == 'Polygon'
+            if len(c) != 1:
+                lengths = [len(l) - (1 if closed else 0) for l in c]
+            for l in c:
+                self._line(coords, l, closed)
+        elif gtype == 'MultiPolygon':
+            if len(c) != 1 or len(c[0]) != 1:
+                lengths = [len(c)]
+                for polygon in c:
+                    lengths.append(len(polygon))
+                    lengths += [len(ring) - 1 for ring in polygon]
+            for polygon in c:
+                for ring in polygon:
+                    self._line(coords, ring, True)
+
+        if lengths:
+            w.packed_varint(2, lengths)
+        w.packed_svarint(3, coords)
+        return w
+
+    def add_feature(self, geometry, properties, feature_id=None):
+        w = ProtobufWriter()
+        w.message(1, self._geometry(geometry))
+        if isinstance(feature_id, int):
+            w.varint(12, (feature_id << 1) ^ (feature_id >> 63))
+        elif feature_id is not None:
+            w.string(11, str(feature_id))
+        self._props(w, properties, 14)
+        self.features.append(w)
+
+    def encode(self, custom_properties=None):
+        """ returns the encoded FeatureCollection (bytes), with custom_properties (dict) on the collection """
+        fc = ProtobufWriter()
+        for f in self.features:
+            fc.message(1, f)
+        self._props(fc, custom_properties or {}, 15)
+
+        data = ProtobufWriter()
+        for key in self.keys:
+            data.string(1, key)
+        if self.precision != 6:
+            data.varint(3, self.precision)
+        data.message(4, fc)
+        return bytes(data.buf)
+
+class Dictionary(list):
+    """ list of unique values, returning the index of each value added """
+    def __init__(self):
+        super().__init__()
+        self.index = {}
+
+    def add(self, value):
+        if value not in self.index:
+            self.index[value] = len(self)
+            self.append(value)
+        return self.index[value]
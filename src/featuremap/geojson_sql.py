@@ -0,0 +1,147 @@
+"""
+Builds the map data FeatureCollection inside PostgreSQL (json_build_object/json_agg/ST_AsGeoJSON).
+
+Produces the same document structure as the Python serialiser in views.py, but in a single query so that
+the number of queries and the Python CPU time stay constant regardless of the number of places returned.
+"""
+
+from django.db import connection
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+import json
+
+from .models import Place, Word, Language, Media
+from . import lod
+from .profiles import PROFILES, FIELDS, BASIC_FIELDS
+
+# json for a list of media attached to the row aliased as {alias}: params are (media url, content type id)
+MEDIA_JSON_SQL = """COALESCE((
+    SELECT json_agg(json_build_object(
+        'id', m.id,
+        'href', %s || m.file,
+        'type', m.file_type,
+        'desc', m.description
+    ) ORDER BY m.id)
+    FROM {media} m WHERE m.content_type_id = %s AND m.object_id = {alias}.id
+), '[]'::json)"""
+
+# json for the names of the place aliased as p, {word_properties} is a list of json_build_object arguments
+NAMES_JSON_SQL = """COALESCE((
+    SELECT json_agg(json_build_object({word_properties}) ORDER BY w.id)
+    FROM {word} w JOIN {language} l ON l.id = w.language_id
+    WHERE w.place_id = p.id
+), '[]'::json)"""
+
+# the first name of the place aliased as p, and its language
+FIRST_NAME_SQL = """(
+    SELECT {column} FROM {word} w JOIN {language} l ON l.id = w.language_id
+    WHERE w.place_id = p.id ORDER BY w.id LIMIT 1
+)"""
+
+FULL_LANG_PROPERTIES = """
+                'id', l.id,
+                'owner', l.owner_id,
+                'metadata', l.metadata,
+                'source', l.source_id,
+                'source_ref', l.source_ref,
+                'name', l.name,
+                'alt_names', l.alt_names,
+                'colour', l.colour"""
+
+COMPACT_LANG_PROPERTIES = "'id', l.id, 'name', l.name, 'colour', l.colour"
+
+FEATURES_SQL = """
+WITH places AS ({subquery})
+SELECT json_build_object(
+    'type', 'FeatureCollection',
+    'features', COALESCE((
+        SELECT json_agg(json_build_object(
+            'type', 'Feature',
+            'geometry', {geometry},
+            'properties', json_build_object({place_properties})
+        ) ORDER BY p.id)
+        FROM {place} p WHERE p.id IN (SELECT id FROM places)
+    ), '[]'::json),
+    'metadata', json_build_object(
+        'clustered', false,
+        'langs', COALESCE((
+            SELECT json_agg(json_build_object({lang_properties}) ORDER BY l.name)
+            FROM {language} l WHERE l.id IN (
+                SELECT w.language_id FROM {word} w WHERE w.place_id IN (SELECT id FROM places)
+            )
+        ), '[]'::json)
+    )::jsonb || %s::jsonb
+)::text
+"""
+
+def _tables():
+    return {
+        'place': Place._meta.db_table,
+        'word': Word._meta.db_table,
+        'language': Language._meta.db_table,
+        'media': Media._meta.db_table,
+    }
+
+def _field_properties(alias, fields, media_url, content_types, basic_only=False):
+    """
+    (sql, params) for the fields of the row aliased as alias, in featuremap.profiles.FIELDS order.
+    content_types maps the aliases to the content type ids used for media.
+    """
+    props = []
+    params = []
+    for f in FIELDS:
+        if f not in fields or (basic_only and f not in BASIC_FIELDS):
+            continue
+        if f == 'media':
+            props.append("'media', " + MEDIA_JSON_SQL.format(alias=alias, **_tables()))
+            params += [media_url, content_types[alias]]
+        elif f in ('owner', 'source'):
+            props.append("'%s', %s.%s_id" % (f, alias, f))
+        elif f == 'names':
+            word_props, word_params = _field_properties('w', fields, media_url, content_types, True)
+            word_props += [
+                "'name', w.name",
+                "'desc', w.\"desc\"",
+                "'lang', json_build_object('id', l.id, 'name', l.name, 'colour', l.colour)",
+            ]
+            props.append("'names', " + NAMES_JSON_SQL.format(word_properties=', '.join(word_props), **_tables()))
+            params += word_params
+        elif f == 'label':
+            props.append("'label', " + FIRST_NAME_SQL.format(column='w.name', **_tables()))
+        elif f == 'colour':
+            props.append("'colour', " + FIRST_NAME_SQL.format(column='l.colour', **_tables()))
+        else:
+            props.append("'%s', %s.\"%s\"" % (f, alias, f))
+    return props, params
+
+def get_properties_sql(fields, place_ct, word_ct, media_url):
+    """ returns (sql, params), the json_build_object arguments for the properties of each place """
+    props, params = _field_properties('p', fields, media_url, {'p': place_ct, 'w': word_ct})
+    return ', '.join(props), params
+
+def get_features_sql(subquery, zoom=None, place_properties='', full=True):
+    return FEATURES_SQL.format(
+        subquery = subquery,
+        geometry = lod.geojson_sql('p.location', zoom),
+        place_properties = place_properties,
+        lang_properties = FULL_LANG_PROPERTIES if full else COMPACT_LANG_PROPERTIES,
+        **_tables()
+    )
+
+def places_geojson_sql(places, extra_metadata=None, zoom=None, fields=PROFILES['full']):
+    """
+    returns the GeoJSON FeatureCollection (str) for a queryset of places, generated by the database.
+    extra_metadata is merged into the collection's metadata object, geometries are simplified for zoom if given.
+    Only the given fields (see featuremap.profiles) are included in the properties of each place.
+    """
+    subquery, sub_params = places.values('pk').query.sql_with_params()
+    media_url = default_storage.base_url
+    place_ct = ContentType.objects.get_for_model(Place).id
+    word_ct = ContentType.objects.get_for_model(Word).id
+    properties, prop_params = get_properties_sql(fields, place_ct, word_ct, media_url)
+
+    # parameters in order of appearance in the query
+    params = tuple(sub_params) + tuple(prop_params) + (json.dumps(extra_metadata or {}), )
+    with connection.cursor() as cursor:
+        cursor.execute(get_features_sql(subquery, zoom, properties, full=fields == PROFILES['full']), params)
+        return cursor.fetchone()[0]
@@ -2,7 +2,10 @@ from django.contrib.staticfiles.storage import staticfiles_storage
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
 
+from .apps import get_icon_sprite_dir
+
 import re
+import json
 import random
 import logging
 
@@ -48,11 +51,46 @@ def icon_func(f):
 get_icon_path = icon_func(staticfiles_storage.path)
 get_icon_url = icon_func(staticfiles_storage.url)
 
+_icon_urls = None
+
 def get_icon_url_dict():
-    return {
-        name: staticfiles_storage.url(path)
-        for name, path in _icon_list.items()
-    }
+    global _icon_urls
+    if _icon_urls is None:
+        # urls don't change while the app is running, only look them up once
+        _icon_urls = {
+            name: staticfiles_storage.url(path)
+            for name, path in _icon_list.items()
+        }
+    return _icon_urls
+
+def load_sprite_manifest():
+    """ returns the manifest of the icon sprite atlas (see featuremap.sprites) with its url, or None if not built """
+    sprite_dir = get_icon_sprite_dir().rstrip('/')
+    path = '%s/manifest.json' % sprite_dir
+    if not staticfiles_storage.exists(path):
+        return None
+    with staticfiles_storage.open(path) as f:
+        manifest = json.load(f)
+    manifest['url'] = staticfiles_storage.url('%s/manifest-%s.json' % (sprite_dir, manifest['version']))
+    return manifest
+
+try:
+    _sprite_manifest = load_sprite_manifest()
+except Exception as e:
+    logger.warn(e)
+    _sprite_manifest = None
+
+def get_sprite_manifest():
+    return _sprite_manifest
+
+def get_icons_metadata():
+    """
+    icon data for map data responses: the url of the sprite manifest (which includes its version) if it has been
+    built, otherwise the url of each icon
+    """
+    if _sprite_manifest:
+        return {'icon_manifest': _sprite_manifest['url']}
+    return {'icons': get_icon_url_dict()}
 
 def get_hex_colour():
     rgb = [
@@ -0,0 +1,108 @@
+"""
+In-memory index of languages by name and alternative name, used to resolve the languages of imported names without
+a query for each row.
+
+Names are compared case-insensitively like the CICharField columns (citext compares lower case strings). The index
+for the process is loaded on first use and is dropped whenever a Language is saved or deleted (see signals.py), so
+it reloads on the next lookup. Imports reload it at the start, which picks up changes made by other processes.
+
+An index loaded inside a transaction can include languages created by that transaction, so it is only used by the
+thread which loaded it until the transaction commits, and is dropped by the next lookup outside a transaction if it
+was rolled back. The default language is likewise only kept once committed.
+"""
+
+from django.db import connection, transaction
+import threading
+
+from .models import Language
+
+import logging
+logger = logging.getLogger(__name__)
+
+class LanguageIndex:
+    """ every language by (case insensitive) name and alternative name, loaded once """
+    def __init__(self):
+        self.by_name = {}
+        self.by_alt_name = {}
+        # the names each language was indexed by
+        self.keys = {}
+        self._default = None
+        for lang in Language._base_manager.order_by('pk'):
+            self.add(lang)
+
+    @staticmethod
+    def key(lang):
+        return (lang.name.lower(), tuple(alt_name.lower() for alt_name in lang.alt_names))
+
+    def add(self, lang):
+        self.keys[lang.pk] = self.key(lang)
+        # the lowest pk wins where languages share a name
+        self.by_name.setdefault(lang.name.lower(), lang)
+        for alt_name in lang.alt_names:
+            self.by_alt_name.setdefault(alt_name.lower(), lang)
+
+    def default(self):
+        default = self._default
+        if default is None:
+            default = Language.default()
+            # it may have been created by a transaction which is rolled back
+            transaction.on_commit(lambda: setattr(self, '_default', default))
+        return default
+
+    def commit(self):
+        """ shares an index loaded inside a transaction with the other threads, once the transaction commits """
+        global _index
+        _index = self
+        _local.index = None
+
+    def find_name(self, name):
+        """ same as LanguageRelation.find_language, returns a Language or None """
+        if not name or len(name) < 3:
+            return self.default()
+        return self.by_name.get(name.lower()) or self.by_alt_name.get(name.lower())
+
+    def find(self, values):
+        """ same as LanguageRelation.find_model_instance, returns a Language or None """
+        if 'name' not in values:
+            return self.default()
+        return self.find_name(values['name'].strip())
+
+_lock = threading.Lock()
+_index = None
+# _local.index is an index loaded by this thread inside a transaction: it is set when its commit is scheduled
+# (with transaction.on_commit), and cleared by LanguageIndex.commit
+_local = threading.local()
+
+def _pending_index():
+    index = getattr(_local, 'index', None)
+    if index is not None and not connection.in_atomic_block:
+        # the transaction ended without running LanguageIndex.commit, so it was rolled back
+        index = _local.index = None
+    return index
+
+def get_language_index():
+    """ the LanguageIndex of this process (or of this thread's transaction), loaded if needed """
+    global _index
+    index = _pending_index() or _index
+    if index is None:
+        with _lock:
+            index = LanguageIndex()
+            logger.debug('loaded %d languages' % len(index.by_name))
+            if connection.in_atomic_block:
+                _local.index = index
+                transaction.on_commit(index.commit)
+            else:
+                _index = index
+    return index
+
+def invalidate_language_index():
+    """ drops the index of this process, eg. when a language changes """
+    global _index
+    _index = None
+    _local.index = None
+
+def language_saved(lang):
+    """ drops the index of this process if lang is new or its names changed """
+    index = _pending_index() or _index
+    if index is not None and (lang.pk not in index.keys or index.keys[lang.pk] != index.key(lang)):
+        invalidate_language_index()
@@ -0,0 +1,37 @@
+"""
+Language legend for the map filter control: each language with the number of places and names shown on the map.
+
+The counts come from one grouped query, and the result is cached (in the map data cache) until the data version
+changes. Its ETag is a hash of the content, so clients only download it again when a language or a count changes.
+"""
+
+from django.db.models import Count, Q
+import hashlib
+import json
+
+from .models import Language
+from .versions import get_version
+from .cache import get_cache
+
+def get_language_legend(public_only=False):
+    """ returns a list of languages with place and name counts, for the languages which have places on the map """
+    names = Q(word__place__location__isnull=False)
+    if public_only:
+        names &= Q(word__place__is_public=True)
+    langs = Language.objects.select_related(None).prefetch_related(None).annotate(
+        num_places = Count('word__place', filter=names, distinct=True),
+        num_names = Count('word', filter=names),
+    ).filter(num_names__gt=0).order_by('name')
+    return list(langs.values('id', 'name', 'alt_names', 'colour', 'num_places', 'num_names'))
+
+def get_language_legend_json(public_only=False):
+    """ returns (json, etag) for the language legend """
+    cache = get_cache()
+    key = 'legend:%s:%d' % ('public' if public_only else 'auth', get_version())
+    legend = cache.get(key) if cache is not None else None
+    if legend is None:
+        content = json.dumps({'langs': get_language_legend(public_only)})
+        legend = (content, 'legend-%s' % hashlib.sha1(content.encode()).hexdigest())
+        if cache is not None:
+            cache.set(key, legend)
+    return legend
@@ -0,0 +1,64 @@
+"""
+Level of detail for map geometries.
+
+Lines and polygons (eg. rivers and ranges from GEONOMA) are simplified to the size of a screen pixel at the
+requested zoom level using ST_SimplifyPreserveTopology, and output coordinates are rounded to the number of
+decimal places that the zoom level can display. Points are always sent at full precision: clients keep the places
+they have loaded (see sync.py) when zooming in, and a point rounded for a low zoom level would be misplaced.
+
+For the same reason, responses to sync requests are never simplified: a synchronised client would keep the simplified
+geometries at every zoom level. The bundled map synchronises whenever it shows places, so it only gets simplified
+geometries when it doesn't send sync data (a viewport with more than MAX_SYNC_TILES tiles). Simplification is for
+clients which load the viewport again for each zoom level, such as other map clients using the GET API.
+"""
+
+import geojson
+import math
+
+# width (in pixels) of a standard web map tile
+TILE_SIZE = 256
+
+# simplification tolerance, in screen pixels
+SIMPLIFY_PIXELS = 1.0
+
+def get_pixel_size(zoom):
+    """ size of a screen pixel in degrees (of longitude) at the given zoom level """
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+def get_tolerance(zoom):
+    return get_pixel_size(zoom) * SIMPLIFY_PIXELS
+
+def get_precision(zoom):
+    """ number of decimal places needed to resolve half a pixel at the given zoom level """
+    return min(max(int(math.ceil(-math.log10(get_pixel_size(zoom) / 2))), 0), 9)
+
+def geojson_sql(column, zoom=None):
+    """ SQL expression for the (simplified) json geometry of a geometry/geography column """
+    if zoom is None:
+        return 'ST_AsGeoJSON(%s)::json' % column
+    return ("CASE WHEN ST_GeometryType({column}::geometry) IN ('ST_Point', 'ST_MultiPoint') "
+            "THEN ST_AsGeoJSON({column})::json "
+            "ELSE ST_AsGeoJSON(ST_SimplifyPreserveTopology({column}::geometry, {tolerance:.12f}), {precision})::json END"
+           ).format(column=column, tolerance=get_tolerance(zoom), precision=get_precision(zoom))
+
+def _quantise(coords, digits):
+    if isinstance(coords, (list, tuple)):
+        return [_quantise(c, digits) for c in coords]
+    return round(coords, digits)
+
+def _quantise_geometry(geom, digits):
+    if 'geometries' in geom:
+        for g in geom['geometries']:
+            _quantise_geometry(g, digits)
+    else:
+        geom['coordinates'] = _quantise(geom['coordinates'], digits)
+
+def to_geojson(geom, zoom=None):
+    """ converts a GEOSGeometry into a geojson geometry, simplified for the given zoom level """
+    if zoom is None or geom.geom_type in ('Point', 'MultiPoint'):
+        return geojson.loads(geom.geojson)
+
+    geom = geom.simplify(get_tolerance(zoom), preserve_topology=True)
+    data = geojson.loads(geom.geojson)
+    _quantise_geometry(data, get_precision(zoom))
+    return data
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.db import close_old_connections
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import time
+
+from featuremap.models import UserWithToken
+from featuremap import views, async_views
+from featuremap.benchmarks import percentile
+
+# Western Australia
+DEFAULT_BBOX = '112.5,-35.5,129.0,-13.5'
+
+MODES = ('wsgi', 'asgi-sync', 'asgi-async')
+
+def _summary(mode, times, elapsed, concurrency):
+    return {
+        'mode': mode,
+        'requests': len(times),
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(times) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(times, 0.5) * 1000, 1),
+        'p95_ms': round(percentile(times, 0.95) * 1000, 1),
+    }
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the map data view under WSGI-style threads, ASGI with sync views and '
+            'ASGI with the async views (featuremap.async_views), on the current database. Prints JSON results.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to make the requests as (default: the first superuser)')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests in each mode')
+        parser.add_argument('--concurrency', type=int, default=20, help='Number of requests in flight at once')
+        parser.add_argument('--bbox', default=DEFAULT_BBOX, help='Viewport of each request: west,south,east,north')
+        parser.add_argument('--zoom', type=int, default=12, help='Zoom level of each request')
+        parser.add_argument('--mode', choices=MODES, action='append',
+                            help='Only run these modes (can be repeated, default: all)')
+        parser.add_argument('--cache', action='store_true',
+                            help='Use the map data cache (by default it is disabled, so every request hits the database)')
+
+    def _make_request(self):
+        request = self.factory.get('/data/', {'bbox': self.bbox, 'zoom': self.zoom}, HTTP_ACCEPT_ENCODING='gzip')
+        request.user = self.user
+        return request
+
+    def _call_view(self, request):
+        response = views.places_json(request)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def _timed_wsgi(self):
+        close_old_connections()
+        try:
+            start = time.perf_counter()
+            self._call_view(self._make_request())
+            return time.perf_counter() - start
+        finally:
+            close_old_connections()
+
+    def run_wsgi(self, num, concurrency):
+        """ one thread per request in flight, like a threaded WSGI server """
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(lambda i: self._timed_wsgi(), range(num)))
+
+    async def _run_async(self, num, concurrency, run_view):
+        semaphore = asyncio.Semaphore(concurrency)
+        async def timed():
+            async with semaphore:
+                start = time.perf_counter()
+                await run_view(self._make_request())
+                return time.perf_counter() - start
+        return await asyncio.gather(*[timed() for i in range(num)])
+
+    def run_asgi_sync(self, num, concurrency):
+        """ sync view under ASGI: Django runs it in the one thread shared by all thread sensitive code """
+        return asyncio.run(self._run_async(num, concurrency, sync_to_async(self._call_view)))
+
+    def run_asgi_async(self, num, concurrency):
+        return asyncio.run(self._run_async(num, concurrency, async_views.places_json))
+
+    def handle(self, *args, **options):
+        if options['user']:
+            self.user = UserWithToken.objects.filter(username=options['user']).first()
+        else:
+            self.user = UserWithToken.objects.filter(is_superuser=True).first()
+        if self.user is None:
+            raise CommandError('user not found')
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('requests and concurrency must be positive')
+
+        self.factory = RequestFactory()
+        self.bbox = options['bbox']
+        self.zoom = options['zoom']
+
+        results = []
+        with override_settings(**({} if options['cache'] else {'MAP_CACHE': None})):
+            for mode in options['mode'] or MODES:
+                run = getattr(self, 'run_' + mode.replace('-', '_'))
+                # warm up connections
+                run(min(options['concurrency'], options['requests']), options['concurrency'])
+                start = time.perf_counter()
+                times = run(options['requests'], options['concurrency'])
+                results.append(_summary(mode, times, time.perf_counter() - start, options['concurrency']))
+        return json.dumps(results, indent=2)
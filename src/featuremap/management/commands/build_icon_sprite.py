@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from featuremap.sprites import build_sprite
+from featuremap.models import Language
+
+class Command(BaseCommand):
+    help = 'Pack the place icons into a sprite atlas with a hashed manifest (run after collectstatic, then restart the app)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=64,
+                            help='Size (in pixels) of each icon in the atlas, eg. twice the displayed size for high-DPI screens')
+        parser.add_argument('--padding', type=int, default=1,
+                            help='Transparent pixels around each icon')
+        parser.add_argument('--tint', action='store_true',
+                            help='Also build a copy of the atlas tinted with the colour of each language')
+
+    def handle(self, *args, **options):
+        if options['size'] < 1 or options['padding'] < 0:
+            raise CommandError('invalid icon size or padding')
+
+        colours = Language.objects.values_list('colour', flat=True) if options['tint'] else ()
+        manifest = build_sprite(options['size'], options['padding'], colours)
+        return "Built icon sprite %s with %d icons and %d tints" % (
+            manifest['version'], len(manifest['icons']), len(manifest['tints']))
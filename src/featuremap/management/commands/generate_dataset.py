@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+import random
+
+from featuremap.models import Source
+from featuremap.synthetic import generate_dataset, parse_geometry_mix, delete_source, SOURCE_NAME
+
+class Command(BaseCommand):
+    help = ('Generate a reproducible synthetic dataset (places, names, languages and media spread over WA) for '
+            'benchmarking, see run_benchmarks')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--places', type=int, default=10000, help='Number of places')
+        parser.add_argument('--names', type=int, default=2, help='Number of names per place')
+        parser.add_argument('--languages', type=int, default=20, help='Number of languages')
+        parser.add_argument('--alt-names', type=int, default=2, help='Number of alternative names per language')
+        parser.add_argument('--media', type=int, default=0, help='Number of images per place')
+        parser.add_argument('--geometry', default='point=8,line=1,polygon=1',
+                            help='Relative amounts of each geometry type (default: point=8,line=1,polygon=1)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--source', default=SOURCE_NAME, help='Name of the source to create')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete any previously generated data with the same source name first')
+
+    def handle(self, *args, **options):
+        try:
+            geometry_mix = parse_geometry_mix(options['geometry'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['places'] < 0 or options['names'] < 1 or options['languages'] < 1:
+            raise CommandError('there must be at least one name per place and one language')
+
+        existing = Source.objects.filter(name__iexact=options['source'])
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError("source '%s' already exists, use --replace to delete it first" % options['source'])
+            for source in existing:
+                delete_source(source)
+
+        with transaction.atomic():
+            source, counts = generate_dataset(
+                random.Random(options['seed']),
+                options['places'],
+                names_per_place = options['names'],
+                num_languages = options['languages'],
+                alt_names = options['alt_names'],
+                media_per_place = options['media'],
+                geometry_mix = geometry_mix,
+                source_name = options['source'],
+            )
+        return "Created source %d '%s' with %d languages, %d places, %d names and %d media" % (
+            source.pk, source.name, counts['languages'], counts['places'], counts['names'], counts['media'])
@@ -1,9 +1,10 @@
 from django.core.management.base import BaseCommand, CommandError
 
 import csv
-from featuremap import dataset
 from featuremap.mappings import mappings
 from featuremap.models import Source
+from featuremap.files import IMPORT_ENGINES
+from featuremap.apps import get_import_engine
 
 class Command(BaseCommand):
     help = 'Import a CSV file to the database'
@@ -14,6 +15,10 @@ class Command(BaseCommand):
         parser.add_argument('-s', '--source-desc', help='Description of data source being imported')
         parser.add_argument('-u', '--update', action='store_true',
                             help='Update previously imported data with matching source (slow)')
+        parser.add_argument('-e', '--engine', choices=IMPORT_ENGINES.keys(),
+                            help='Import engine (default: the IMPORT_ENGINE setting)')
+        parser.add_argument('-j', '--workers', type=int,
+                            help='Worker processes for the parallel engine (default: the IMPORT_WORKERS setting)')
 
     def handle(self, *args, **options):
         colmap = mappings.get(options['type'], None)
@@ -31,7 +36,16 @@ class Command(BaseCommand):
             source = Source(name=options['type'], description=source_desc)
             source.save()
         
-        ds = dataset.Dataset(colmap)
+        try:
+            ds = IMPORT_ENGINES[options['engine'] or get_import_engine()](colmap)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['workers'] and hasattr(ds, 'workers'):
+            ds.workers = options['workers']
         with open(filename, newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            ds.bulk_ingest(reader, source)
+            if hasattr(ds, 'ingest_csv'):
+                # the copy engine reads the file itself
+                ds.ingest_csv(csvfile, source)
+            else:
+                reader = csv.DictReader(csvfile)
+                ds.bulk_ingest(reader, source)
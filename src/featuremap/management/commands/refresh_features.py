@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from featuremap.features import refresh_map_features
+from featuremap.cache import invalidate_all
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalised map feature table (eg. after upgrading, or changing data outside of Django)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', type=int,
+                            help='Only rebuild features for places from the source with this id')
+
+    def handle(self, *args, **options):
+        num = refresh_map_features(source_id=options['source'])
+        invalidate_all()
+        return "Refreshed %d map features" % num
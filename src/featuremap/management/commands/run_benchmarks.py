@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+import json
+
+from featuremap.models import UserWithToken
+from featuremap.benchmarks import BenchmarkSuite, GROUPS, environment
+
+class Command(BaseCommand):
+    help = ('Time the map data, place detail and search views and the imports for each column mapping on the current '
+            'database (eg. one filled by generate_dataset), and print the results as JSON for comparing commits')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to make the requests as (default: the first superuser)')
+        parser.add_argument('--runs', type=int, default=20, help='Number of timed requests for each benchmark')
+        parser.add_argument('--import-rows', type=int, default=1000, help='Number of rows to import for each mapping')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for choosing places, queries and rows')
+        parser.add_argument('--only', choices=GROUPS, action='append',
+                            help='Only run these benchmarks (can be repeated, default: all)')
+        parser.add_argument('--cache', action='store_true',
+                            help='Use the map data cache (by default it is disabled, so every request hits the database)')
+        parser.add_argument('-o', '--output', help='Write the results to this file instead of printing them')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = UserWithToken.objects.filter(username=options['user']).first()
+        else:
+            user = UserWithToken.objects.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('user not found')
+        if options['runs'] < 1 or options['import_rows'] < 1:
+            raise CommandError('runs and import-rows must be positive')
+
+        suite = BenchmarkSuite(user, runs=options['runs'], import_rows=options['import_rows'], seed=options['seed'])
+        with override_settings(**({} if options['cache'] else {'MAP_CACHE': None})):
+            output = {
+                'environment': environment(),
+                'results': suite.run(options['only'] or GROUPS),
+            }
+        output = json.dumps(output, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            return 'Wrote results to %s' % options['output']
+        return output
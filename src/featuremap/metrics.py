@@ -0,0 +1,202 @@
+"""
+Per-request performance metrics: number of SQL queries, time spent in SQL, in template rendering and in the rest of
+the view (ORM and serialisation), and response size.
+
+TimingMiddleware reports them for each response in a Server-Timing header (shown by browser developer tools) and
+adds them to histograms by view, which are served in the Prometheus text format by the metrics view (/metrics).
+Template rendering is timed by the TimedDjangoTemplates backend (see TEMPLATES in settings.example.py).
+
+The histograms are kept in each worker process, so with several workers each scrape sees one process.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+import bisect
+import threading
+import time
+
+from .apps import get_server_timing
+from .dbpool import get_pool_stats
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+SIZE_BUCKETS = (1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+# timings of the request being handled
+_current = ContextVar('featuremap_request_timings', default=None)
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+
+@contextmanager
+def timer(name):
+    """ adds the time spent in the block to the current request's timings for name ('sql' or 'template') """
+    timings = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            setattr(timings, name, getattr(timings, name) + time.perf_counter() - start)
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    timings.queries += 1
+    with timer('sql'):
+        return execute(sql, params, many, context)
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+connection_created.connect(_install_query_timer)
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timer('template'):
+            return super().render(context, request)
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """ the Django template backend, with rendering time counted in the request's metrics """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """ a Prometheus histogram with a view label """
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.values = {}    # view -> [count in each bucket (not cumulative) and +Inf, sum]
+
+    def observe(self, view, value):
+        with self.lock:
+            counts = self.values.setdefault(view, [0] * (len(self.buckets) + 1) + [0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self.lock:
+            values = {view: list(counts) for view, counts in self.values.items()}
+        for view, counts in sorted(values.items()):
+            label = 'view="%s"' % _escape(view)
+            total = 0
+            for le, count in zip(list(self.buckets) + ['+Inf'], counts):
+                total += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, le, total))
+            lines.append('%s_sum{%s} %s' % (self.name, label, repr(float(counts[-1]))))
+            lines.append('%s_count{%s} %d' % (self.name, label, total))
+        return lines
+
+HISTOGRAMS = {
+    'total': Histogram('featuremap_request_seconds', 'Time to handle each request', DURATION_BUCKETS),
+    'sql': Histogram('featuremap_request_sql_seconds', 'Time spent running SQL queries in each request', DURATION_BUCKETS),
+    'queries': Histogram('featuremap_request_sql_queries', 'Number of SQL queries in each request', COUNT_BUCKETS),
+    'template': Histogram('featuremap_request_template_seconds', 'Time spent rendering templates in each request',
+                          DURATION_BUCKETS),
+    'app': Histogram('featuremap_request_app_seconds',
+                     'Time spent in each request outside SQL queries and templates (ORM, serialisation)',
+                     DURATION_BUCKETS),
+    'size': Histogram('featuremap_response_bytes', 'Size of each response body', SIZE_BUCKETS),
+}
+
+def _server_timing(timings, total):
+    app = max(total - timings.sql - timings.template, 0)
+    return ', '.join([
+        'sql;dur=%.1f;desc="%d queries"' % (timings.sql * 1000, timings.queries),
+        'tpl;dur=%.1f' % (timings.template * 1000),
+        'app;dur=%.1f' % (app * 1000),
+        'total;dur=%.1f' % (total * 1000),
+    ])
+
+def _count_streamed(content, view):
+    size = 0
+    for chunk in content:
+        size += len(chunk)
+        yield chunk
+    HISTOGRAMS['size'].observe(view, size)
+
+class TimingMiddleware:
+    """ times each request (put it first in MIDDLEWARE, so that it includes all the others) """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '(unresolved)'
+        HISTOGRAMS['total'].observe(view, total)
+        HISTOGRAMS['sql'].observe(view, timings.sql)
+        HISTOGRAMS['queries'].observe(view, timings.queries)
+        HISTOGRAMS['template'].observe(view, timings.template)
+        HISTOGRAMS['app'].observe(view, max(total - timings.sql - timings.template, 0))
+        if response.streaming:
+            # the size is known once the response has been sent
+            response.streaming_content = _count_streamed(response.streaming_content, view)
+        else:
+            HISTOGRAMS['size'].observe(view, len(response.content))
+
+        if get_server_timing():
+            response['Server-Timing'] = _server_timing(timings, total)
+        return response
+
+def _pool_metrics():
+    stats = get_pool_stats()
+    if not stats:
+        return []
+    gauges = {
+        'size': 'Open pooled database connections',
+        'in_use': 'Pooled database connections checked out',
+        'max_size': 'Maximum pooled database connections',
+    }
+    counters = {
+        'connects': 'Database connections opened by the pool',
+        'checkouts': 'Database connections checked out of the pool',
+        'waits': 'Checkouts which waited for a free connection',
+        'wait_seconds': 'Time spent waiting for a free connection',
+        'timeouts': 'Checkouts which timed out waiting for a free connection',
+        'health_check_failures': 'Idle connections which failed their health check',
+        'discarded': 'Broken connections closed by the pool',
+    }
+    lines = []
+    for kind, metrics in (('gauge', gauges), ('counter', counters)):
+        for key, help in metrics.items():
+            name = 'featuremap_db_pool_' + key + ('_total' if kind == 'counter' else '')
+            lines += ['# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, kind)]
+            lines += ['%s{database="%s"} %s' % (name, _escape(alias), s[key]) for alias, s in sorted(stats.items())]
+    return lines
+
+def render_metrics():
+    """ all metrics in the Prometheus text exposition format """
+    lines = []
+    for histogram in HISTOGRAMS.values():
+        lines += histogram.render()
+    lines += _pool_metrics()
+    return '\n'.join(lines) + '\n'
@@ -1,7 +1,7 @@
 """ initial migration to ensure required PostgreSQL extensions are loaded """
 
 from django.conf import settings
-from django.contrib.postgres.operations import CreateExtension
+from django.contrib.postgres.operations import CreateExtension, TrigramExtension
 from django.db import migrations
 
 class Migration(migrations.Migration):
@@ -15,4 +15,6 @@ class Migration(migrations.Migration):
     operations = [
         CreateExtension('postgis'),
         CreateExtension('citext'),
+        # for the name search indexes
+        TrigramExtension(),
     ]
@@ -1,5 +1,7 @@
 from django.contrib.gis.db import models
+from django.db import transaction
 from django.contrib.postgres import fields as pg
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth import models as auth_models
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
@@ -49,6 +51,16 @@ class PrefetchManager(models.Manager):
             qs = qs.prefetch_related(*self.prefetch)
         return qs
 
+# pks of the default Source and Language, by model
+_default_pks = {}
+
+def clear_default_pks(model=None):
+    """ forgets the cached default pk of model (or all of them), eg. when the default instance is deleted """
+    if model is None:
+        _default_pks.clear()
+    else:
+        _default_pks.pop(model, None)
+
 def get_default_metadata():
     return { }
 
@@ -60,7 +72,13 @@ class BaseItemModel(models.Model):
     
     @classmethod
     def get_default_pk(cls):
-        return cls.default().pk
+        """ the pk of cls.default(), cached as it is the default of foreign keys (see clear_default_pks) """
+        pk = _default_pks.get(cls)
+        if pk is None:
+            pk = cls.default().pk
+            # only cached once committed, as it may have been created by a transaction which is rolled back
+            transaction.on_commit(lambda: _default_pks.setdefault(cls, pk))
+        return pk
 
     def make_archive_entry(self):
         archive = self.metadata.get('archive', [])
@@ -203,6 +221,12 @@ class Place(BaseSourcedModel):
     media   = GenericRelation('Media', related_query_name='place')
     objects = PrefetchManager(select=['source'], prefetch=['names', 'names__media', 'names__source', 'names__language', 'media'])
 
+    class Meta:
+        indexes = [
+            # trigram index for searching place types, see featuremap.search
+            GinIndex(name='place_category_trgm', fields=['category'], opclasses=['gin_trgm_ops']),
+        ]
+
     def __str__(self):
         try:
             names = self.names.all()
@@ -215,11 +239,52 @@ class Place(BaseSourcedModel):
             s += '%s (%s)' % (n.name, n.language.name)
         return s
 
+
+# denormalised copy of what the map needs to draw each place, kept up to date by featuremap.features
+class MapFeature(models.Model):
+    place           = models.OneToOneField(Place, primary_key=True, on_delete=models.CASCADE, related_name='map_feature')
+    location        = models.GeometryField(spatial_index=True, geography=True, srid=4326)
+    is_public       = models.BooleanField(default=True)
+    category        = pg.CICharField(max_length=200, blank=True)
+    icon            = models.CharField(max_length=100, blank=True)
+    # first name of the place
+    label           = models.CharField(max_length=200, blank=True)
+    # language id and colour for each name of the place
+    lang_ids        = pg.ArrayField(models.IntegerField(), default=list)
+    lang_colours    = pg.ArrayField(models.CharField(max_length=18), default=list)
+    updated         = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.label or str(self.place_id)
+
+# records deleted places so that map clients can be told to remove them (see featuremap.sync)
+class DeletedPlace(models.Model):
+    place_id    = models.IntegerField(db_index=True)
+    location    = models.GeometryField(null=True, spatial_index=True, geography=True, srid=4326)
+    is_public   = models.BooleanField(default=True)
+    deleted     = models.DateTimeField(_('When deleted'), auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return "Place %d (deleted %s)" % (self.place_id, self.deleted)
+
+
+# counters which change whenever the map data changes, used for HTTP caching (see featuremap.versions)
+class DataVersion(models.Model):
+    key         = models.CharField(max_length=50, unique=True)
+    version     = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return "%s: %d" % (self.key, self.version)
+
     
 class Word(BaseSourcedModel):
     class Meta:
         verbose_name = _('Place Name')
         verbose_name_plural = _('Place Names')
+        indexes = [
+            # trigram index for name search & autocomplete, see featuremap.search
+            GinIndex(name='word_name_trgm', fields=['name'], opclasses=['gin_trgm_ops']),
+        ]
     
     place       = models.ForeignKey(Place, related_name='names', on_delete=models.SET_NULL, null=True)
     name        = pg.CICharField(_('Name'), max_length=200, blank=False)
@@ -0,0 +1,37 @@
+"""
+"What's near here": the places closest to a point, using PostGIS KNN ordering.
+
+Ordering by the <-> operator lets PostgreSQL walk the spatial (GiST) index on Place.location nearest-first and stop
+after the first N places, instead of finding and sorting everything within a distance. For geography columns <->
+gives the distance in metres (on a sphere).
+"""
+
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import GeometryDistance
+from django.contrib.gis.measure import D
+from django.db.models import Exists, OuterRef, Value
+
+from .models import Place, Word
+
+MAX_NEAREST = 100
+
+def nearest_places(point, limit=10, places=None, max_distance=None, language_id=None, category=None):
+    """
+    returns the queryset of the limit places (from places, default all located places) closest to point (a GEOS
+    Point in WGS84), nearest first and annotated with their distance in metres.
+    Optionally only places within max_distance metres, with a name in a language or of a category.
+    """
+    if places is None:
+        places = Place.objects.all()
+    places = places.filter(location__isnull=False)
+
+    if max_distance is not None:
+        places = places.filter(location__dwithin=(point, D(m=max_distance)))
+    if language_id is not None:
+        places = places.filter(Exists(Word.objects.filter(place=OuterRef('pk'), language_id=language_id)))
+    if category is not None:
+        places = places.filter(category=category)
+
+    # compare as geography, so that the operator can use the index on the geography column
+    target = Value(point, output_field=GeometryField(srid=4326, geography=True))
+    return places.annotate(distance=GeometryDistance('location', target)).order_by('distance')[:limit]
@@ -0,0 +1,70 @@
+"""
+Parallel import engine: the bulk engine (featuremap.bulk) with the rows mapped through the column map in a pool of
+worker processes.
+
+The rows are read in the main process and split into batches (row ranges), which the workers map to Records: field
+values, coordinates (LocationFilter.calculate_batch) and the structure of related objects, all without queries. The
+main process is the only writer: it saves the batches in the order of the rows, matching places, names and languages
+as the bulk engine does, so duplicate names and languages in different batches are resolved the same way for any
+number of workers. While one batch is saved the workers map the following ones.
+
+Mapping is most of the work of the bulk engine for files with coordinates to transform, so this is faster with more
+workers until the writer (the database) is the limit.
+
+The workers are forked, so this is only for the import_csv management command: forking a multi-threaded web server
+process (or inside a transaction) would copy database connections and locks in use by other threads.
+"""
+
+from django.db import connection, connections
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import os
+
+from featuremap.bulk import BulkDataset, batches
+from featuremap.apps import get_import_workers
+
+import logging
+logger = logging.getLogger(__name__)
+
+# the dataset and source of a worker process, set by _init_worker
+_worker = None
+
+def _init_worker(colmap, source):
+    global _worker
+    _worker = (BulkDataset(colmap), source)
+
+def _plan_batch(rows, start_index):
+    dataset, source = _worker
+    return dataset.plan_batch(rows, start_index, source)
+
+class ParallelDataset(BulkDataset):
+    """ imports rows with the bulk engine, mapping batches of rows in worker processes, see the module docstring """
+    def __init__(self, model_map, dry_run=False, workers=None):
+        super().__init__(model_map, dry_run=dry_run)
+        self.workers = workers or get_import_workers() or os.cpu_count()
+
+    def planned_batches(self, rows, source, batch_size):
+        if self.workers < 2:
+            yield from super().planned_batches(rows, source, batch_size)
+            return
+
+        if connection.in_atomic_block:
+            raise ValueError('the parallel import engine can\'t be used inside a transaction')
+        # the workers are forked: they shouldn't share the database connections of this process
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.colmap, source)) as executor:
+            # enough batches are queued to keep the workers busy, without reading the whole file into memory
+            pending = deque()
+            count = 0
+            for batch in batches(rows, batch_size):
+                pending.append((len(batch), executor.submit(_plan_batch, batch, count)))
+                count += len(batch)
+                if len(pending) > self.workers * 2:
+                    num_rows, future = pending.popleft()
+                    yield num_rows, future.result()
+            while pending:
+                num_rows, future = pending.popleft()
+                yield num_rows, future.result()
@@ -0,0 +1,50 @@
+"""
+Field profiles for map data responses ("sparse fieldsets").
+
+A request can name a profile, or list the fields it wants. Only those fields are fetched from the database and
+serialised for each place. Names include the same basic fields (id, owner, metadata, media, source) as requested
+for the place.
+"""
+
+# all the fields which can be requested, in output order
+FIELDS = (
+    'id', 'owner', 'metadata', 'category', 'icon', 'desc', 'location_desc', 'media', 'source',
+    'names',    # list of names with their language
+    'label',    # first name of the place
+    'colour',   # colour of the language of the first name
+)
+
+# fields shared by places and names
+BASIC_FIELDS = ('id', 'owner', 'metadata', 'media', 'source')
+
+PROFILES = {
+    # the minimum needed to draw a marker
+    'marker': ('id', 'icon', 'label', 'colour'),
+    # what the map needs to draw, filter and label markers
+    'popup': ('id', 'category', 'icon', 'desc', 'location_desc', 'names'),
+    'full': ('id', 'owner', 'metadata', 'category', 'icon', 'media', 'source', 'names'),
+}
+
+DEFAULT_PROFILE = 'full'
+
+def get_fields(profile=None, fields=None):
+    """
+    returns the tuple of fields to include for each place, from a list of fields (list or comma-separated str)
+    or else a profile name. Raises ValueError for unknown fields or profiles.
+    """
+    if fields:
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        fields = set(f.strip() for f in fields)
+        unknown = fields - set(FIELDS)
+        if unknown:
+            raise ValueError('unknown fields: %s' % ", ".join(sorted(unknown)))
+        return tuple(f for f in FIELDS if f in fields)
+
+    profile = profile or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ValueError('unknown profile "%s"' % profile)
+    return PROFILES[profile]
+
+def needs_names(fields):
+    return any(f in fields for f in ('names', 'label', 'colour'))
@@ -0,0 +1,144 @@
+"""
+Place name search and autocomplete, using pg_trgm trigram similarity.
+
+Names (Word.name) and place types (Place.category) are matched using the % (similarity) and <% (word similarity)
+operators, which can use the GIN trigram indexes on those columns, so partially typed or misspelt names are found
+without scanning the names table. Languages are matched on their name and alternative names; there are few enough
+languages that they don't need an index.
+"""
+
+from django.db import connection
+
+from .models import Place, Word, Language
+
+import logging
+logger = logging.getLogger(__name__)
+
+# shortest query which can be matched, shorter queries have too few trigrams to be useful
+MIN_QUERY_LENGTH = 2
+
+MAX_RESULTS = 50
+
+# added to the score of places inside the viewport, so that nearby names are listed first
+VIEWPORT_BIAS = 0.25
+
+SCORE_SQL = "GREATEST(similarity({column}, %(q)s), word_similarity(%(q)s, {column}))"
+MATCH_SQL = "({column} %% %(q)s OR %(q)s <%% {column})"
+
+PLACES_SQL = """
+WITH matches AS (
+    SELECT DISTINCT ON (p.id)
+        p.id, w.name, l.id AS lang_id, l.name AS lang_name, l.colour, p.category, p.icon,
+        ST_PointOnSurface(p.location::geometry) AS point,
+        {word_score} + {bias} AS score
+    FROM {word} w
+    JOIN {place} p ON p.id = w.place_id
+    JOIN {language} l ON l.id = w.language_id
+    WHERE {word_match} AND p.location IS NOT NULL {extra_where}
+    ORDER BY p.id, score DESC
+)
+SELECT id, name, lang_id, lang_name, colour, category, icon, ST_X(point), ST_Y(point), score
+FROM matches
+ORDER BY score DESC, name
+LIMIT %(limit)s
+"""
+
+VIEWPORT_BIAS_SQL = """CASE WHEN p.location && ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)::geography
+    THEN %(bias)s ELSE 0 END"""
+
+LANGUAGES_SQL = """
+SELECT l.id, l.name, l.alt_names, l.colour, GREATEST({name_score}, COALESCE((
+    SELECT max({alt_score}) FROM unnest(l.alt_names) a
+), 0)) AS score
+FROM {language} l
+WHERE {name_match} OR EXISTS (SELECT 1 FROM unnest(l.alt_names) a WHERE {alt_match})
+ORDER BY score DESC, l.name
+LIMIT %(limit)s
+"""
+
+CATEGORIES_SQL = """
+SELECT p.category, count(*), {score} AS score
+FROM {place} p
+WHERE {match} AND p.location IS NOT NULL {extra_where}
+GROUP BY p.category
+ORDER BY score DESC, p.category
+LIMIT %(limit)s
+"""
+
+def _tables():
+    return {
+        'place': Place._meta.db_table,
+        'word': Word._meta.db_table,
+        'language': Language._meta.db_table,
+    }
+
+def _fetch(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+def search_places(query, bbox=None, limit=10, public_only=False):
+    """
+    returns the places with names matching query, best match first. Places within bbox (west, south, east, north)
+    are ranked higher.
+    """
+    params = {'q': query, 'limit': limit}
+    bias = '0'
+    if bbox:
+        params.update(zip(('west', 'south', 'east', 'north'), bbox), bias=VIEWPORT_BIAS)
+        bias = VIEWPORT_BIAS_SQL
+    sql = PLACES_SQL.format(
+        word_score = SCORE_SQL.format(column='w.name'),
+        word_match = MATCH_SQL.format(column='w.name'),
+        bias = bias,
+        extra_where = 'AND p.is_public' if public_only else '',
+        **_tables()
+    )
+    return [
+        {
+            'id': pk,
+            'name': name,
+            'lang': {'id': lang_id, 'name': lang_name, 'colour': colour},
+            'category': category,
+            'icon': icon,
+            'location': [x, y],
+            'score': score,
+        }
+        for pk, name, lang_id, lang_name, colour, category, icon, x, y, score in _fetch(sql, params)
+    ]
+
+def search_languages(query, limit=10):
+    """ returns the languages with a name or alternative name matching query """
+    sql = LANGUAGES_SQL.format(
+        name_score = SCORE_SQL.format(column='l.name'),
+        alt_score = SCORE_SQL.format(column='a'),
+        name_match = MATCH_SQL.format(column='l.name'),
+        alt_match = MATCH_SQL.format(column='a'),
+        **_tables()
+    )
+    return [
+        {'id': pk, 'name': name, 'alt_names': alt_names, 'colour': colour, 'score': score}
+        for pk, name, alt_names, colour, score in _fetch(sql, {'q': query, 'limit': limit})
+    ]
+
+def search_categories(query, limit=10, public_only=False):
+    """ returns the place types matching query, with the number of places of each type """
+    sql = CATEGORIES_SQL.format(
+        score = SCORE_SQL.format(column='p.category'),
+        match = MATCH_SQL.format(column='p.category'),
+        extra_where = 'AND p.is_public' if public_only else '',
+        **_tables()
+    )
+    return [
+        {'category': category, 'num_places': num, 'score': score}
+        for category, num, score in _fetch(sql, {'q': query, 'limit': limit})
+    ]
+
+def search(query, bbox=None, limit=10, public_only=False):
+    """ autocomplete results for query: matching places, languages and place types """
+    logger.debug('search "%s" bbox=%s' % (query, bbox))
+    return {
+        'places': search_places(query, bbox, limit, public_only),
+        'languages': search_languages(query, limit),
+        'categories': search_categories(query, limit, public_only),
+    }
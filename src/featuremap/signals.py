@@ -0,0 +1,142 @@
+"""
+Model signal handlers which keep derived data up to date when places and their related objects change.
+"""
+
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Source, Place, Word, Language, Media, DeletedPlace, clear_default_pks
+from .versions import bump_version, bumps_deferred
+from .features import refresh_map_features
+from .languages import language_saved, invalidate_language_index
+from . import cache
+
+def touch_places(place_ids):
+    """
+    bump Place.updated so that changes to related objects are picked up by map clients, and refresh their map
+    features (unless bumps are deferred, eg. during an import which refreshes them at the end)
+    """
+    place_ids = [pk for pk in place_ids if pk is not None]
+    if place_ids:
+        Place.objects.filter(pk__in=place_ids).update(updated=timezone.now())
+        if not bumps_deferred():
+            refresh_map_features(place_ids=place_ids)
+            if cache.get_cache() is not None:
+                for location in Place.objects.filter(pk__in=place_ids).values_list('location', flat=True):
+                    cache.invalidate_geometry(location)
+
+@receiver(post_init, sender=Place)
+def place_loaded(sender, instance, **kwargs):
+    # remember where the place was, so the cache can be invalidated there if it moves
+    # (avoid loading the field if it was deferred)
+    instance._cached_location = instance.__dict__.get('location', None)
+    instance._cached_is_public = instance.__dict__.get('is_public', None)
+
+def _removed_from_map(instance):
+    """ whether a saved place moved away from (or was hidden at) its previous location, for map clients """
+    old = instance._cached_location
+    if old is None or 'location' not in instance.__dict__:
+        return False
+    return instance.location != old or (instance._cached_is_public and not instance.is_public)
+
+def removed_places(places):
+    """
+    DeletedPlace records (unsaved) for the places which moved away from (or were hidden at) their previous location,
+    and remembers their current location. For places saved without signals, eg. by bulk_update
+    """
+    deleted = []
+    for place in places:
+        if _removed_from_map(place):
+            # synchronised clients remove it from the tiles of its previous location (and load it again, see sync.py)
+            deleted.append(DeletedPlace(place_id=place.pk, location=place._cached_location,
+                                        is_public=place._cached_is_public is not False))
+        place._cached_location = place.__dict__.get('location', None)
+        place._cached_is_public = place.__dict__.get('is_public', None)
+    return deleted
+
+@receiver(post_save, sender=Place)
+def place_saved(sender, instance, **kwargs):
+    old_location = instance._cached_location
+    for deleted in removed_places([instance]):
+        deleted.save()
+    bump_version()
+    if not bumps_deferred():
+        refresh_map_features(place_ids=[instance.pk])
+        cache.invalidate_geometry(old_location)
+        cache.invalidate_geometry(instance.__dict__.get('location', None))
+
+@receiver(post_delete, sender=Place)
+def place_deleted(sender, instance, **kwargs):
+    if instance.location is not None:
+        DeletedPlace.objects.create(place_id=instance.pk, location=instance.location, is_public=instance.is_public)
+        cache.invalidate_geometry(instance.location)
+    bump_version()
+
+@receiver(post_init, sender=Word)
+def word_loaded(sender, instance, **kwargs):
+    # remember the place, so that it is refreshed as well if the name is moved to another place
+    instance._cached_place_id = instance.__dict__.get('place_id', None)
+
+@receiver(post_save, sender=Word)
+@receiver(post_delete, sender=Word)
+def word_changed(sender, instance, **kwargs):
+    touch_places({instance._cached_place_id, instance.place_id})
+    instance._cached_place_id = instance.place_id
+    bump_version()
+
+def _language_map_values(instance):
+    # what the map shows of a language, in MapFeature.lang_colours and the legend
+    alt_names = instance.__dict__.get('alt_names')
+    return (instance.__dict__.get('name'), alt_names and tuple(alt_names), instance.__dict__.get('colour'))
+
+@receiver(post_init, sender=Language)
+def language_loaded(sender, instance, **kwargs):
+    instance._cached_map_values = _language_map_values(instance)
+
+@receiver(pre_delete, sender=Language)
+def language_deleting(sender, instance, **kwargs):
+    # the names in the language are deleted with it, so the places are found first
+    instance._place_ids = list(Place.objects.filter(names__language=instance).values_list('pk', flat=True).distinct())
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def language_changed(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save:
+        language_saved(instance)
+        changed = created or _language_map_values(instance) != instance._cached_map_values
+        instance._cached_map_values = _language_map_values(instance)
+        if not changed:
+            # eg. the row import engine saves the language of each name again
+            return
+        if not created and not bumps_deferred():
+            # imports refresh the map features of their source at the end
+            Place.objects.filter(names__language=instance).update(updated=timezone.now())
+            refresh_map_features(language_id=instance.pk)
+    else:
+        invalidate_language_index()
+        clear_default_pks(Language)
+        touch_places(getattr(instance, '_place_ids', []))
+    # names from any source can refer to the language
+    bump_version()
+    cache.invalidate_all()
+
+@receiver(post_delete, sender=Source)
+def source_deleted(sender, instance, **kwargs):
+    clear_default_pks(Source)
+
+@receiver(post_save, sender=Media)
+@receiver(post_delete, sender=Media)
+def media_changed(sender, instance, **kwargs):
+    model = instance.content_type.model_class()
+    # touch_places also refreshes the map features of the places
+    if model is Place:
+        touch_places([instance.object_id])
+    elif model is Word:
+        touch_places(Word.objects.filter(pk=instance.object_id).values_list('place_id', flat=True))
+    elif model is Language and not bumps_deferred():
+        refresh_map_features(language_id=instance.object_id)
+
+    bump_version()
+    if model not in (Place, Word):
+        cache.invalidate_all()
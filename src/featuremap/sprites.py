@@ -0,0 +1,93 @@
+"""
+Packs the place icons (ICONS_DIR) into a sprite atlas, so that map clients load one image instead of one per icon.
+
+The atlas and its manifest are written to ICON_SPRITE_DIR in the static files storage, named by the hash of their
+content so that they can be cached forever. manifest.json always points to the latest build, and is read once
+when the app starts (see featuremap.icons). Atlases can also be pre-tinted with language colours.
+"""
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
+from PIL import Image, ImageChops
+import hashlib
+import io
+import json
+import math
+
+from .apps import get_icon_sprite_dir
+from .icons import generate_icon_list
+
+MANIFEST_NAME = 'manifest.json'
+
+def _hash(data):
+    return hashlib.sha1(data).hexdigest()[:12]
+
+def _png_bytes(image):
+    buf = io.BytesIO()
+    image.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+def _save(storage, sprite_dir, name, data):
+    """ saves a file to the sprite directory, returns its name (relative to the directory) """
+    path = '%s/%s' % (sprite_dir, name)
+    if storage.exists(path):
+        storage.delete(path)
+    storage.save(path, ContentFile(data))
+    return name
+
+def load_icons(storage, size):
+    """ returns {icon name: RGBA image}, scaled to fit in size x size pixels """
+    icons = {}
+    for name, path in sorted(generate_icon_list().items()):
+        with storage.open(path) as f:
+            image = Image.open(f).convert('RGBA')
+        image.thumbnail((size, size), Image.LANCZOS)
+        icons[name] = image
+    return icons
+
+def pack_icons(icons, size, padding=1):
+    """ arranges the icons in a square grid, returns (atlas image, {icon name: [x, y, width, height]}) """
+    cell = size + padding * 2
+    columns = max(int(math.ceil(math.sqrt(len(icons)))), 1)
+    rows = max(int(math.ceil(len(icons) / columns)), 1)
+    atlas = Image.new('RGBA', (columns * cell, rows * cell), (0, 0, 0, 0))
+    rects = {}
+    for i, (name, image) in enumerate(icons.items()):
+        x = (i % columns) * cell + padding
+        y = (i // columns) * cell + padding
+        atlas.paste(image, (x, y))
+        rects[name] = [x, y, image.width, image.height]
+    return atlas, rects
+
+def tint_image(image, colour):
+    """ multiplies the colours of an RGBA image by colour (#rrggbb), keeping its transparency """
+    tinted = ImageChops.multiply(image.convert('RGB'), Image.new('RGB', image.size, colour))
+    tinted.putalpha(image.getchannel('A'))
+    return tinted
+
+def build_sprite(size=64, padding=1, colours=(), storage=staticfiles_storage):
+    """
+    builds the atlas (and a tinted copy for each of colours) and writes the manifest.
+    Returns the manifest dict, image names in it are relative to the manifest.
+    """
+    sprite_dir = get_icon_sprite_dir().rstrip('/')
+    atlas, rects = pack_icons(load_icons(storage, size), size, padding)
+
+    data = _png_bytes(atlas)
+    manifest = {
+        'image': _save(storage, sprite_dir, 'icons-%s.png' % _hash(data), data),
+        'size': list(atlas.size),
+        'icon_size': size,
+        'icons': rects,
+        'tints': {},
+    }
+    for colour in sorted(set(c.lower() for c in colours)):
+        data = _png_bytes(tint_image(atlas, colour))
+        manifest['tints'][colour] = _save(storage, sprite_dir, 'icons-%s.png' % _hash(data), data)
+
+    content = json.dumps(manifest, sort_keys=True).encode()
+    manifest['version'] = _hash(content)
+    content = json.dumps(manifest, sort_keys=True).encode()
+    _save(storage, sprite_dir, 'manifest-%s.json' % manifest['version'], content)
+    _save(storage, sprite_dir, MANIFEST_NAME, content)
+    return manifest
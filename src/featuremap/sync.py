@@ -0,0 +1,89 @@
+"""
+Delta synchronisation of map data.
+
+Map clients divide the viewport into tiles (at zoom level SYNC_TILE_ZOOM) and remember a sync token for each tile
+they have loaded. The token is the database time of the last request which included the tile (less a safety
+margin), so the server only needs to return the places created or changed since then, plus the ids of places
+deleted since then. The request size depends on the viewport size, not on how many places the client has already
+loaded.
+
+Places are stamped with the time they were written, which is before their transaction commits: the margin
+(SYNC_TOKEN_MARGIN) makes clients fetch places written shortly before a request again, in case their transaction
+committed after it. Places which moved out of a tile or were hidden are recorded as deleted from their old location
+(see signals.place_saved), and sent again with their current location and visibility.
+"""
+
+from django.contrib.gis import geos
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import DeletedPlace
+from .tiles import is_valid_tile, tile_bounds
+from .apps import get_sync_token_margin
+
+# upper limit on the number of tiles per request
+MAX_SYNC_TILES = 1024
+
+class SyncError(ValueError):
+    pass
+
+def new_sync_token():
+    """
+    returns a token representing the current state of the data, taken before running any queries: the time of the
+    database (one clock for every web server) less SYNC_TOKEN_MARGIN seconds, which also covers the difference
+    between the clocks of the database and the servers which set Place.updated
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT statement_timestamp() - make_interval(secs => %s)', [get_sync_token_margin()])
+        return cursor.fetchone()[0].isoformat()
+
+def parse_sync_tiles(sync):
+    """
+    Parse the sync data provided by the client: dict of { 'z/x/y': token or None }
+    Returns a list of (bbox polygon, datetime or None)
+    """
+    if not isinstance(sync, dict) or len(sync) > MAX_SYNC_TILES:
+        raise SyncError('sync must be a dict with at most %d tiles' % MAX_SYNC_TILES)
+
+    tiles = []
+    for tile, token in sync.items():
+        try:
+            z, x, y = [int(i) for i in tile.split('/')]
+        except ValueError:
+            raise SyncError('invalid tile "%s"' % tile)
+        if not is_valid_tile(z, x, y):
+            raise SyncError('invalid tile "%s"' % tile)
+
+        since = None
+        if token:
+            since = parse_datetime(token)
+            if since is None:
+                raise SyncError('invalid sync token "%s"' % token)
+        tiles.append((geos.Polygon.from_bbox(tile_bounds(z, x, y)), since))
+    return tiles
+
+def _tiles_q(tiles, time_field, changed_only=False):
+    q = Q(pk__in=[])
+    for bbox, since in tiles:
+        if since is None:
+            if changed_only:
+                continue
+            q |= Q(location__bboverlaps=bbox)
+        else:
+            q |= Q(location__bboverlaps=bbox, **{'%s__gt' % time_field: since})
+    return q
+
+def filter_changed_places(places, tiles, deleted_ids=()):
+    """
+    restrict a Place queryset to places which the client doesn't have an up-to-date copy of. deleted_ids are the
+    places removed from the tiles (see get_deleted_place_ids), which are included if they still exist elsewhere
+    """
+    return places.filter(_tiles_q(tiles, 'updated') | Q(pk__in=deleted_ids))
+
+def get_deleted_place_ids(tiles, public_only=False):
+    """ ids of places deleted from the given tiles since the client's last sync """
+    deleted = DeletedPlace.objects.filter(_tiles_q(tiles, 'deleted', changed_only=True))
+    if public_only:
+        deleted = deleted.filter(is_public=True)
+    return list(deleted.values_list('place_id', flat=True).distinct())
@@ -0,0 +1,210 @@
+"""
+Reproducible synthetic data for benchmarking: languages, places, names and media spread over Western Australia,
+and CSV rows in the format of each column mapping (see featuremap.mappings) for timing imports.
+
+Everything is drawn from a random.Random seeded by the caller, so the same arguments always give the same data.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.gis.geos import Point, LineString, Polygon
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+import io
+import math
+
+from .models import Source, Language, Place, Word, Media
+from .dataset import (RawField, ConcatRawField, LocationFilter, JsonPassthru, Relation, LanguageRelation)
+from .versions import bump_version
+from .features import refresh_map_features
+from .cache import invalidate_all
+from .icons import get_icon_list
+
+import logging
+logger = logging.getLogger(__name__)
+
+SOURCE_NAME = 'Synthetic dataset'
+
+# west, south, east, north
+WA_BBOX = (112.9, -35.1, 129.0, -13.7)
+
+# approximate extent of WA in GDA94 / MGA zone 50 (SRID 28350) eastings and northings
+MGA50_EXTENT = (200000, 6100000, 800000, 8500000)
+
+GEOMETRY_TYPES = ('point', 'line', 'polygon')
+
+CATEGORIES = ['hill', 'waterhole', 'creek', 'rockhole', 'camp', 'station', 'town', 'soak', 'range', 'cave', 'lake']
+
+SYLLABLES = ['ba', 'bu', 'di', 'ga', 'gu', 'ja', 'ji', 'ka', 'ku', 'la', 'li', 'ma', 'mi', 'mu', 'na', 'ngu', 'nya',
+             'pa', 'pi', 'ra', 'ri', 'ta', 'tju', 'wa', 'wi', 'ya', 'yi', 'rr', 'lpa', 'ntu', 'rdi']
+
+MEDIA_FILE = 'synthetic/placeholder.png'
+
+def make_name(rng, min_syllables=2, max_syllables=4):
+    return ''.join(rng.choice(SYLLABLES) for i in range(rng.randint(min_syllables, max_syllables))).capitalize()
+
+def random_lnglat(rng, bbox=WA_BBOX):
+    return rng.uniform(bbox[0], bbox[2]), rng.uniform(bbox[1], bbox[3])
+
+def make_geometry(rng, kind, bbox=WA_BBOX):
+    """ a point, or a line or polygon a few km across, at a random location within bbox """
+    x, y = random_lnglat(rng, bbox)
+    if kind == 'point':
+        return Point(x, y, srid=4326)
+    if kind == 'line':
+        coords = [(x, y)]
+        for i in range(rng.randint(1, 5)):
+            x, y = x + rng.uniform(-0.02, 0.02), y + rng.uniform(-0.02, 0.02)
+            coords.append((x, y))
+        return LineString(coords, srid=4326)
+    if kind == 'polygon':
+        n = rng.randint(5, 8)
+        radius = rng.uniform(0.005, 0.03)
+        ring = [
+            (x + radius * rng.uniform(0.6, 1) * math.cos(2 * math.pi * i / n),
+             y + radius * rng.uniform(0.6, 1) * math.sin(2 * math.pi * i / n))
+            for i in range(n)
+        ]
+        return Polygon(ring + ring[:1], srid=4326)
+    raise ValueError('unknown geometry type: %s' % kind)
+
+def parse_geometry_mix(mix):
+    """ parses eg. "point=8,line=1,polygon=1" into {type: weight} """
+    weights = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in GEOMETRY_TYPES:
+            raise ValueError('geometry type must be one of: %s' % ', '.join(GEOMETRY_TYPES))
+        weights[kind] = float(weight or 1)
+    return weights
+
+def _placeholder_image():
+    """ saves a small image to use as the file of every synthetic media item (once), returns its name """
+    if not default_storage.exists(MEDIA_FILE):
+        from PIL import Image
+        data = io.BytesIO()
+        Image.new('RGB', (64, 48), (200, 120, 60)).save(data, 'PNG')
+        default_storage.save(MEDIA_FILE, ContentFile(data.getvalue()))
+    return MEDIA_FILE
+
+def delete_source(source):
+    """ deletes a source and everything imported from it, returns the number of places deleted """
+    num = Place.objects.filter(source=source).delete()[0]
+    Word.objects.filter(source=source).delete()
+    Language.objects.filter(source=source).delete()
+    source.delete()
+    return num
+
+def generate_dataset(rng, num_places, names_per_place=2, num_languages=20, alt_names=2, media_per_place=0,
+                     geometry_mix=None, source_name=SOURCE_NAME, batch_size=1000):
+    """
+    creates a source with num_languages languages and num_places places, each with names_per_place names (in
+    random languages) and media_per_place images. geometry_mix is {geometry type: weight}, default all points.
+    Returns the source and the number of each kind of object created.
+    """
+    geometry_mix = geometry_mix or {'point': 1}
+    kinds, weights = list(geometry_mix), list(geometry_mix.values())
+    icons = sorted(get_icon_list()) or ['place-name']
+
+    source = Source.objects.create(
+        name = source_name,
+        description = 'Generated by manage.py generate_dataset',
+        can_update = False,
+        pending_import = False,
+    )
+    languages = Language.objects.bulk_create([
+        Language(
+            name = '%s %d' % (make_name(rng), i),
+            alt_names = [make_name(rng) for j in range(alt_names)],
+            colour = '#%06x' % rng.randrange(0x1000000),
+            source = source,
+        )
+        for i in range(num_languages)
+    ])
+
+    media_file = _placeholder_image() if media_per_place else None
+    place_type = ContentType.objects.get_for_model(Place)
+    counts = {'languages': len(languages), 'places': 0, 'names': 0, 'media': 0}
+    for start in range(0, num_places, batch_size):
+        places = Place.objects.bulk_create([
+            Place(
+                category = rng.choice(CATEGORIES),
+                location = make_geometry(rng, rng.choices(kinds, weights)[0]),
+                desc = ' '.join(make_name(rng) for j in range(rng.randint(0, 12))),
+                icon = rng.choice(icons),
+                is_public = rng.random() < 0.9,
+                source = source,
+                source_ref = str(i),
+            )
+            for i in range(start, min(start + batch_size, num_places))
+        ])
+        words = Word.objects.bulk_create([
+            Word(
+                place = place,
+                name = make_name(rng),
+                desc = make_name(rng) if rng.random() < 0.3 else '',
+                language = rng.choice(languages),
+                source = source,
+                source_ref = '%s_%d' % (place.source_ref, j),
+            )
+            for place in places for j in range(names_per_place)
+        ])
+        media = Media.objects.bulk_create([
+            Media(
+                file_type = Media.IMAGE,
+                title = make_name(rng),
+                file = media_file,
+                content_type = place_type,
+                object_id = place.pk,
+            )
+            for place in places for j in range(media_per_place)
+        ])
+        counts['places'] += len(places)
+        counts['names'] += len(words)
+        counts['media'] += len(media)
+        logger.debug('generated %d of %d places' % (counts['places'], num_places))
+
+    # bulk_create doesn't send the signals which keep the derived data up to date
+    bump_version()
+    refresh_map_features(source_id=source.pk)
+    invalidate_all()
+    return source, counts
+
+def _location_columns(location, rng):
+    if location.mode == LocationFilter.WKT:
+        return {location.wkt_field: 'POINT(%f %f)' % random_lnglat(rng)}
+    if location.mode == LocationFilter.LAT_LNG:
+        lng, lat = random_lnglat(rng)
+        return {location.lat_field: '%f' % lat, location.lng_field: '%f' % lng}
+    west, south, east, north = MGA50_EXTENT
+    return {location.east_field: '%.1f' % rng.uniform(west, east), location.north_field: '%.1f' % rng.uniform(south, north)}
+
+def _fill_row(level, row, rng, index, language_names):
+    for field, fmap in level.items():
+        if isinstance(fmap, LanguageRelation):
+            name = fmap.get('name')
+            if isinstance(name, RawField):
+                num = min(2 if name.separator and rng.random() < 0.2 else 1, len(language_names))
+                row[name.value] = (name.separator or ',').join(rng.sample(language_names, num))
+        elif isinstance(fmap, Relation):
+            _fill_row(fmap, row, rng, index, language_names)
+        elif isinstance(fmap, ConcatRawField):
+            for label, column in fmap.value:
+                row.setdefault(column, make_name(rng))
+        elif isinstance(fmap, RawField):
+            row.setdefault(fmap.value, str(index) if field == 'source_ref' else make_name(rng))
+        elif isinstance(fmap, LocationFilter):
+            row.update(_location_columns(fmap, rng))
+        elif isinstance(fmap, JsonPassthru):
+            for column in fmap:
+                row.setdefault(column, str(rng.randint(0, 100000)))
+
+def mapping_rows(colmap, num_rows, rng, language_names=None):
+    """ returns num_rows rows (dicts of column: value, as read from a CSV file) to import with colmap """
+    language_names = language_names or list(Language.objects.values_list('name', flat=True)[:50]) or ['English']
+    rows = []
+    for i in range(num_rows):
+        row = {}
+        _fill_row(colmap, row, rng, i, language_names)
+        rows.append(row)
+    return rows
@@ -1,8 +1,771 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.contrib.gis import geos
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+import datetime
+import json
+import random
+import shutil
+import struct
+import tempfile
 
-from featuremap import models
-from mappings import f10781_placenames_csv
+from featuremap import geobuf, models, lod, profiles
+from featuremap.cache import lnglat_to_tile, tile_range
+from featuremap.details import MAX_BATCH_DETAILS
+from featuremap.files import IMPORT_ENGINES
+from featuremap.mappings import f10781_placenames_csv
+from featuremap.sync import parse_sync_tiles, SyncError, MAX_SYNC_TILES
+from featuremap.synthetic import mapping_rows
+from featuremap.tiles import is_valid_tile, tile_bounds
 
-def ItemUpdateTest(TestCase):
+GEOMETRY_NAMES = {v: k for k, v in geobuf.GEOMETRY_TYPES.items()}
+
+def _varint(buf, pos):
+    value = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7f) << shift
+        shift += 7
+        if b < 0x80:
+            return value, pos
+
+def _fields(buf):
+    """ yields (field number, value) for each field of a protobuf message """
+    pos = 0
+    while pos < len(buf):
+        tag, pos = _varint(buf, pos)
+        field, wire_type = tag >> 3, tag & 7
+        if wire_type == geobuf.VARINT:
+            value, pos = _varint(buf, pos)
+        elif wire_type == geobuf.FIXED64:
+            value = struct.unpack('<d', buf[pos:pos + 8])[0]
+            pos += 8
+        elif wire_type == geobuf.BYTES:
+            length, pos = _varint(buf, pos)
+            value = bytes(buf[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError('unexpected wire type %d' % wire_type)
+        yield field, value
+
+def _packed(buf):
+    values, pos = [], 0
+    while pos < len(buf):
+        value, pos = _varint(buf, pos)
+        values.append(value)
+    return values
+
+def _zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+class GeobufDecoder:
+    """ decodes a Geobuf FeatureCollection into GeoJSON, independently of the encoder """
+    def decode(self, data):
+        self.keys = []
+        self.e = 10 ** 6
+        collection = b''
+        for field, value in _fields(data):
+            if field == 1:
+                self.keys.append(value.decode('utf-8'))
+            elif field == 3:
+                self.e = 10 ** value
+            elif field == 4:
+                collection = value
+
+        features, values, props = [], [], {}
+        for field, value in _fields(collection):
+            if field == 1:
+                features.append(self._feature(value))
+            elif field == 13:
+                values.append(self._value(value))
+            elif field == 15:
+                props = self._props(value, values)
+        return {'type': 'FeatureCollection', 'features': features, 'properties': props}
+
+    def _props(self, indexes, values):
+        indexes = _packed(indexes)
+        return {self.keys[indexes[i]]: values[indexes[i + 1]] for i in range(0, len(indexes), 2)}
+
+    def _value(self, data):
+        field, value = next(_fields(data))
+        if field == 1:
+            return value.decode('utf-8')
+        if field == 4:
+            return -value
+        if field == 5:
+            return bool(value)
+        if field == 6:
+            return json.loads(value.decode('utf-8'))
+        return value
+
+    def _feature(self, data):
+        feature = {'type': 'Feature', 'properties': {}}
+        values = []
+        for field, value in _fields(data):
+            if field == 1:
+                feature['geometry'] = self._geometry(value)
+            elif field == 11:
+                feature['id'] = value.decode('utf-8')
+            elif field == 12:
+                feature['id'] = _zigzag(value)
+            elif field == 13:
+                values.append(self._value(value))
+            elif field == 14:
+                feature['properties'] = self._props(value, values)
+        return feature
+
+    def _line(self, coords, closed=False):
+        points, total = [], [0, 0]
+        for i in range(0, len(coords), 2):
+            total = [total[0] + coords[i], total[1] + coords[i + 1]]
+            points.append([total[0] / self.e, total[1] / self.e])
+        if closed:
+            points.append(points[0])
+        return points
+
+    def _lines(self, coords, lengths, closed):
+        lines, pos = [], 0
+        for length in lengths:
+            lines.append(self._line(coords[pos:pos + length * 2], closed))
+            pos += length * 2
+        return lines
+
+    def _geometry(self, data):
+        gtype, lengths, coords, geometries = None, None, [], []
+        for field, value in _fields(data):
+            if field == 1:
+                gtype = GEOMETRY_NAMES[value]
+            elif field == 2:
+                lengths = _packed(value)
+            elif field == 3:
+                coords = [_zigzag(v) for v in _packed(value)]
+            elif field == 4:
+                geometries.append(self._geometry(value))
+
+        if gtype == 'GeometryCollection':
+            return {'type': gtype, 'geometries': geometries}
+        if gtype == 'Point':
+            c = [coords[0] / self.e, coords[1] / self.e]
+        elif gtype in ('MultiPoint', 'LineString'):
+            c = self._line(coords)
+        elif gtype in ('MultiLineString', 'Polygon'):
+            c = self._lines(coords, lengths or [len(coords) // 2], gtype == 'Polygon')
+        else:
+            if not lengths:
+                c = [self._lines(coords, [len(coords) // 2], True)]
+            else:
+                c, pos, i = [], 0, 1
+                for p in range(lengths[0]):
+                    num_rings = lengths[i]
+                    ring_lengths = lengths[i + 1:i + 1 + num_rings]
+                    size = sum(ring_lengths) * 2
+                    c.append(self._lines(coords[pos:pos + size], ring_lengths, True))
+                    pos += size
+                    i += 1 + num_rings
+        return {'type': gtype, 'coordinates': c}
+
+def _round(coords, digits):
+    if isinstance(coords, list):
+        return [_round(c, digits) for c in coords]
+    return round(coords, digits)
+
+class GeobufTest(SimpleTestCase):
+    POINT = {'type': 'Point', 'coordinates': [115.857123, -31.952456]}
+    LINE = {'type': 'LineString', 'coordinates': [[115.1, -31.2], [115.3, -31.25], [115.6, -31.0]]}
+    POLYGON = {'type': 'Polygon', 'coordinates': [
+        [[115.0, -32.0], [116.0, -32.0], [116.0, -31.0], [115.0, -31.0], [115.0, -32.0]],
+        [[115.2, -31.8], [115.4, -31.8], [115.4, -31.6], [115.2, -31.8]],
+    ]}
+    MULTIPOLYGON = {'type': 'MultiPolygon', 'coordinates': [
+        [[[120.0, -20.0], [121.0, -20.0], [121.0, -19.0], [120.0, -20.0]]],
+        [
+            [[122.0, -22.0], [124.0, -22.0], [124.0, -20.0], [122.0, -20.0], [122.0, -22.0]],
+            [[122.5, -21.5], [123.0, -21.5], [123.0, -21.0], [122.5, -21.5]],
+        ],
+    ]}
+
+    def round_trip(self, encoder, custom_properties=None):
+        return GeobufDecoder().decode(encoder.encode(custom_properties))
+
+    def assertGeometryEqual(self, decoded, geometry, digits=6):
+        self.assertEqual(decoded['type'], geometry['type'])
+        self.assertEqual(_round(decoded['coordinates'], digits), _round(geometry['coordinates'], digits))
+
+    def test_geometries(self):
+        encoder = geobuf.GeobufEncoder()
+        geometries = [self.POINT, self.LINE, self.POLYGON, self.MULTIPOLYGON]
+        for i, geometry in enumerate(geometries):
+            encoder.add_feature(geometry, {}, i)
+        features = self.round_trip(encoder)['features']
+        self.assertEqual(len(features), len(geometries))
+        for i, (feature, geometry) in enumerate(zip(features, geometries)):
+            self.assertEqual(feature['id'], i)
+            self.assertGeometryEqual(feature['geometry'], geometry)
+
+    def test_closed_rings(self):
+        encoder = geobuf.GeobufEncoder()
+        encoder.add_feature(self.POLYGON, {})
+        encoder.add_feature(self.MULTIPOLYGON, {})
+        polygon, multipolygon = [f['geometry'] for f in self.round_trip(encoder)['features']]
+        for ring in polygon['coordinates'] + [r for p in multipolygon['coordinates'] for r in p]:
+            self.assertEqual(ring[0], ring[-1])
+
+    def test_single_ring(self):
+        # polygons with one ring are encoded without lengths
+        polygon = {'type': 'Polygon', 'coordinates': self.POLYGON['coordinates'][:1]}
+        multipolygon = {'type': 'MultiPolygon', 'coordinates': [polygon['coordinates']]}
+        encoder = geobuf.GeobufEncoder()
+        encoder.add_feature(polygon, {})
+        encoder.add_feature(multipolygon, {})
+        decoded = [f['geometry'] for f in self.round_trip(encoder)['features']]
+        self.assertGeometryEqual(decoded[0], polygon)
+        self.assertGeometryEqual(decoded[1], multipolygon)
+
+    def test_precision(self):
+        encoder = geobuf.GeobufEncoder(precision=3)
+        encoder.add_feature(self.POINT, {})
+        decoded = self.round_trip(encoder)['features'][0]['geometry']
+        self.assertEqual(decoded['coordinates'], [115.857, -31.952])
+
+    def test_properties(self):
+        names = geobuf.Dictionary()
+        self.assertEqual(names.add('Kata Tjuta'), 0)
+        self.assertEqual(names.add('Uluru'), 1)
+        self.assertEqual(names.add('Kata Tjuta'), 0)
+
+        props = {'name': 0, 'height': 348.5, 'offset': -12, 'public': True, 'icon': 'hill', 'media': [1, 2]}
+        encoder = geobuf.GeobufEncoder()
+        encoder.add_feature(self.POINT, props, 'place.1')
+        encoder.add_feature(self.LINE, {'name': 1})
+        collection = self.round_trip(encoder, {'names': list(names)})
+        first, second = collection['features']
+        self.assertEqual(first['id'], 'place.1')
+        self.assertEqual(first['properties'], props)
+        self.assertEqual(second['properties'], {'name': 1})
+        self.assertEqual(collection['properties'], {'names': ['Kata Tjuta', 'Uluru']})
+
+class TileTest(SimpleTestCase):
+    def test_is_valid_tile(self):
+        self.assertTrue(is_valid_tile(0, 0, 0))
+        self.assertTrue(is_valid_tile(3, 7, 7))
+        self.assertFalse(is_valid_tile(3, 8, 0))
+        self.assertFalse(is_valid_tile(3, 0, -1))
+        self.assertFalse(is_valid_tile(-1, 0, 0))
+        self.assertFalse(is_valid_tile(23, 0, 0))
+
+    def test_tile_bounds(self):
+        west, south, east, north = tile_bounds(0, 0, 0)
+        self.assertEqual((west, east), (-180.0, 180.0))
+        self.assertAlmostEqual(north, 85.0511, places=4)
+        self.assertAlmostEqual(south, -85.0511, places=4)
+
+        west, south, east, north = tile_bounds(1, 1, 0)
+        self.assertEqual((west, east), (0.0, 180.0))
+        self.assertAlmostEqual(south, 0.0)
+
+class SyncTest(SimpleTestCase):
+    def test_parse_sync_tiles(self):
+        tiles = parse_sync_tiles({'10/851/612': '2024-05-01T10:20:30.123456+00:00', '10/852/612': None})
+        self.assertEqual(len(tiles), 2)
+        (bbox, since), (bbox2, since2) = tiles
+        self.assertEqual(since, datetime.datetime(2024, 5, 1, 10, 20, 30, 123456, tzinfo=datetime.timezone.utc))
+        self.assertIsNone(since2)
+        for (polygon, token), tile in zip(tiles, [(10, 851, 612), (10, 852, 612)]):
+            for value, expected in zip(polygon.extent, tile_bounds(*tile)):
+                self.assertAlmostEqual(value, expected)
+
+    def test_invalid(self):
+        invalid = [
+            [],
+            {'12/%d/0' % i: None for i in range(MAX_SYNC_TILES + 1)},
+            {'1/0': None},
+            {'a/b/c': None},
+            {'1/2/0': None},
+            {'1/0/0': 'yesterday'},
+        ]
+        for sync in invalid:
+            with self.assertRaises(SyncError):
+                parse_sync_tiles(sync)
+
+def make_place(name, lng, lat, language, **kwargs):
+    """ a place with one name, at (lng, lat) """
+    place = models.Place.objects.create(location=geos.Point(lng, lat, srid=4326), **kwargs)
+    models.Word.objects.create(place=place, name=name, language=language)
+    return place
+
+# Western Australia, as map data request bounds
+WA_BOUNDS = {'sw': {'lng': 112.9, 'lat': -35.1}, 'ne': {'lng': 129.0, 'lat': -13.7}}
+
+class MapDataTestCase(TestCase):
+    """ a logged in client, and a few places """
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('mapper', password='mapper')
+        self.client.force_login(self.user)
+        self.language = models.Language.objects.create(name='Noongar', colour='#ff0000')
+        self.places = [
+            make_place('Boorloo', 115.86, -31.95, self.language),
+            make_place('Walyalup', 115.75, -32.05, self.language),
+            make_place('Kalgoorlie', 121.47, -30.75, self.language, is_public=False),
+        ]
+
+    def post_data(self, **data):
+        return self.client.post(reverse('featuremap:data'), json.dumps(data), content_type='application/json')
+
+    def get_data(self, **params):
+        return self.client.get(reverse('featuremap:data'), params)
+
+class MapDataTest(MapDataTestCase):
+
+    def test_clusters_ignore_sync(self):
+        # every zoom 10 tile of the viewport, as sent by the map at low zoom levels
+        sync = {'10/%d/%d' % (x, y): None for x in range(833, 880) for y in range(560, 612)}
+        self.assertGreater(len(sync), MAX_SYNC_TILES)
+        response = self.post_data(zoom=5, bounds=WA_BOUNDS, sync=sync)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['metadata']['clustered'])
+        self.assertNotIn('sync_token', data['metadata'])
+
+    def test_too_many_sync_tiles(self):
+        sync = {'10/%d/%d' % (x, y): None for x in range(833, 880) for y in range(560, 612)}
+        self.assertEqual(self.post_data(zoom=12, bounds=WA_BOUNDS, sync=sync).status_code, 400)
+
+class CacheTileTest(SimpleTestCase):
+    def test_lnglat_to_tile(self):
+        for z, x, y in [(0, 0, 0), (4, 13, 9), (10, 851, 612), (16, 53522, 39122)]:
+            west, south, east, north = tile_bounds(z, x, y)
+            self.assertEqual(lnglat_to_tile((west + east) / 2, (south + north) / 2, z), (x, y))
+        # clamped to the tile scheme
+        self.assertEqual(lnglat_to_tile(180.0, 90.0, 2), (3, 0))
+        self.assertEqual(lnglat_to_tile(-180.0, -90.0, 2), (0, 3))
+
+    def test_tile_range(self):
+        west, south, east, north = tile_bounds(6, 53, 36)
+        margin = 1e-6
+        self.assertEqual(tile_range((west + margin, south + margin, east - margin, north - margin), 6), (53, 36, 53, 36))
+        self.assertEqual(tile_range((112.9, -35.1, 129.0, -13.7), 4), (13, 8, 13, 9))
+
+class LodTest(SimpleTestCase):
+    def test_precision(self):
+        precisions = [lod.get_precision(zoom) for zoom in range(23)]
+        self.assertEqual(precisions, sorted(precisions))
+        for zoom, precision in enumerate(precisions):
+            # half a pixel is resolved, with no more than one extra decimal place
+            self.assertLessEqual(10 ** -precision, lod.get_pixel_size(zoom) / 2)
+            if precision:
+                self.assertGreater(10 ** -(precision - 1), lod.get_pixel_size(zoom) / 2)
+
+    def test_quantise(self):
+        geom = {'type': 'GeometryCollection', 'geometries': [
+            {'type': 'LineString', 'coordinates': [[115.123456, -31.987654], [115.5, -31.5]]},
+            {'type': 'Polygon', 'coordinates': [[[1.26, 2.34], [1.31, 2.36], [1.28, 2.41], [1.26, 2.34]]]},
+        ]}
+        lod._quantise_geometry(geom, 1)
+        line, polygon = geom['geometries']
+        self.assertEqual(line['coordinates'], [[115.1, -32.0], [115.5, -31.5]])
+        self.assertEqual(polygon['coordinates'], [[[1.3, 2.3], [1.3, 2.4], [1.3, 2.4], [1.3, 2.3]]])
+
+    def test_points_not_quantised(self):
+        point = geos.Point(115.857123, -31.952456, srid=4326)
+        self.assertEqual(list(lod.to_geojson(point, zoom=2)['coordinates']), [115.857123, -31.952456])
+
+    def test_to_geojson(self):
+        zoom = 5
+        ring = [(115.123456, -31.123456), (116.123456, -31.123456), (116.123456, -30.123456), (115.123456, -31.123456)]
+        data = lod.to_geojson(geos.Polygon(ring, srid=4326), zoom=zoom)
+        for x, y in data['coordinates'][0]:
+            self.assertEqual(x, round(x, lod.get_precision(zoom)))
+            self.assertEqual(y, round(y, lod.get_precision(zoom)))
+
+    def test_geojson_sql(self):
+        self.assertEqual(lod.geojson_sql('location'), 'ST_AsGeoJSON(location)::json')
+        sql = lod.geojson_sql('location', 5)
+        self.assertIn('ST_SimplifyPreserveTopology(location::geometry', sql)
+        self.assertIn('THEN ST_AsGeoJSON(location)::json', sql)
+
+class ImportEngineTest(TestCase):
+    NUM_ROWS = 30
+    LANGUAGES = ['Noongar', 'Yindjibarndi', 'Martu Wangka']
+    # engines which should give the same results as the row engine
+    ENGINES = ('bulk', 'copy')
+
+    def setUp(self):
+        for name in self.LANGUAGES:
+            models.Language.objects.create(name=name)
+        self.rows = mapping_rows(f10781_placenames_csv, self.NUM_ROWS, random.Random(0), self.LANGUAGES)
+
+    def ingest(self, engine, rows):
+        source = models.Source.objects.get_or_create(name='test: %s' % engine, pending_import=False)[0]
+        count, new, updated = IMPORT_ENGINES[engine](f10781_placenames_csv).bulk_ingest(rows, source)
+        objects = {
+            'Place': models.Place.objects.filter(source=source).count(),
+            'Word': models.Word.objects.filter(place__source=source).count(),
+            'changed': models.Place.objects.filter(source=source, desc='changed').count(),
+        }
+        return count, new, updated, objects
+
+    def test_counts(self):
+        results = {}
+        for engine in ('row', ) + self.ENGINES:
+            first = self.ingest(engine, self.rows)
+            # import the same rows again, then with changes to every second row
+            again = self.ingest(engine, self.rows)
+            changed = [dict(row, comments='changed') if i % 2 else row for i, row in enumerate(self.rows)]
+            results[engine] = (first, again, self.ingest(engine, changed))
+
+        count, new, updated, objects = results['row'][0]
+        self.assertEqual(count, self.NUM_ROWS)
+        self.assertEqual(new['Place'], self.NUM_ROWS)
+        self.assertEqual(objects['Place'], self.NUM_ROWS)
+        # every place matched by source_ref is counted as updated
+        self.assertEqual(results['row'][1][2]['Place'], self.NUM_ROWS)
+        self.assertEqual(results['row'][2][3]['changed'], self.NUM_ROWS // 2)
+        for engine in self.ENGINES:
+            for expected, result in zip(results['row'], results[engine]):
+                count, new, updated, objects = result
+                self.assertEqual(count, expected[0], engine)
+                self.assertEqual(objects, expected[3], engine)
+                for model in ('Place', 'Word'):
+                    self.assertEqual(new.get(model, 0), expected[1].get(model, 0), (engine, model))
+                    self.assertEqual(updated.get(model, 0), expected[2].get(model, 0), (engine, model))
+
+    def test_moved_places(self):
+        for engine in ('row', ) + self.ENGINES:
+            self.ingest(engine, self.rows)
+            moved = [dict(row, north=str(float(row['north']) + 1000)) if i < 5 else row
+                        for i, row in enumerate(self.rows)]
+            self.ingest(engine, moved)
+            # synchronised map clients are told to remove them from their old location
+            deleted = models.DeletedPlace.objects.filter(
+                place_id__in=models.Place.objects.filter(source__name='test: %s' % engine).values('pk'))
+            self.assertEqual(deleted.count(), 5, engine)
+
+    def test_parallel_in_transaction(self):
+        # the worker processes are forked, which isn't safe inside a transaction (see featuremap.parallel)
+        dataset = IMPORT_ENGINES['parallel'](f10781_placenames_csv, workers=2)
+        source = models.Source.objects.create(name='test: parallel', pending_import=False)
+        with self.assertRaises(ValueError):
+            dataset.bulk_ingest(self.rows, source)
+
+class MapCacheTest(MapDataTestCase):
+    PERTH_BBOX = '115.7,-32.1,116.0,-31.9'
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        # a file based cache isn't checked against the data version, like a cache shared between processes
+        settings = override_settings(MAP_CACHE='map_data', CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'map_data': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200)
+        return {w['name'] for f in response.json()['features'] for w in f['properties']['names']}
+
+    def rename(self, name):
+        word = self.places[0].names.get()
+        word.name = name
+        word.save()
+
+    def test_cached(self):
+        self.assertEqual(self.names(self.get_data(bbox=self.PERTH_BBOX)), {'Boorloo', 'Walyalup'})
+        # not read from the database again
+        models.Word.objects.filter(name='Boorloo').update(name='Perth')
+        self.assertEqual(self.names(self.get_data(bbox=self.PERTH_BBOX)), {'Boorloo', 'Walyalup'})
+
+    def test_invalidated_on_commit(self):
+        self.assertEqual(self.names(self.get_data(bbox=self.PERTH_BBOX)), {'Boorloo', 'Walyalup'})
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.rename('Perth')
+            # until the change is committed, other requests can't see it
+            self.assertEqual(self.names(self.get_data(bbox=self.PERTH_BBOX)), {'Boorloo', 'Walyalup'})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.names(self.get_data(bbox=self.PERTH_BBOX)), {'Perth', 'Walyalup'})
+
+    def test_other_tiles_kept(self):
+        kalgoorlie = '121.3,-30.9,121.6,-30.6'
+        self.assertEqual(self.names(self.get_data(bbox=kalgoorlie)), {'Kalgoorlie'})
+        models.Word.objects.filter(name='Kalgoorlie').update(name='Karlkurla')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rename('Perth')
+        self.assertEqual(self.names(self.get_data(bbox=kalgoorlie)), {'Kalgoorlie'})
+
+    def test_moved_name(self):
+        kalgoorlie = '121.3,-30.9,121.6,-30.6'
+        self.assertEqual(self.names(self.get_data(bbox=kalgoorlie)), {'Kalgoorlie'})
+        # the name is moved away from the place it was on
+        word = models.Word.objects.get(name='Kalgoorlie')
+        with self.captureOnCommitCallbacks(execute=True):
+            word.place = self.places[0]
+            word.save()
+        self.assertEqual(self.names(self.get_data(bbox=kalgoorlie)), set())
+        self.assertEqual(models.MapFeature.objects.get(pk=self.places[2].pk).label, '')
+        self.assertEqual(models.MapFeature.objects.get(pk=self.places[0].pk).lang_ids, [self.language.pk] * 2)
+
+class ETagTest(MapDataTestCase):
+    PARAMS = {'bbox': '115.7,-32.1,116.0,-31.9'}
+
+    def test_not_modified(self):
+        response = self.get_data(**self.PARAMS)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('featuremap:data'), self.PARAMS, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified(self):
+        etag = self.get_data(**self.PARAMS)['ETag']
+        # a change anywhere changes the version
+        self.places[2].desc = 'Goldfields'
+        self.places[2].save()
+        response = self.client.get(reverse('featuremap:data'), self.PARAMS, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_other_requests(self):
+        etag = self.get_data(**self.PARAMS)['ETag']
+        self.assertNotEqual(self.get_data(bbox='121.3,-30.9,121.6,-30.6')['ETag'], etag)
+        # sync requests are specific to the client
+        self.assertFalse(self.post_data(bounds=WA_BOUNDS).has_header('ETag'))
+
+    def test_detail(self):
+        url = reverse('featuremap:detail', kwargs={'place_id': self.places[0].pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        word = self.places[0].names.get()
+        word.desc = 'Perth'
+        word.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+class ClusterTest(MapDataTestCase):
+    def test_clustered(self):
+        response = self.get_data(bbox='112.9,-35.1,129.0,-13.7', zoom=2)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['metadata']['clustered'])
+        self.assertEqual(sum(f['properties']['count'] for f in data['features']), len(self.places))
+        for feature in data['features']:
+            self.assertTrue(feature['properties']['cluster'])
+            self.assertEqual(feature['geometry']['type'], 'Point')
+            self.assertEqual(feature['properties']['langs'], [self.language.pk])
+        names = {n for f in data['features'] for n in f['properties']['names']}
+        self.assertEqual(names, {'Boorloo', 'Walyalup', 'Kalgoorlie'})
+        self.assertEqual([l['id'] for l in data['metadata']['langs']], [self.language.pk])
+
+    def test_grid(self):
+        # Boorloo and Walyalup are about 15km apart: in one cell at zoom 5, and separate at zoom 9
+        bbox = '115.5,-32.5,116.5,-31.5'
+        counts = sorted(f['properties']['count'] for f in self.get_data(bbox=bbox, zoom=5).json()['features'])
+        self.assertEqual(counts, [2])
+        counts = sorted(f['properties']['count'] for f in self.get_data(bbox=bbox, zoom=9).json()['features'])
+        self.assertEqual(counts, [1, 1])
+
+    @override_settings(CLUSTER_MAX_ZOOM=10)
+    def test_not_clustered(self):
+        data = self.get_data(bbox='112.9,-35.1,129.0,-13.7', zoom=10).json()
+        self.assertFalse(data['metadata']['clustered'])
+        self.assertEqual({f['properties']['id'] for f in data['features']}, {p.pk for p in self.places})
+
+class ProfileTest(MapDataTestCase):
+    BBOX = '115.7,-32.1,116.0,-31.9'
+
+    def properties(self, **params):
+        response = self.get_data(bbox=self.BBOX, **params)
+        self.assertEqual(response.status_code, 200)
+        return {f['properties']['id']: f['properties'] for f in response.json()['features']}
+
+    def test_get_fields(self):
+        self.assertEqual(profiles.get_fields(), profiles.PROFILES[profiles.DEFAULT_PROFILE])
+        self.assertEqual(profiles.get_fields('marker'), profiles.PROFILES['marker'])
+        # in output order, whatever order they are requested in
+        self.assertEqual(profiles.get_fields(fields='label, id'), ('id', 'label'))
+        self.assertEqual(profiles.get_fields('marker', ['icon']), ('icon', ))
+        with self.assertRaises(ValueError):
+            profiles.get_fields('everything')
+        with self.assertRaises(ValueError):
+            profiles.get_fields(fields='id,password')
+
+    def test_marker(self):
+        props = self.properties(profile='marker')[self.places[0].pk]
+        self.assertEqual(props, {'id': self.places[0].pk, 'icon': 'place-name', 'label': 'Boorloo',
+                                 'colour': self.language.colour})
+
+    def test_fields(self):
+        props = self.properties(fields='id,category')
+        self.assertEqual(set(props), {self.places[0].pk, self.places[1].pk})
+        for p in props.values():
+            self.assertEqual(set(p), {'id', 'category'})
+
+    def test_names(self):
+        props = self.properties(profile='popup')[self.places[0].pk]
+        self.assertEqual(set(props), set(profiles.PROFILES['popup']))
+        self.assertEqual([(n['name'], n['lang']['id']) for n in props['names']], [('Boorloo', self.language.pk)])
+        # the full profile includes the basic fields of names as well
+        names = self.properties()[self.places[0].pk]['names']
+        self.assertIn('source', names[0])
+
+    def test_invalid(self):
+        self.assertEqual(self.get_data(bbox=self.BBOX, profile='everything').status_code, 400)
+        self.assertEqual(self.get_data(bbox=self.BBOX, fields='id,password').status_code, 400)
+
+class LegendTest(MapDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = models.Language.objects.create(name='Yindjibarndi')
+        place = make_place('Ngurrawaana', 117.9, -21.9, self.other)
+        models.Word.objects.create(place=place, name='Ngurrawaana Community', language=self.other)
+        # names of places without a location are not on the map
+        unlocated = models.Place.objects.create()
+        models.Word.objects.create(place=unlocated, name='Nowhere', language=self.other)
+        models.Language.objects.create(name='Unused')
+
+    def get_legend(self, **headers):
+        return self.client.get(reverse('featuremap:legend'), **headers)
+
+    def test_counts(self):
+        response = self.get_legend()
+        self.assertEqual(response.status_code, 200)
+        langs = [(l['name'], l['num_places'], l['num_names']) for l in response.json()['langs']]
+        self.assertEqual(langs, [('Noongar', 3, 3), ('Yindjibarndi', 1, 2)])
+
+    def test_not_modified(self):
+        response = self.get_legend()
+        self.assertEqual(self.get_legend(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        make_place('Mandurah', 115.72, -32.53, self.language)
+        response = self.get_legend(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['langs'][0]['num_places'], 4)
+
+class DetailsTest(MapDataTestCase):
     def setUp(self):
-        pass
\ No newline at end of file
+        super().setUp()
+        settings = override_settings(MAP_CACHE='map_data', CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'map_data': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'details-test'},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get_details(self, ids, **params):
+        response = self.client.get(reverse('featuremap:details'), dict(params, ids=','.join(map(str, ids))))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['places']
+
+    def test_html(self):
+        ids = [p.pk for p in self.places[:2]]
+        details = self.get_details(ids)
+        self.assertEqual(set(details), {str(pk) for pk in ids})
+        self.assertIn('Boorloo', details[str(ids[0])])
+        self.assertIn('Walyalup', details[str(ids[1])])
+
+    def test_json(self):
+        details = self.get_details([self.places[0].pk], format='json')
+        feature = details[str(self.places[0].pk)]
+        self.assertEqual(feature['properties']['names'][0]['name'], 'Boorloo')
+
+    def test_changed(self):
+        pk = self.places[0].pk
+        self.assertIn('Boorloo', self.get_details([pk])[str(pk)])
+        word = self.places[0].names.get()
+        word.name = 'Perth'
+        word.save()
+        # the cached fragment is keyed by the updated time of the names
+        detail = self.get_details([pk])[str(pk)]
+        self.assertIn('Perth', detail)
+        self.assertNotIn('Boorloo', detail)
+
+    def test_missing(self):
+        self.assertEqual(self.get_details([self.places[0].pk, 0]).keys(), {str(self.places[0].pk)})
+
+    def test_invalid(self):
+        url = reverse('featuremap:details')
+        self.assertEqual(self.client.get(url, {'ids': '1,a'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': '1', 'format': 'xml'}).status_code, 400)
+        ids = ','.join(str(i) for i in range(MAX_BATCH_DETAILS + 1))
+        self.assertEqual(self.client.get(url, {'ids': ids}).status_code, 400)
+
+class SearchTest(MapDataTestCase):
+    def setUp(self):
+        super().setUp()
+        models.Place.objects.filter(pk=self.places[0].pk).update(category='waterhole')
+        models.Language.objects.filter(pk=self.language.pk).update(alt_names=['Nyungar'])
+        # the same name in two places
+        self.perth_wells = make_place('Warrawarra', 115.8, -32.0, self.language)
+        self.goldfields_wells = make_place('Warrawarra', 121.4, -30.8, self.language)
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('featuremap:search'), dict(params, q=q))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_places(self):
+        places = self.search('boorl')['places']
+        self.assertEqual(places[0]['id'], self.places[0].pk)
+        self.assertEqual(places[0]['lang']['name'], 'Noongar')
+        self.assertAlmostEqual(places[0]['location'][0], 115.86)
+        # misspelt
+        self.assertEqual(self.search('Borloo')['places'][0]['name'], 'Boorloo')
+
+    def test_languages(self):
+        self.assertEqual([l['id'] for l in self.search('noonga')['languages']], [self.language.pk])
+        self.assertEqual([l['id'] for l in self.search('nyunga')['languages']], [self.language.pk])
+
+    def test_categories(self):
+        self.assertEqual(self.search('waterh')['categories'][0]['category'], 'waterhole')
+        self.assertEqual(self.search('waterh')['categories'][0]['num_places'], 1)
+
+    def test_viewport_first(self):
+        goldfields = '121.0,-31.0,122.0,-30.5'
+        self.assertEqual(self.search('Warrawarra', bbox=goldfields)['places'][0]['id'], self.goldfields_wells.pk)
+        perth = '115.5,-32.5,116.5,-31.5'
+        self.assertEqual(self.search('Warrawarra', bbox=perth)['places'][0]['id'], self.perth_wells.pk)
+
+    def test_limit(self):
+        self.assertEqual(len(self.search('Warrawarra', limit=1)['places']), 1)
+        self.assertEqual(len(self.search('Warrawarra', limit=0)['places']), 1)
+
+    def test_short_query(self):
+        self.assertEqual(self.search('b'), {'places': [], 'languages': [], 'categories': []})
+
+    def test_invalid(self):
+        url = reverse('featuremap:search')
+        self.assertEqual(self.client.get(url, {'q': 'boorl', 'limit': 'ten'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'q': 'boorl', 'bbox': '1,2,3'}).status_code, 400)
+
+class NearestTest(MapDataTestCase):
+    # in Fremantle, closer to Walyalup than to Boorloo
+    POINT = {'lng': 115.76, 'lat': -32.04}
+
+    def nearest(self, **params):
+        response = self.client.get(reverse('featuremap:nearest'), dict(self.POINT, **params))
+        self.assertEqual(response.status_code, 200)
+        return [(f['properties']['id'], f['properties']['distance']) for f in response.json()['features']]
+
+    def test_nearest_first(self):
+        nearest = self.nearest()
+        self.assertEqual([pk for pk, distance in nearest], [self.places[1].pk, self.places[0].pk, self.places[2].pk])
+        distances = [distance for pk, distance in nearest]
+        self.assertEqual(distances, sorted(distances))
+        # metres
+        self.assertAlmostEqual(distances[0], 1458, delta=10)
+
+    def test_limit(self):
+        self.assertEqual([pk for pk, distance in self.nearest(limit=1)], [self.places[1].pk])
+        self.assertEqual(len(self.nearest(limit=0)), 1)
+
+    def test_filters(self):
+        self.assertEqual(len(self.nearest(max_distance=50000)), 2)
+        other = models.Language.objects.create(name='Wangkatha')
+        models.Word.objects.create(place=self.places[2], name='Kalgurli', language=other)
+        self.assertEqual([pk for pk, distance in self.nearest(lang=other.pk)], [self.places[2].pk])
+        models.Place.objects.filter(pk=self.places[0].pk).update(category='waterhole')
+        self.assertEqual([pk for pk, distance in self.nearest(category='waterhole')], [self.places[0].pk])
+
+    def test_invalid(self):
+        url = reverse('featuremap:nearest')
+        self.assertEqual(self.client.get(url, {'lng': '115.76'}).status_code, 400)
+        self.assertEqual(self.client.get(url, dict(self.POINT, limit='ten')).status_code, 400)
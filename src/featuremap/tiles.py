@@ -0,0 +1,82 @@
+"""
+Mapbox Vector Tiles (MVT) for the map, generated directly by PostGIS using ST_AsMVT/ST_AsMVTGeom.
+
+Each tile only carries the properties needed to draw a marker: place id, first name, language colour and icon.
+Everything else is loaded on demand from the detail view.
+"""
+
+from django.db import connection
+import math
+
+from .models import Place, Word, Language
+
+import logging
+logger = logging.getLogger(__name__)
+
+# MVT layer name and tile geometry parameters (see ST_AsMVTGeom docs)
+TILE_LAYER = 'places'
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_MAX_ZOOM = 22
+
+TILE_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom
+), mvtgeom AS (
+    SELECT
+        ST_AsMVTGeom(ST_Transform(p.location::geometry, 3857), bounds.geom, %(extent)s, %(buffer)s, true) AS geom,
+        p.id AS id,
+        w.name AS name,
+        l.colour AS colour,
+        p.icon AS icon
+    FROM {place} p
+    CROSS JOIN bounds
+    LEFT JOIN LATERAL (
+        SELECT name, language_id FROM {word} WHERE place_id = p.id ORDER BY id LIMIT 1
+    ) w ON true
+    LEFT JOIN {language} l ON l.id = w.language_id
+    WHERE p.location IS NOT NULL
+        AND p.location && ST_Transform(bounds.geom, 4326)::geography
+        {extra_where}
+)
+SELECT ST_AsMVT(mvtgeom.*, %(layer)s, %(extent)s, 'geom') FROM mvtgeom
+"""
+
+def is_valid_tile(z, x, y):
+    """ check the tile coordinates are within the XYZ tile scheme for the given zoom """
+    if z < 0 or z > TILE_MAX_ZOOM:
+        return False
+    n = 2 ** z
+    return 0 <= x < n and 0 <= y < n
+
+def tile_bounds(z, x, y):
+    """ returns (west, south, east, north) in WGS84 degrees for the given XYZ tile """
+    n = 2.0 ** z
+    lat = lambda ty: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return (x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y))
+
+def get_tile_sql(public_only=False):
+    return TILE_SQL.format(
+        place = Place._meta.db_table,
+        word = Word._meta.db_table,
+        language = Language._meta.db_table,
+        extra_where = 'AND p.is_public' if public_only else '',
+    )
+
+def get_place_tile(z, x, y, public_only=False):
+    """ returns the encoded MVT tile (bytes) containing places for the given z/x/y tile coordinates """
+    params = {
+        'z': z,
+        'x': x,
+        'y': y,
+        'extent': TILE_EXTENT,
+        'buffer': TILE_BUFFER,
+        'layer': TILE_LAYER,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(get_tile_sql(public_only), params)
+        row = cursor.fetchone()
+
+    tile = bytes(row[0]) if row and row[0] else b''
+    logger.debug('tile %d/%d/%d: %d bytes' % (z, x, y, len(tile)))
+    return tile
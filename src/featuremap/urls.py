@@ -6,7 +6,13 @@ from django.conf import settings
 from featuremap import views
 from featuremap.auth import token_login_view
 from featuremap.admin import admin_site
-from featuremap.apps import get_detail_url
+from featuremap.apps import get_detail_url, get_async_views
+
+if get_async_views():
+    # the same views, run in a bounded thread pool under ASGI
+    from featuremap import async_views as data_views
+else:
+    data_views = views
 
 app_name = 'featuremap'
 
@@ -14,9 +20,15 @@ urlpatterns = [
     path('', RedirectView.as_view(url=reverse_lazy('featuremap:map'), permanent=True)),
     path('map/', views.leaflet_view, name='map'),
 
-    path('data/', views.places_json, name='data'),
-    path(get_detail_url() + '<int:place_id>/', views.place_detail, name='detail'),
+    path('data/', data_views.places_json, name='data'),
+    path('data/languages/', views.languages_json, name='legend'),
+    path('search/', data_views.search_json, name='search'),
+    path('nearest/', data_views.nearest_json, name='nearest'),
+    path('tiles/<int:z>/<int:x>/<int:y>.pbf', data_views.place_tile, name='tile'),
+    path(get_detail_url() + '<int:place_id>/', data_views.place_detail, name='detail'),
+    path(get_detail_url() + 'batch/', data_views.place_details, name='details'),
     path('about/', views.AboutView.as_view(), name='about'),
+    path('metrics', views.metrics, name='metrics'),
 
     path('user/<login_token>/', token_login_view, name='map_login'),
 ]
@@ -0,0 +1,55 @@
+"""
+Version counter for the map data.
+
+The counter is bumped by model signals (see signals.py) whenever anything shown on the map changes, and is used to
+build ETags so that unchanged responses can be answered with "304 Not Modified" without running any queries for
+places. There is a single counter: a response which only shows the places of one source still shows the names and
+languages of other sources.
+"""
+
+from django.db.models import F
+from contextlib import contextmanager
+import threading
+
+from .models import DataVersion
+
+GLOBAL_KEY = 'global'
+
+_local = threading.local()
+
+def _increment():
+    if not DataVersion.objects.filter(key=GLOBAL_KEY).update(version=F('version') + 1):
+        DataVersion.objects.get_or_create(key=GLOBAL_KEY)
+
+def bump_version():
+    """ increment the version, or once at the end if bumps are deferred """
+    if getattr(_local, 'pending', None) is not None:
+        _local.pending = True
+    else:
+        _increment()
+
+@contextmanager
+def deferred_bumps():
+    """
+    collect version bumps (eg. during an import) and apply them once at the end.
+    Cached map data is not invalidated for each change either, the caller is responsible for that.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        # already deferring
+        yield
+        return
+
+    _local.pending = False
+    try:
+        yield
+    finally:
+        pending = _local.pending
+        _local.pending = None
+        if pending:
+            _increment()
+
+def bumps_deferred():
+    return getattr(_local, 'pending', None) is not None
+
+def get_version():
+    return DataVersion.objects.filter(key=GLOBAL_KEY).values_list('version', flat=True).first() or 0
@@ -1,10 +1,16 @@
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseForbidden
+from django.template.loader import render_to_string
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseForbidden,
+                         StreamingHttpResponse, Http404)
 from django.conf import settings
 from django.views.generic.base import TemplateView
 from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from django.views.decorators.cache import never_cache
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.translation import gettext as _
 from django.forms.models import model_to_dict
+from django.db.models import Prefetch
 from django.contrib.gis import geos
 from django.contrib.auth.decorators import login_required
 from django.contrib import auth
@@ -12,12 +18,31 @@ from django.urls import reverse, get_script_prefix
 
 import geojson
 import json
+import itertools
+import hashlib
+import gzip
 
 from django.core.serializers import serialize
-from .models import Place, Language, UserWithToken
-from .icons import get_icon_url_dict
+from .models import Place, Word, Language, UserWithToken, MapFeature
+from .icons import get_icon_url_dict, get_icons_metadata
 from .auth import login_or_token_required
-from .apps import get_site_name, get_detail_url
+from .apps import (get_site_name, get_detail_url, get_tile_max_age, get_cluster_max_zoom,
+                   get_cluster_cell_size, get_map_data_engine, get_map_data_chunk_size,
+                   get_sync_tile_zoom, get_legend_max_age, get_metrics_ips)
+from .clustering import cluster_places
+from .geojson_sql import places_geojson_sql
+from .features import features_geojson_sql
+from . import lod, geobuf, profiles
+from .tiles import get_place_tile, is_valid_tile
+from .sync import (parse_sync_tiles, filter_changed_places, get_deleted_place_ids, new_sync_token,
+                   MAX_SYNC_TILES)
+from .versions import get_version
+from .cache import CachedRegion, get_cache
+from .legend import get_language_legend_json
+from .details import get_place_details, MAX_BATCH_DETAILS
+from .search import search, MIN_QUERY_LENGTH as MIN_SEARCH_QUERY_LENGTH, MAX_RESULTS as MAX_SEARCH_RESULTS
+from .nearest import nearest_places, MAX_NEAREST
+from .metrics import render_metrics
 
 import logging
 logger = logging.getLogger(__name__)
@@ -31,6 +56,11 @@ class AboutView(TemplateView):
         ctx['title'] = get_site_name()
         return ctx
 
+def get_tile_url_template():
+    """ Leaflet-style URL template for the vector tile endpoint, eg. /tiles/{z}/{x}/{y}.pbf """
+    url = reverse('featuremap:tile', kwargs={'z': 0, 'x': 0, 'y': 0})
+    return url.replace('0/0/0.pbf', '{z}/{x}/{y}.pbf')
+
 def get_js_context():
     """
     Returns a dict to be translated into javascript variables in the rendered view DOM.
@@ -38,7 +68,14 @@ def get_js_context():
     """
     return {
         'data_url': reverse('featuremap:data'),
+        'legend_url': reverse('featuremap:legend'),
+        'search_url': reverse('featuremap:search'),
+        'tile_url': get_tile_url_template(),
+        'sync_tile_zoom': get_sync_tile_zoom(),
+        'max_sync_tiles': MAX_SYNC_TILES,
+        'cluster_max_zoom': get_cluster_max_zoom(),
         'detail_url_base': get_script_prefix() + get_detail_url(),
+        'detail_batch_url': reverse('featuremap:details'),
         'map_url': reverse('featuremap:map'),
         'about_url': reverse('featuremap:about'),
         'csrf_cookie_name': getattr(settings, 'CSRF_COOKIE_NAME'),
@@ -48,7 +85,6 @@ def get_map_context(request, *args, **kwargs):
     return {
         'title': get_site_name(),
         'js': get_js_context(),
-        'langs': Language.objects.all(),
     }
 
 @login_required
@@ -56,31 +92,81 @@ def leaflet_view(request, *args, **kwargs):
     """ The main maps view """
     return render(request, 'maps_leaflet.html', get_map_context(request, *args, **kwargs))
 
+def _place_detail_etag(request, *args, place_id=None, **kwargs):
+    return 'detail-%s-%d' % (place_id, get_version())
+
+def _render_detail_html(place):
+    return render_to_string('place_detail.html', {'item': place})
+
+def _render_detail_json(place):
+    return _get_place(place)
+
+DETAIL_RENDERERS = {
+    'html': _render_detail_html,
+    'json': _render_detail_json,
+}
+
+@condition(etag_func=_place_detail_etag)
 def place_detail(request, *args, place_id=None, **kwargs):
     """ The place detail view """
-    context = {
-        'item': Place.objects.get(id=place_id),
-    }
-    return render(request, 'place_detail.html', context)
-
-def _get_basic_data(inst, extrafields=[]):
-    """ gets the baseline data in a dict form """
-    fields = ['id', 'updated', 'created', 'owner', 'metadata']
-    data = model_to_dict(inst, fields = fields + extrafields)
-    data['media'] = [
-        {
-            "id": m.pk,
-            "href": m.get_absolute_url(),
-            "type": m.file_type,
-            "desc": m.description,
-        }
-        for m in inst.media.all()
-    ]
-    data['source'] = inst.source.id if inst.source else None
+    details = get_place_details(Place.objects.filter(id=place_id), _render_detail_html)
+    if place_id not in details:
+        raise Http404()
+    return HttpResponse(details[place_id])
+
+def _get_detail_ids(request):
+    return [int(i) for i in request.GET.get('ids', '').split(',') if i]
+
+def _place_details_etag(request, *args, **kwargs):
+    try:
+        ids = _get_detail_ids(request)
+    except ValueError:
+        return None
+    key = '%s:%s:%s' % (','.join(map(str, sorted(ids))), request.GET.get('format', 'html'), request.user.is_authenticated)
+    return 'details-%s-%d' % (hashlib.sha1(key.encode()).hexdigest(), get_version())
+
+@condition(etag_func=_place_details_etag)
+@gzip_page
+def place_details(request):
+    """
+    Details of many places in one request, eg. to prefetch the popups of the visible markers.
+    ids=1,2,3 and format=html (popup fragments, the default) or json (features), returns {"places": {id: detail}}
+    """
+    try:
+        ids = _get_detail_ids(request)
+    except ValueError:
+        return HttpResponseBadRequest()
+    fmt = request.GET.get('format', 'html')
+    if fmt not in DETAIL_RENDERERS or len(ids) > MAX_BATCH_DETAILS:
+        return HttpResponseBadRequest()
+
+    places = Place.objects.filter(id__in=ids)
+    if not request.user.is_authenticated:
+        places = places.filter(is_public=True)
+    details = get_place_details(places, DETAIL_RENDERERS[fmt], fmt)
+    response = HttpResponse(geojson.dumps({'places': details}), content_type=JSON_CONTENT_TYPE)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def _get_basic_data(inst, extrafields=[], fields=profiles.BASIC_FIELDS):
+    """ gets the baseline data in a dict form, limited to fields """
+    data = model_to_dict(inst, fields = [f for f in ('id', 'owner', 'metadata') if f in fields] + extrafields)
+    if 'media' in fields:
+        data['media'] = [
+            {
+                "id": m.pk,
+                "href": m.get_absolute_url(),
+                "type": m.file_type,
+                "desc": m.description,
+            }
+            for m in inst.media.all()
+        ]
+    if 'source' in fields:
+        data['source'] = inst.source_id
     return data
 
-def _get_word(w):
-    data = _get_basic_data(w)
+def _get_word(w, fields=profiles.BASIC_FIELDS):
+    data = _get_basic_data(w, fields=fields)
     data.update({
         "name": w.name,
         "desc": w.desc,
@@ -91,64 +177,419 @@ def _get_word(w):
         },
     })
     return data
-    
-def _get_place_properties(p):
+
+def _get_place_properties(p, fields=profiles.PROFILES['full']):
     # transform DB geometries into workable format
     #p.location.coords = p.location.coords[::-1]
-    props = _get_basic_data(p, ['category', 'icon'])
-    props.update({
-        "names": [_get_word(w) for w in p.names.all()],
-    })
+    props = _get_basic_data(p, [f for f in ('category', 'icon', 'desc', 'location_desc') if f in fields], fields)
+    if profiles.needs_names(fields):
+        names = list(p.names.all())
+        if 'names' in fields:
+            props["names"] = [_get_word(w, fields) for w in names]
+        if 'label' in fields:
+            props["label"] = names[0].name if names else None
+        if 'colour' in fields:
+            props["colour"] = names[0].language.colour if names else None
     return props
 
-def _get_place(p):
-    geom = geojson.loads(p.location.geojson);
-    props = _get_place_properties(p)
+def _get_place(p, zoom=None, fields=profiles.PROFILES['full']):
+    geom = lod.to_geojson(p.location, zoom)
+    props = _get_place_properties(p, fields)
     return geojson.Feature(geometry=geom, properties=props)
 
-@login_required
-@gzip_page
-def places_json(request):
-    """ basically just dump the database into JSON, with some optimisations for the map service """
-    places = Place.objects.filter(location__isnull=False)
+def _project_places(places, fields):
+    """ limit the columns and related objects fetched for places to those needed for fields """
+    if fields == profiles.PROFILES['full']:
+        return places
 
-    if not request.user.is_authenticated:
-        places = places.filter(is_public=True)
+    places = places.select_related(None).prefetch_related(None).only(
+        'id', 'location', *[f for f in ('owner', 'metadata', 'category', 'icon', 'desc', 'location_desc', 'source')
+                            if f in fields])
+    prefetch = []
+    if 'media' in fields:
+        prefetch.append('media')
+    if profiles.needs_names(fields):
+        words = Word.objects.select_related(None).prefetch_related(None).select_related('language').only(
+            'id', 'place', 'name', 'desc', 'language', 'language__name', 'language__colour',
+            *[f for f in ('owner', 'metadata', 'source') if f in fields]).order_by('id')
+        prefetch.append(Prefetch('names', queryset=words))
+        if 'media' in fields and 'names' in fields:
+            prefetch.append('names__media')
+    return places.prefetch_related(*prefetch)
+
+def _get_langs_metadata(langs, fields):
+    """ languages used by the names in the response, in full only if the full profile was requested """
+    langs = sorted(langs.values(), key = lambda l: l.name)
+    if fields == profiles.PROFILES['full']:
+        return [model_to_dict(l) for l in langs]
+    return [{'id': l.pk, 'name': l.name, 'colour': l.colour} for l in langs]
 
+def _iter_places_chunked(places, chunk_size, fields=profiles.PROFILES['full']):
+    """
+    Iterate over places using a server-side cursor, fetching related objects one chunk at a time.
+    QuerySet.iterator() ignores prefetch_related, so only the ids are read from the cursor.
+    """
+    ids = places.values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(ids, chunk_size))
+        if not chunk:
+            break
+        yield from _project_places(Place.objects.filter(id__in=chunk), fields).order_by('id')
+
+def _stream_places_json(places, chunk_size, extra_metadata, zoom=None, fields=profiles.PROFILES['full']):
+    """ generates the FeatureCollection incrementally, one feature at a time """
+    langs = {}
+    yield '{"type": "FeatureCollection", "features": ['
+    for i, p in enumerate(_iter_places_chunked(places, chunk_size, fields)):
+        if profiles.needs_names(fields):
+            for w in p.names.all():
+                langs.setdefault(w.language.pk, w.language)
+        yield (', ' if i else '') + geojson.dumps(_get_place(p, zoom, fields))
+
+    # language metadata is only known once all the places have been seen
+    metadata = {
+        "clustered": False,
+        "langs": _get_langs_metadata(langs, fields),
+        **get_icons_metadata(),
+    }
+    metadata.update(extra_metadata)
+    yield '], "metadata": %s}' % geojson.dumps(metadata)
+
+def _get_clustered_json(places, zoom):
+    """ aggregate places into grid clusters, for low zoom levels """
+    features, lang_ids = cluster_places(places, zoom, get_cluster_cell_size())
+    features = geojson.FeatureCollection(features)
+    langs = Language.objects.filter(id__in=lang_ids).order_by('name')
+    features.metadata = {
+        "clustered": True,
+        "langs": [model_to_dict(l) for l in langs],
+        **get_icons_metadata(),
+    }
+    return geojson.dumps(features)
+
+def _get_request_data(request):
+    """ map data request parameters, from the JSON body (POST) or the query string (GET) """
     if request.method == 'POST':
-        # parse json request data and include in query
-        try:
-            data = json.loads(request.body)
-            b = data.get('bounds', None)
-            if b:
-                bbox = geos.Polygon.from_bbox((b['sw']['lng'], b['sw']['lat'],
-                                               b['ne']['lng'], b['ne']['lat']))
-                logger.debug('search bbox=%s' % bbox)
-                places = places.filter(location__bboverlaps=bbox)
-
-            loaded_ids = data.get('alreadyLoaded', None)
-            if loaded_ids and isinstance(loaded_ids, list):
-                 places = places.exclude(id__in=loaded_ids)
-        except (json.JSONDecodeError, KeyError):
-            logger.error('invalid request data')
-            return HttpResponseBadRequest()
+        return json.loads(request.body)
 
+    data = {}
+    bbox = request.GET.get('bbox', None)
+    if bbox:
+        # bbox=west,south,east,north
+        w, s, e, n = [float(v) for v in bbox.split(',')]
+        data['bounds'] = {'sw': {'lng': w, 'lat': s}, 'ne': {'lng': e, 'lat': n}}
+    for key in ('zoom', 'profile', 'fields'):
+        if key in request.GET:
+            data[key] = request.GET[key]
+    return data
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+def _wants_geobuf(request):
+    """ clients can request the compact binary format using the Accept header """
+    return geobuf.CONTENT_TYPE in request.META.get('HTTP_ACCEPT', '')
+
+def _map_data_response(features_json, streaming=False, content_type=JSON_CONTENT_TYPE):
+    response_class = StreamingHttpResponse if streaming else HttpResponse
+    response = response_class(features_json, content_type=content_type)
+    # responses may be stored, but must be revalidated using the ETag (see _places_json_etag)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept', ))
+    return response
+
+def _places_json_etag(request):
+    """ only GET requests can be cached, POST requests contain sync data specific to the client """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    key = [
+        get_version(),
+        request.user.is_authenticated,
+        get_map_data_engine(),
+        sorted(request.GET.items()),
+        # gzip_page changes the representation, so it needs a different ETag
+        'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''),
+        _wants_geobuf(request),
+    ]
+    return 'data-%s' % hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+def _get_places_json(places, extra_metadata, zoom=None, fields=profiles.PROFILES['full']):
+    """
+    serialise the places using the configured engine, returns (content, is_streaming).
+    Geometries are simplified for the zoom level, if given. Only the given fields are included for each place.
+    """
+    engine = get_map_data_engine()
+    if engine == 'sql':
+        # let the database build the whole document
+        return places_geojson_sql(places, dict(get_icons_metadata(), **extra_metadata), zoom, fields), False
+    elif engine == 'features':
+        # places is a queryset of MapFeatures, which always have the compact properties
+        return features_geojson_sql(places, dict(get_icons_metadata(), **extra_metadata), zoom), False
+    elif engine == 'stream':
+        # gzip_page compresses streaming responses incrementally as well
+        return _stream_places_json(places, get_map_data_chunk_size(), extra_metadata, zoom, fields), True
+
+    places = _project_places(places, fields)
     # make a feature collection for json export
-    features = geojson.FeatureCollection([_get_place(p) for p in places])
+    features = geojson.FeatureCollection([_get_place(p, zoom, fields) for p in places])
     
     # include some data for languages etc. in the response
-    langs = []
-    for p in places:
-        for w in p.names.all():
-            if not w.language in langs:
-                langs.append(w.language)
-            
-    langs.sort(key = lambda l: l.name)
+    langs = {}
+    if profiles.needs_names(fields):
+        for p in places:
+            for w in p.names.all():
+                langs.setdefault(w.language.pk, w.language)
                 
     features.metadata = {
-        "langs": [model_to_dict(l) for l in langs],
-        "icons": get_icon_url_dict(),
+        "clustered": False,
+        "langs": _get_langs_metadata(langs, fields),
+        **get_icons_metadata(),
     }
+    features.metadata.update(extra_metadata)
     
-    features_json = geojson.dumps(features)
-    return HttpResponse(features_json, content_type='application/json; charset=utf-8')
\ No newline at end of file
+    return geojson.dumps(features), False
+
+def _get_places_geobuf(places, extra_metadata, zoom=None):
+    """
+    Compact binary (Geobuf) encoding of the places. Names, categories, icons and languages are dictionary-encoded:
+    each feature has the index of its first name, category and icon, and a list of language indexes (one per name).
+    The dictionaries are included as properties of the FeatureCollection.
+    """
+    if places.model is MapFeature:
+        rows = places.values_list('pk', 'location', 'category', 'icon', 'label', 'lang_ids')
+    else:
+        place_names = {}
+        words = Word.objects.filter(place__in=places).order_by('id').values_list('place_id', 'name', 'language_id')
+        for place_id, name, lang_id in words:
+            place_names.setdefault(place_id, []).append((name, lang_id))
+        rows = (
+            (pk, location, category, icon,
+             place_names[pk][0][0] if pk in place_names else '',
+             [lang_id for name, lang_id in place_names.get(pk, [])])
+            for pk, location, category, icon in places.values_list('pk', 'location', 'category', 'icon')
+        )
+
+    names, categories, icons, lang_ids = (geobuf.Dictionary() for i in range(4))
+    # points are not rounded for the zoom level (see lod.py), so the precision is at least that of points
+    encoder = geobuf.GeobufEncoder(precision=6 if zoom is None else max(lod.get_precision(zoom), 6))
+    for pk, location, category, icon, label, langs in rows:
+        encoder.add_feature(lod.to_geojson(location, zoom), {
+            'name': names.add(label),
+            'category': categories.add(category),
+            'icon': icons.add(icon),
+            'langs': [lang_ids.add(l) for l in langs],
+        }, pk)
+
+    langs = {l['id']: l for l in Language.objects.filter(id__in=lang_ids).values('id', 'name', 'colour')}
+    icon_urls = get_icon_url_dict()
+    metadata = {
+        'clustered': False,
+        'names': names,
+        'categories': categories,
+        'icons': [{'name': i, 'url': icon_urls.get(i, None)} for i in icons],
+        'langs': [langs[l] for l in lang_ids],
+    }
+    metadata.update(extra_metadata)
+    return encoder.encode(metadata)
+
+def _gzipped_response(request, body, content_type):
+    """ response for a gzip-compressed body (from the map cache), decompressed if the client can't handle it """
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(body, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(body), content_type=content_type)
+    patch_vary_headers(response, ('Accept-Encoding', ))
+    return response
+
+def _cached_map_data_response(request, body, content_type):
+    response = _gzipped_response(request, body, content_type)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept', ))
+    return response
+
+def _visibility(request):
+    """ the class of data which the user can see, for cache keys """
+    return 'auth' if request.user.is_authenticated else 'public'
+
+@login_required
+@condition(etag_func=_places_json_etag)
+@gzip_page
+def places_json(request):
+    """ basically just dump the database into JSON, with some optimisations for the map service """
+    if get_map_data_engine() == 'features':
+        # read from the denormalised table instead, it has the same fields for filtering
+        places = MapFeature.objects.all()
+    else:
+        places = Place.objects.filter(location__isnull=False)
+
+    if not request.user.is_authenticated:
+        places = places.filter(is_public=True)
+
+    bbox = None
+    zoom = None
+    sync_tiles = None
+    # parse request data
+    try:
+        data = _get_request_data(request)
+        b = data.get('bounds', None)
+        if b:
+            bbox = (float(b['sw']['lng']), float(b['sw']['lat']), float(b['ne']['lng']), float(b['ne']['lat']))
+
+        zoom = data.get('zoom', None)
+        if zoom is not None:
+            zoom = int(zoom)
+
+        clustered = zoom is not None and zoom < get_cluster_max_zoom()
+        sync = data.get('sync', None)
+        if sync is not None and not clustered:
+            # clusters summarise every place in the viewport, so they are not synchronised
+            sync_tiles = parse_sync_tiles(sync)
+
+        fields = profiles.get_fields(data.get('profile', None), data.get('fields', None))
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError, AttributeError):
+        logger.error('invalid request data')
+        return HttpResponseBadRequest()
+
+    # clusters are always sent as json
+    binary = not clustered and _wants_geobuf(request)
+    content_type = geobuf.CONTENT_TYPE if binary else JSON_CONTENT_TYPE
+
+    region = None
+    if request.method in ('GET', 'HEAD') and bbox and sync_tiles is None and get_cache() is not None:
+        # responses for the same area are shared: expand the bbox to the tiles used as the cache key
+        region = CachedRegion.for_bbox('data:%s:%s:%s:%s:%s' % (
+            _visibility(request), get_map_data_engine(), zoom, 'geobuf' if binary else 'json', ','.join(fields)), bbox)
+        bbox = region.bbox
+        body = region.get()
+        if body is not None:
+            return _cached_map_data_response(request, body, content_type)
+
+    if bbox:
+        bbox = geos.Polygon.from_bbox(bbox)
+        logger.debug('search bbox=%s' % bbox)
+        places = places.filter(location__bboverlaps=bbox)
+
+    if clustered:
+        features_json, streaming = _get_clustered_json(places, zoom), False
+    else:
+        extra_metadata = {}
+        if sync_tiles is not None:
+            # only send what has changed since the client last loaded each tile
+            extra_metadata['sync_token'] = new_sync_token()
+            deleted = get_deleted_place_ids(sync_tiles, public_only=not request.user.is_authenticated)
+            extra_metadata['deleted'] = deleted
+            # places which moved out of the tiles (or were hidden) are sent again if the client can still see them,
+            # after being removed by the client
+            places = filter_changed_places(places, sync_tiles, deleted)
+            # the client keeps these geometries at every zoom level, so they are not simplified for this one: level
+            # of detail only applies to requests without sync data (see lod.py)
+            zoom = None
+        if binary:
+            features_json, streaming = _get_places_geobuf(places, extra_metadata, zoom), False
+        else:
+            features_json, streaming = _get_places_json(places, extra_metadata, zoom, fields)
+
+    if region is not None:
+        if streaming:
+            features_json = ''.join(features_json)
+        return _cached_map_data_response(request, region.set(features_json), content_type)
+
+    return _map_data_response(features_json, streaming, content_type)
+
+def _get_legend(request):
+    """ the legend is needed for both the ETag and the response, only get it once per request """
+    if not hasattr(request, '_legend'):
+        request._legend = get_language_legend_json(public_only=not request.user.is_authenticated)
+    return request._legend
+
+def _legend_etag(request):
+    return _get_legend(request)[1]
+
+@login_required
+@condition(etag_func=_legend_etag)
+def languages_json(request):
+    """ languages with their colours and place/name counts, for the map filter control """
+    content, etag = _get_legend(request)
+    response = HttpResponse(content, content_type=JSON_CONTENT_TYPE)
+    patch_cache_control(response, private=True, max_age=get_legend_max_age())
+    return response
+
+@login_required
+def search_json(request):
+    """
+    search/autocomplete for place names, languages and place types: q=query, limit=number of results of each kind,
+    and optionally bbox=west,south,east,north to rank places in the viewport first
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), MAX_SEARCH_RESULTS))
+        bbox = request.GET.get('bbox', None)
+        if bbox:
+            bbox = [float(v) for v in bbox.split(',')]
+            if len(bbox) != 4:
+                raise ValueError('bbox needs 4 values')
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    if len(query) < MIN_SEARCH_QUERY_LENGTH:
+        results = {'places': [], 'languages': [], 'categories': []}
+    else:
+        results = search(query, bbox, limit, public_only=not request.user.is_authenticated)
+    return HttpResponse(json.dumps(results), content_type=JSON_CONTENT_TYPE)
+
+@login_required
+@gzip_page
+def nearest_json(request):
+    """
+    the places nearest to lng=, lat= (eg. from a GPS fix) as a FeatureCollection, nearest first with their distance
+    in metres. Optional: limit=, max_distance= (metres), lang= (language id) and category=
+    """
+    try:
+        point = geos.Point(float(request.GET['lng']), float(request.GET['lat']), srid=4326)
+        limit = max(1, min(int(request.GET.get('limit', 10)), MAX_NEAREST))
+        max_distance = request.GET.get('max_distance', None)
+        max_distance = float(max_distance) if max_distance else None
+        language_id = request.GET.get('lang', None)
+        language_id = int(language_id) if language_id else None
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest()
+
+    fields = profiles.PROFILES['popup']
+    places = _project_places(Place.objects.all(), fields)
+    if not request.user.is_authenticated:
+        places = places.filter(is_public=True)
+    places = nearest_places(point, limit, places, max_distance, language_id, request.GET.get('category', None))
+
+    features = []
+    for p in places:
+        feature = _get_place(p, fields=fields)
+        feature.properties['distance'] = p.distance
+        features.append(feature)
+    return HttpResponse(geojson.dumps(geojson.FeatureCollection(features)), content_type=JSON_CONTENT_TYPE)
+
+@login_required
+@gzip_page
+def place_tile(request, z, x, y):
+    """ Mapbox Vector Tile containing the places within tile z/x/y """
+    if not is_valid_tile(z, x, y):
+        return HttpResponseBadRequest()
+
+    content_type = 'application/vnd.mapbox-vector-tile'
+    public_only = not request.user.is_authenticated
+    if get_cache() is not None:
+        region = CachedRegion.for_tile('tile:%s' % _visibility(request), z, x, y)
+        body = region.get()
+        if body is None:
+            body = region.set(get_place_tile(z, x, y, public_only=public_only))
+        response = _gzipped_response(request, body, content_type)
+    else:
+        response = HttpResponse(get_place_tile(z, x, y, public_only=public_only), content_type=content_type)
+    patch_cache_control(response, private=True, max_age=get_tile_max_age())
+    return response
+
+@never_cache
+def metrics(request):
+    """ request timings and database pool statistics in the Prometheus text format (see featuremap.metrics) """
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in get_metrics_ips()):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'featuremap.metrics.TimingMiddleware',  # Server-Timing header and /metrics, keep it first to time everything
+    'featuremap.dbpool.ViewLabelMiddleware',  # count pooled database connection use by view
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,7 +61,9 @@ ROOT_URLCONF = 'placesdb.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django template backend, with rendering time included in the request metrics (featuremap.metrics)
+        'BACKEND': 'featuremap.metrics.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': ['src/templates', django.__path__[0] + '/forms/templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,20 +83,56 @@ WSGI_APPLICATION = 'placesdb.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
-
+# The featuremap.dbpool engine is PostGIS with an in-process connection pool (see featuremap/dbpool/__init__.py):
+# with CONN_MAX_AGE = 0 each request borrows a connection and returns it when it finishes, so requests don't pay for
+# connecting to PostgreSQL. POOL MAX_SIZE is per worker process, and should be at least the number of threads which
+# use the database in each worker:
+#   gunicorn sync workers: 1 (or use the postgis engine with CONN_MAX_AGE = 600 instead of the pool)
+#   gunicorn gthread workers: --threads
+#   uvicorn / ASGI: ASYNC_DB_THREADS with ASYNC_VIEWS = True, 1 otherwise (sync views share one thread)
+#   mod_wsgi daemon mode: threads=
+# Keep workers * MAX_SIZE below PostgreSQL's max_connections.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        'ENGINE': 'featuremap.dbpool',
         'NAME': 'placedb',
         'USER': 'placedb',
         'PASSWORD': '',
         'HOST': 'localhost',
         'PORT': '', # blank for default
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': 8,  # connections per worker process
+            'TIMEOUT': 10,  # seconds a request waits for a free connection before failing
+            'HEALTH_CHECK_AFTER': 30,  # check connections idle for longer than this (seconds) with SELECT 1
+            'MAX_IDLE': 600,  # close connections idle for longer than this (seconds)
+        },
     }
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# MAX_ENTRIES bounds the memory used by the map data cache. Use the FileBasedCache backend to share the cache
+# between worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # the map data cache must be shared by all the worker processes, which invalidate it when places change: use a
+    # file based cache (on the same server), memcached or redis. A LocMemCache is checked against the data version
+    # in the database for every response instead, so any change invalidates all of it (see featuremap.cache)
+    'map_data': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(ROOT_DIR, 'cache', 'map_data'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 AUTH_USER_MODEL = 'featuremap.UserWithToken'
@@ -152,9 +192,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # logs every SQL query at DEBUG, which slows down every request: use /metrics or the Server-Timing
+        # header to see query counts and times instead
         'django.db': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': 'INFO',
             'propagate': True,
         },
     },
@@ -163,9 +205,69 @@ LOGGING = {
 # local directory where place icons are stored (relative to STATIC_ROOT)
 ICONS_DIR = 'images/imwicons/'
 
+# icon sprite atlas, built from ICONS_DIR by "manage.py build_icon_sprite" after collectstatic (relative to STATIC_ROOT).
+# If it has not been built, map clients load each icon separately.
+ICON_SPRITE_DIR = 'images/sprites/'
+
 # Base URLs for map data requests
 DETAIL_URL = 'detail/'
 
+# Browser cache lifetime (seconds) for vector tiles served from /tiles/<z>/<x>/<y>.pbf
+TILE_MAX_AGE = 300
+
+# Browser cache lifetime (seconds) for the language legend (/data/languages/), which is revalidated by ETag after that
+LEGEND_MAX_AGE = 3600
+
+# Map data requests with zoom below CLUSTER_MAX_ZOOM get places aggregated into grid cells of
+# CLUSTER_CELL_SIZE screen pixels
+CLUSTER_MAX_ZOOM = 10
+CLUSTER_CELL_SIZE = 64
+
+# How map data responses are generated: 'python' serialises model instances using the ORM,
+# 'stream' does the same but streams the response in chunks of MAP_DATA_CHUNK_SIZE places (flat memory use),
+# 'sql' builds the GeoJSON document in a single PostgreSQL query (much faster for large viewports)
+# 'features' reads a compact version of the data from the denormalised MapFeature table (fastest, but does not include
+# metadata or media. Run `manage.py refresh_features` once after enabling it to populate the table)
+MAP_DATA_ENGINE = 'python'
+MAP_DATA_CHUNK_SIZE = 500
+
+# Map clients keep track of which data they have loaded using tiles of this zoom level. Should be no more than
+# CLUSTER_MAX_ZOOM, otherwise clients will send a lot of tiles with each request.
+SYNC_TILE_ZOOM = 10
+# Seconds subtracted from sync tokens, so that places written by transactions which commit up to this long after
+# they were written are still sent to clients (see featuremap.sync)
+SYNC_TOKEN_MARGIN = 300
+
+# Cache used for map data responses (see CACHES below), or None to disable. Cached responses are invalidated
+# for the tiles (of zoom level up to CACHE_TILE_ZOOM) covering each changed place.
+MAP_CACHE = 'map_data'
+CACHE_TILE_ZOOM = 10
+
+# Use the async versions of the map data, detail, tile, search and nearest views (for ASGI servers such as uvicorn,
+# see placesdb/asgi.py). Their database work runs in a pool of ASYNC_DB_THREADS threads per worker process, each with
+# its own database connection. Leave off for WSGI servers, which already run each request in its own thread.
+ASYNC_VIEWS = False
+ASYNC_DB_THREADS = 8
+
+# How CSV files are imported (admin site and manage.py import_csv): 'row' saves each place and name separately,
+# 'bulk' maps batches of rows and writes them with a few bulk queries per batch (much faster for large files),
+# 'copy' copies the whole file into the database with COPY and imports it with set-based SQL (fastest for files with
+# millions of rows, for column maps of places and names only). manage.py import_csv --engine parallel is the bulk
+# engine with the rows mapped through the column map (and coordinates transformed) in IMPORT_WORKERS forked
+# processes while the main process writes them (not for the admin site, which can't fork worker processes)
+IMPORT_ENGINE = 'bulk'
+
+# Worker processes for manage.py import_csv --engine parallel (default: one per CPU)
+#IMPORT_WORKERS = 8
+
+# Add a Server-Timing header to each response, with the time spent in SQL queries, templates and the rest of the
+# view (shown by browser developer tools)
+SERVER_TIMING = True
+
+# Client addresses allowed to read the Prometheus metrics at /metrics (staff users can always read them). Metrics are
+# kept by each worker process.
+METRICS_IPS = ['127.0.0.1', '::1']
+
 # Title of map page, admin site, etc
 SITE_NAME = 'Maps Page'
 SITE_VERSION = '1.0.1'
\ No newline at end of file
@@ -302,6 +302,23 @@ var CanvasIconLayer = (L.Layer ? L.Layer : L.Class).extend({
 
         var options = marker.options.icon.options;
 
+        if (options.spriteRect) {
+
+            // icon is part of a sprite atlas: [x, y, width, height] within the image
+            this._context.drawImage(
+                marker.canvas_img,
+                options.spriteRect[0],
+                options.spriteRect[1],
+                options.spriteRect[2],
+                options.spriteRect[3],
+                pointPos.x - options.iconAnchor[0],
+                pointPos.y - options.iconAnchor[1],
+                options.iconSize[0],
+                options.iconSize[1]
+            );
+            return;
+        }
+
         this._context.drawImage(
             marker.canvas_img,
             pointPos.x - options.iconAnchor[0],
@@ -9,6 +9,19 @@ window.rbush = RBush;
  * placeCache is populated with markers for each place, keyed by feature.properties.id */
 var placeCache = {}, iconsList = {}, langCache = {};
 
+/* popup html for places, prefetched in batches for newly loaded markers, keyed by place id */
+var detailCache = {};
+
+// most places to prefetch the details of in one request, see featuremap/details.py
+const MAX_DETAIL_BATCH = 100;
+
+/* url of the icon sprite manifest which iconsList was built from, if the server has an icon sprite */
+var iconManifestUrl = null;
+
+/* sync tokens for each tile (at zoom sync_tile_zoom) which has been loaded, keyed by "z/x/y".
+ * the server only sends places which have changed since the token was issued */
+var tileTokens = {};
+
 // initialise the label engine
 var labelRenderer = new L.LabelTextCollision({
     collisionFlg: true, // don't draw overlapping names
@@ -23,6 +36,10 @@ var iconLayer = L.canvasIconLayer({
 // list of icon markers which have yet to be added to the map, after geoJSON calls
 var newIconMarkers = [];
 
+// clusters returned by the server at low zoom levels, replaced on every data request
+var clusterLayer = L.layerGroup();
+var showingClusters = false;
+
 // initialise geoJSON parser
 var geoJsonLayer = L.geoJSON(null, {
     pointToLayer: function (point, latLng) {
@@ -55,7 +72,7 @@ var geoJsonLayer = L.geoJSON(null, {
         // create marker with icon & store for later adding to map
         var iconMarker = L.marker(layer.getLatLng(), {
             keyboard: false,
-            icon: iconsList[feature.properties.icon],
+            icon: getFeatureIcon(feature.properties),
         });
         iconMarker.feature = feature;
 
@@ -79,20 +96,73 @@ var geoJsonLayer = L.geoJSON(null, {
     },
 });
 
+// returns the icon for a feature, tinted with the colour of its first language if the sprite has that tint
+function getFeatureIcon(props) {
+    var names = getFeatureNames(props);
+    if (names.length && names[0].lang.colour) {
+        var tinted = iconsList[props.icon + '|' + names[0].lang.colour.toLowerCase()];
+        if (tinted)
+            return tinted;
+    }
+    return iconsList[props.icon];
+}
+
+// loads the icons from the sprite manifest (see featuremap/sprites.py), then calls callback
+function loadIconManifest(url, callback) {
+    $.getJSON(url, function (manifest) {
+        iconManifestUrl = url;
+        var baseUrl = new URL(url, window.location.href);
+        var images = {'': manifest.image};
+        for (var colour in manifest.tints)
+            images['|' + colour] = manifest.tints[colour];
+
+        for (var suffix in images) {
+            var imageUrl = new URL(images[suffix], baseUrl).href;
+            for (var iconName in manifest.icons) {
+                iconsList[iconName + suffix] = L.icon({
+                    iconUrl: imageUrl,
+                    iconSize: [32, 32],
+                    iconAnchor: [16, 31],
+                    // position of the icon in the atlas, see leaflet.canvas-markers.js
+                    spriteRect: manifest.icons[iconName],
+                });
+            }
+        }
+        callback();
+    }).fail(function (jqxhr, textStatus, error) {
+        console.log('failed to load icon manifest: ' + textStatus);
+        loaderControl.setState('error', textStatus);
+    });
+}
+
+// returns the names of a feature, as a list of {name, lang: {id, colour}}
+function getFeatureNames(props) {
+    if (props.names)
+        return props.names;
+
+    // compact format (from the map feature table) only has the language id & colour for each name
+    var names = [];
+    for (var i = 0; i < props.langs.length; i++) {
+        names.push({name: i == 0 ? props.label : '', lang: {id: props.langs[i], colour: props.colours[i]}});
+    }
+    return names;
+}
+
 // updates feature visibility/style based on filter selections
 function reevaluateVisibilityCriteria(feature_id) {
     if (!feature_id || (!feature_id in placeCache)) return;
 
     var langs = filterControl.getRowStatus('lang');
     var f = placeCache[feature_id].feature.properties;
+    var names = getFeatureNames(f);
     var visibleLang = null, numVisible = 0;
 
     // find first language which is visible
-    for (var i = 0; i < f.names.length; i++) {
-        if (!(f.names[i].lang.id in langs)) continue;
-        if (langs[f.names[i].lang.id]) {
+    for (var i = 0; i < names.length; i++) {
+        if (!(names[i].lang.id in langs)) continue;
+        if (langs[names[i].lang.id]) {
             if (visibleLang === null)
-                visibleLang = f.names[i].lang;
+                visibleLang = names[i].lang;
             numVisible++;
         }
     }
@@ -135,6 +205,38 @@ function setFeatureVisibility(db_id, visible) {
     return true;
 }
 
+// remove a place from the map and the cache, eg. when it is deleted or replaced by an updated version
+function removePlace(db_id) {
+    // the place has changed or been deleted
+    delete detailCache[db_id];
+    if (!(db_id in placeCache)) return;
+    setFeatureVisibility(db_id, false);
+    delete placeCache[db_id];
+}
+
+// list of "z/x/y" tile keys at zoom sync_tile_zoom covering the given bounds, or null if there are more than the
+// server accepts (max_sync_tiles)
+function getSyncTiles(bbox) {
+    var z = sync_tile_zoom, n = Math.pow(2, z);
+    var clamp = function (v) { return Math.min(Math.max(v, 0), n - 1); };
+    var tileX = function (lng) { return clamp(Math.floor((lng + 180) / 360 * n)); };
+    var tileY = function (lat) {
+        var r = lat * Math.PI / 180;
+        return clamp(Math.floor((1 - Math.log(Math.tan(r) + 1 / Math.cos(r)) / Math.PI) / 2 * n));
+    };
+    var x0 = tileX(bbox.getWest()), x1 = tileX(bbox.getEast());
+    var y0 = tileY(bbox.getNorth()), y1 = tileY(bbox.getSouth());
+    if ((x1 - x0 + 1) * (y1 - y0 + 1) > max_sync_tiles)
+        return null;
+    var tiles = [];
+    for (var x = x0; x <= x1; x++) {
+        for (var y = y0; y <= y1; y++) {
+            tiles.push(z + "/" + x + "/" + y);
+        }
+    }
+    return tiles;
+}
+
 function forceRedraw() {
     iconLayer.redraw();
     //labelRenderer._reset();
@@ -148,9 +250,68 @@ function refreshAllVisibility() {
     forceRedraw();
 }
 
-function handleGeoJson(data, status, jqxhr) {
+// returns text label for a cluster feature
+function getClusterLabel(feature) {
+    var p = feature.properties;
+    if (p.names.length == 0)
+        return "" + p.count;
+    return p.names[0] + (p.count > 1 ? " (+" + (p.count - 1) + ")" : "");
+}
+
+function showClusters(visible) {
+    if (visible == showingClusters) return;
+    showingClusters = visible;
+    if (visible) {
+        openInfo(null);
+        map.removeLayer(iconLayer);
+        map.removeLayer(geoJsonLayer);
+        map.addLayer(clusterLayer);
+    } else {
+        clusterLayer.clearLayers();
+        map.removeLayer(clusterLayer);
+        map.addLayer(iconLayer);
+        map.addLayer(geoJsonLayer);
+    }
+}
+
+function handleClusters(features) {
+    // draw one circle per cluster, sized by the number of places it contains
+    clusterLayer.clearLayers();
+    for (var i = 0; i < features.length; i++) {
+        var f = features[i];
+        var latLng = L.GeoJSON.coordsToLatLng(f.geometry.coordinates);
+        var lang = f.properties.langs.length == 1 ? langCache[f.properties.langs[0]] : null;
+        var marker = L.circleMarker(latLng, {
+            renderer: labelRenderer,
+            pane: 'markerPane',
+            radius: Math.min(6 + 2 * Math.log2(f.properties.count), 20),
+            stroke: true,
+            color: '#fff',
+            weight: 1,
+            fill: true,
+            fillColor: lang ? lang.colour : '#ccc',
+            fillOpacity: 0.8,
+            text: getClusterLabel(f),
+        });
+        marker.on('click', function (e) {
+            // zoom in on the cluster to see the places inside it
+            map.setView(e.target.getLatLng(), map.getZoom() + 2);
+        });
+        clusterLayer.addLayer(marker);
+    }
+}
+
+function handleGeoJson(data, status, jqxhr, syncTiles) {
     // process data returned from the geojson web service (expects a FeatureCollection)
 
+    if (data.metadata.icon_manifest && data.metadata.icon_manifest != iconManifestUrl) {
+        // the icons have to be ready before any markers are made
+        loadIconManifest(data.metadata.icon_manifest, function () {
+            handleGeoJson(data, status, jqxhr, syncTiles);
+        });
+        return;
+    }
+
     /* process icons and prepare them for use on the map */
     for (var iconName in data.metadata.icons) {
         if (iconName in iconsList)
@@ -170,6 +331,26 @@ function handleGeoJson(data, status, jqxhr) {
         filterControl.addRow('lang', lang.id, lang.name, lang.colour, null, lang);
     }
 
+    showClusters(data.metadata.clustered);
+    if (data.metadata.clustered) {
+        handleClusters(data.features);
+        loaderControl.setState('okay', "Loaded " + data.features.length + " clusters");
+        return;
+    }
+
+    if (data.metadata.sync_token) {
+        for (var i = 0; i < syncTiles.length; i++) {
+            tileTokens[syncTiles[i]] = data.metadata.sync_token;
+        }
+        for (var i = 0; i < data.metadata.deleted.length; i++) {
+            removePlace(data.metadata.deleted[i]);
+        }
+        // places which have changed are replaced by the new version
+        for (var i = 0; i < data.features.length; i++) {
+            removePlace(data.features[i].properties.id);
+        }
+    }
+
     if (data.features.length == 0) {
         console.log("No features returned from server");
         loaderControl.setState('okay');
@@ -186,22 +367,52 @@ function handleGeoJson(data, status, jqxhr) {
     // add the icon markers to the map, use array for optimal performance
     iconLayer.addLayers(newIconMarkers);
     console.log(newIconMarkers);
+    prefetchDetails(newIconMarkers.map(function (m) { return m.feature.properties.id; }));
     newIconMarkers = [];
     
     console.log(data.metadata);
 }
 
+// adds every language with places on the map to the filter control, with the number of places
+function loadLegend() {
+    $.getJSON(legend_url, function (data) {
+        for (var i = 0; i < data.langs.length; i++) {
+            var lang = data.langs[i];
+            if (lang.id in langCache)
+                continue;
+            langCache[lang.id] = lang;
+            filterControl.addRow('lang', lang.id, lang.name + ' (' + lang.num_places + ')', lang.colour, null, lang);
+        }
+    });
+}
+
+// loads the popup html of places in the background, so that clicking on their markers is instant
+function prefetchDetails(ids) {
+    ids = ids.filter(function (id) { return !(id in detailCache); });
+    if (ids.length == 0 || ids.length > MAX_DETAIL_BATCH)
+        return; // too many to be worth it, details are loaded when clicked
+    $.getJSON(detail_batch_url, {ids: ids.join(',')}, function (data) {
+        for (var id in data.places)
+            detailCache[id] = data.places[id];
+    });
+}
+
 function cleanReloadViewport() {
     iconLayer.clearLayers();
     geoJsonLayer.clearLayers();
+    clusterLayer.clearLayers();
     openInfo(null);
     placeCache = {};
+    tileTokens = {};
     newIconMarkers = [];
     filterControl.clearRows();
     langCache = {};
     iconsList = {};
+    iconManifestUrl = null;
+    detailCache = {};
     forceRedraw();
 
+    loadLegend();
     reloadViewport();
 }
 
@@ -226,21 +437,37 @@ function reloadViewport() {
     var bbox = map.getBounds();
     loaderControl.setState('loading');
 
+    // clusters are not synchronised, and a large viewport has too many tiles: the places in it are all sent
+    var syncTiles = map.getZoom() < cluster_max_zoom ? null : getSyncTiles(bbox);
+    var sync = null;
+    if (syncTiles) {
+        sync = {};
+        for (var i = 0; i < syncTiles.length; i++) {
+            // tell server which tiles we already have, it sends only what changed since then
+            sync[syncTiles[i]] = tileTokens[syncTiles[i]] || null;
+        }
+    }
+
     var data = {
-        // tell server not to send us IDs of 
-        alreadyLoaded: Object.keys(placeCache),
+        zoom: map.getZoom(),
+        // only what is needed to draw and filter markers, details are loaded when a marker is clicked
+        profile: 'popup',
         bounds: {
             ne: bbox.getNorthEast(),
             sw: bbox.getSouthWest(),
         },
     };
+    if (sync)
+        data.sync = sync;
     $.ajax(data_url, { /* the data URL is passed through from the app settings */
         cache: false,
         method: 'POST',
         headers: {'X-CSRFToken': csrftoken},
         data: JSON.stringify(data),
         dataType: "json",
-        success: handleGeoJson,
+        success: function (data, status, jqxhr) {
+            handleGeoJson(data, status, jqxhr, syncTiles);
+        },
         error: function (jqxhr, textStatus, error) {
             console.log(jqxhr);
             loaderControl.setState('error', textStatus);
@@ -250,10 +477,10 @@ function reloadViewport() {
 
 // returns text label for given Feature
 function getLabel(marker) {
-    var f = marker.feature;
+    var names = getFeatureNames(marker.feature.properties);
 
-    if (f.properties.names.length > 0) {
-        return f.properties.names[0].name;
+    if (names.length > 0) {
+        return names[0].name;
     } else {
         return "";
     }
@@ -315,27 +542,38 @@ function openInfo(layer) {
         }).setLatLng(infoLayer.getLatLng()).setContent(htmlContent[0]).openOn(map);
     }
 
+    function showDetail(data) {
+        if (!infoLayer) return;
+        var tempDiv = $("#tempdiv");
+        var html = tempDiv.append($.parseHTML(data)).children();
+
+        var imgs = $("img.media-external", html);
+        if (imgs.length > 0) {
+            var numLoaded = 0;
+            imgs.on("load", function () {
+                console.log("imgs loaded: " + numLoaded);
+                if (++numLoaded == imgs.length) {
+                    // open popup only after images are loaded
+                    doPopup(html);
+                }
+            });
+        } else {
+            // open popup immediately, nothing more to load
+            doPopup(html);
+        }
+    }
+
+    var id = layer.feature.properties.id;
+    if (id in detailCache) {
+        showDetail(detailCache[id]);
+        return;
+    }
+
     loaderControl.setState('loading');
-    pendingXhr = $.ajax(detail_url_base + layer.feature.properties.id + "/", {
+    pendingXhr = $.ajax(detail_url_base + id + "/", {
         success: function (data, status, jqxhr) {
-            if (!infoLayer) return;
-            var tempDiv = $("#tempdiv");
-            var html = tempDiv.append($.parseHTML(data)).children();
-
-            var imgs = $("img.media-external", html);
-            if (imgs.length > 0) {
-                var numLoaded = 0;
-                imgs.on("load", function () {
-                    console.log("imgs loaded: " + numLoaded);
-                    if (++numLoaded == imgs.length) {
-                        // open popup only after images are loaded
-                        doPopup(html);
-                    }
-                });
-            } else {
-                // open popup immediately, nothing more to load
-                doPopup(html);
-            }
+            detailCache[id] = data;
+            showDetail(data);
             loaderControl.setState('okay');
         },
         error: function (jqxhr, textStatus, error) {
@@ -394,6 +632,7 @@ $(function () {
         loadUrl: about_url, /* passed from the app settings */
     }).addTo(map);
 
+    loadLegend();
     reloadViewport();
     
     map.on('zoomend moveend', reloadViewport);